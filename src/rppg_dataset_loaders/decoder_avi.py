@@ -0,0 +1,37 @@
+import struct
+
+from . import utils_avi
+from .decoder_base import VideoDecoder
+
+
+class AVIDecoder(VideoDecoder):
+    """ Decoder of uncompressed and MJPEG AVI files without subprocesses, see `utils_avi.AVIReader` """
+
+    # abstract - implementations
+
+    def get_is_supported(self):
+        if not str(self.get_video_path()).lower().endswith('.avi'):
+            return False
+        try:
+            return self.avi_reader.get_is_supported()
+        except (OSError, ValueError, struct.error):
+            return False
+
+    def _get_metadata(self):
+        return self.avi_reader.get_metadata()
+
+    def _get_frame_timestamps_and_key_frame_indices(self):
+        return self.avi_reader.get_frame_timestamps(), self.avi_reader.get_key_frame_indices()
+
+    def _read(self, frame_index_start, frames_count, crop_rect, segments_count):
+        return [self.avi_reader.get_frame(frame_index, crop_rect)
+                for frame_index in range(frame_index_start, frame_index_start + frames_count)]
+
+    def _close(self):
+        self.avi_reader.close()
+
+    # public
+
+    def __init__(self, video_path):
+        super().__init__(video_path)
+        self.avi_reader = utils_avi.AVIReader(video_path)
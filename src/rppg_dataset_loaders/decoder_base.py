@@ -0,0 +1,203 @@
+""" Video decoder backends used by `VideoChannel` """
+
+import importlib
+from enum import Enum
+from fractions import Fraction
+
+import numpy
+
+from . import utils_trace
+
+
+class DecoderTitle(Enum):
+    """
+    Titles of supported video decoder backends
+    """
+    FFmpeg = 'ffmpeg'  # ffmpeg / ffprobe command line tools, one process per request
+    PyAV = 'pyav'      # in-process libav binding, requires `av` package
+    AVI = 'avi'        # direct reader of uncompressed and MJPEG AVI files
+
+
+decoder_title_to_class = {DecoderTitle.FFmpeg: ('decoder_ffmpeg', 'FFmpegDecoder'),
+                          DecoderTitle.PyAV: ('decoder_pyav', 'PyAVDecoder'),
+                          DecoderTitle.AVI: ('decoder_avi', 'AVIDecoder'),
+                          }
+
+
+def import_decoder(decoder_title: DecoderTitle) -> 'VideoDecoder.__class__':
+    """ Imports decoder class on demand, so optional dependencies of other decoders are not required """
+    module_name_rel, class_name = decoder_title_to_class[DecoderTitle(decoder_title)]
+    decoder_module = importlib.import_module(f"{__package__}.{module_name_rel}", package=None)
+    return decoder_module.__dict__[class_name]
+
+
+def crop_and_resize_frames(frames, boxes, size):
+    """ Crops frames by (frames, 4) `x`, `y`, `w`, `h` boxes and resizes them to (width, height) `size` """
+    frames = numpy.asarray(frames)
+    boxes = numpy.asarray(boxes, dtype=numpy.int64)
+    width, height = size
+    rows = boxes[:, 1:2] + ((numpy.arange(height) + 0.5) * boxes[:, 3:4] / height).astype(numpy.int64)
+    cols = boxes[:, 0:1] + ((numpy.arange(width) + 0.5) * boxes[:, 2:3] / width).astype(numpy.int64)
+    return frames[numpy.arange(len(frames))[:, None, None], rows[:, :, None], cols[:, None, :]]
+
+
+class VideoDecoder(object):
+    """
+    Decoder of the first video stream of a video file into RGB frames.
+    Frames are addressed by indices in the order of their presentation timestamps.
+    """
+
+    # private
+
+    def _prv_get_frame_index_range(self, frame_index_start, frames_count):
+        frame_index_start = max(0, frame_index_start)
+        frames_count = max(0, min(frames_count, self.get_frames_count() - frame_index_start))
+        return frame_index_start, frames_count
+
+    # public
+
+    # frames count to read ahead by `VideoChannel` cache, or None if reads of single frames are cheap
+    cache_min_page_size = None
+    # False if frames are cropped in advance and `crop_rect` of reads is ignored
+    supports_crop_rect = True
+
+    def __init__(self, video_path):
+        self.video_path = video_path
+        self.metadata = None
+        self.frame_timestamps = None
+        self.key_frame_indices = None
+        self.frame_index = 0
+
+    def get_video_path(self):
+        return self.video_path
+
+    def get_metadata(self):
+        """ Video stream metadata in the format of `ffprobe -show_streams` """
+        if self.metadata is None:
+            self.metadata = self._get_metadata()
+        return self.metadata
+
+    def get_time_base(self):
+        return Fraction(self.get_metadata()['time_base'])
+
+    def get_video_size_with_rotation(self):
+        metadata = self.get_metadata()
+        rotation = 0
+        width = int(metadata['width'])
+        height = int(metadata['height'])
+        if 'tags' in metadata:
+            tags = metadata['tags']
+            if 'rotate' in tags:
+                rotation = int(tags['rotate'])
+        while rotation < 0:
+            rotation += 360
+        while rotation > 360:
+            rotation -= 360
+        if rotation != 0 and rotation != 180:
+            width, height = height, width
+        return {
+            'width': width,
+            'height': height,
+            'rotation': rotation,
+        }
+
+    def get_frame_shape(self, crop_rect=None):
+        if crop_rect is not None:
+            return crop_rect['h'], crop_rect['w'], 3
+        video_size_with_rotation = self.get_video_size_with_rotation()
+        return video_size_with_rotation['height'], video_size_with_rotation['width'], 3
+
+    def get_source_rect(self):
+        """ Area of video frames decoded frames are scaled from, if `crop_rect` is not supported """
+        return None
+
+    def get_frame_timestamps(self):
+        """ Presentation timestamps of frames, in seconds """
+        if self.frame_timestamps is None:
+            self.frame_timestamps, self.key_frame_indices = self._get_frame_timestamps_and_key_frame_indices()
+        return self.frame_timestamps
+
+    def get_key_frame_indices(self):
+        if self.key_frame_indices is None:
+            self.frame_timestamps, self.key_frame_indices = self._get_frame_timestamps_and_key_frame_indices()
+        return self.key_frame_indices
+
+    def get_frames_count(self):
+        return len(self.get_frame_timestamps())
+
+    def get_segments(self, frame_index_start, frames_count, segments_count):
+        """ Splits frame range into at most `segments_count` (start, count) segments at key frames """
+        if segments_count <= 1:
+            return [(frame_index_start, frames_count)]
+        frame_index_end = frame_index_start + frames_count
+        key_frame_indices = numpy.asarray(self.get_key_frame_indices(), dtype=numpy.int64)
+        key_frame_indices = key_frame_indices[(key_frame_indices > frame_index_start) &
+                                              (key_frame_indices < frame_index_end)]
+        if len(key_frame_indices) == 0:
+            return [(frame_index_start, frames_count)]
+        # snap evenly spaced boundaries to the nearest key frames
+        boundaries_even = frame_index_start + numpy.arange(1, segments_count) * frames_count / segments_count
+        nearest = numpy.abs(key_frame_indices[None, :] - boundaries_even[:, None]).argmin(axis=1)
+        boundaries = [frame_index_start] + sorted(set(key_frame_indices[nearest].tolist())) + [frame_index_end]
+        return [(boundaries[i], boundaries[i + 1] - boundaries[i]) for i in range(len(boundaries) - 1)]
+
+    def seek(self, frame_index):
+        """ Sets index of the frame to be returned first by the next `read` """
+        self.frame_index = frame_index
+
+    def read(self, frames_count, crop_rect=None, segments_count=1):
+        """ Reads frames from the current position and advances it, less frames at the end of the video """
+        frame_index_start, frames_count = self._prv_get_frame_index_range(self.frame_index, frames_count)
+        frames = self._read(frame_index_start, frames_count, crop_rect, segments_count)
+        self.frame_index = frame_index_start + len(frames)
+        return frames
+
+    def get_frames(self, frame_index_start, frames_count, crop_rect=None, segments_count=1):
+        self.seek(frame_index_start)
+        return self.read(frames_count, crop_rect, segments_count)
+
+    def get_frames_resized(self, frame_index_start, frames_count, crop_rect, size):
+        """ Frames cropped by `crop_rect` and resized to (width, height) `size` """
+        frame_index_start, frames_count = self._prv_get_frame_index_range(frame_index_start, frames_count)
+        return self._read_resized(frame_index_start, frames_count, crop_rect, size)
+
+    def iter_frames(self, frame_index_start, frames_count, chunk_frames_count, crop_rect=None, size=None):
+        """ Generator of chunks of frames; frames downscaled to `size` by area averaging are float32 """
+        frame_index_start, frames_count = self._prv_get_frame_index_range(frame_index_start, frames_count)
+        return self._iter_frames(frame_index_start, frames_count, chunk_frames_count, crop_rect, size)
+
+    def close(self):
+        self._close()
+
+    # abstract - to override
+
+    def get_is_supported(self):  # bool, checked before auto-selection of decoder
+        return True
+
+    def _get_metadata(self):  # dict { }
+        raise NotImplementedError('abstract method is not overridden')
+
+    def _get_frame_timestamps_and_key_frame_indices(self):  # list, list
+        raise NotImplementedError('abstract method is not overridden')
+
+    def _read(self, frame_index_start, frames_count, crop_rect, segments_count):  # array or list of frames
+        raise NotImplementedError('abstract method is not overridden')
+
+    def _read_resized(self, frame_index_start, frames_count, crop_rect, size):
+        frames = self.get_frames(frame_index_start, frames_count, crop_rect)
+        height, width = self.get_frame_shape(crop_rect)[:2]
+        boxes = numpy.tile(numpy.asarray([0, 0, width, height], dtype=numpy.int64), (len(frames), 1))
+        return crop_and_resize_frames(frames, boxes, size)
+
+    def _iter_frames(self, frame_index_start, frames_count, chunk_frames_count, crop_rect, size):
+        frame_index_end = frame_index_start + frames_count
+        for chunk_index_start in range(frame_index_start, frame_index_end, chunk_frames_count):
+            frames_count = min(chunk_frames_count, frame_index_end - chunk_index_start)
+            frames = self.get_frames(chunk_index_start, frames_count, crop_rect)
+            if len(frames) > 0:
+                yield frames if size is None else utils_trace.get_area_downscaled(frames, size)
+            if len(frames) < frames_count:
+                return
+
+    def _close(self):
+        return
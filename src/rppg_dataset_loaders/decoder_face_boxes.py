@@ -0,0 +1,130 @@
+""" Cropping of video frames by a track of face boxes, which may change from frame to frame """
+
+import numpy
+
+from .decoder_base import VideoDecoder
+
+
+def load_face_boxes(path, frames_count, frame_width, frame_height):
+    """ Loads (frames_count, 4) `x`, `y`, `w`, `h` face boxes of `x y w h` or `index count x y w h` lines """
+    boxes = numpy.tile(numpy.asarray([0, 0, frame_width, frame_height], dtype=numpy.int64), (frames_count, 1))
+    with open(path, 'rt', encoding='utf8') as boxes_file:
+        rows = [line.split() for line in boxes_file if line.strip()]
+    if len(rows) == 0:
+        rows = numpy.zeros((0, 4), dtype=numpy.int64)  # empty track, all frames get the whole frame box
+    else:
+        rows = numpy.asarray(rows, dtype=numpy.float64).round().astype(numpy.int64).reshape(len(rows), -1)
+    if rows.shape[1] == 4:
+        boxes[:len(rows)] = rows[:frames_count]
+    elif rows.shape[1] == 6:
+        for frame_index_start, segment_frames_count, x, y, w, h in rows:
+            boxes[frame_index_start: frame_index_start + segment_frames_count] = (x, y, w, h)
+    else:
+        raise ValueError(f'4 or 6 values per line are expected in face boxes track: {path}')
+    boxes[:, 0] = numpy.clip(boxes[:, 0], 0, frame_width - 1)
+    boxes[:, 1] = numpy.clip(boxes[:, 1], 0, frame_height - 1)
+    boxes[:, 2] = numpy.clip(boxes[:, 2], 1, frame_width - boxes[:, 0])
+    boxes[:, 3] = numpy.clip(boxes[:, 3], 1, frame_height - boxes[:, 1])
+    return boxes
+
+
+def crop_and_resize_frames_by_area(frames, boxes, size):
+    """ Crops frames by (frames, 4) `x`, `y`, `w`, `h` boxes and resizes them by area averaging """
+    width, height = size
+    frames_array = numpy.empty((len(frames), height, width) + numpy.shape(frames[0])[2:], dtype=numpy.uint8) \
+        if len(frames) > 0 else numpy.empty((0, height, width, 3), dtype=numpy.uint8)
+    for frame_index, (frame, (x, y, w, h)) in enumerate(zip(frames, numpy.asarray(boxes).tolist())):
+        row_bounds = numpy.arange(height + 1, dtype=numpy.int64) * h // height
+        col_bounds = numpy.arange(width + 1, dtype=numpy.int64) * w // width
+        sums = numpy.add.reduceat(numpy.asarray(frame)[y: y + h, x: x + w], row_bounds[:-1], axis=0,
+                                  dtype=numpy.float64)
+        sums = numpy.add.reduceat(sums, col_bounds[:-1], axis=1)
+        # `reduceat` takes the single pixel at the bound of empty cells
+        areas = numpy.outer(numpy.maximum(1, numpy.diff(row_bounds)), numpy.maximum(1, numpy.diff(col_bounds)))
+        if sums.ndim == 3:
+            areas = areas[:, :, None]
+        frames_array[frame_index] = numpy.round(sums / areas)
+    return frames_array
+
+
+def get_box_segments(boxes, min_constant_frames):
+    """ :return: list of (frame_index_start, frames_count, is_constant) segments of frames with the same box """
+    bounds = [0] + (numpy.flatnonzero((numpy.diff(boxes, axis=0) != 0).any(axis=1)) + 1).tolist() + [len(boxes)]
+    segments = []
+    for run_start, run_end in zip(bounds[:-1], bounds[1:]):
+        is_constant = run_end - run_start >= min_constant_frames
+        if not is_constant and len(segments) > 0 and not segments[-1][2]:
+            segments[-1] = (segments[-1][0], run_end - segments[-1][0], False)
+        else:
+            segments.append((run_start, run_end - run_start, is_constant))
+    return segments
+
+
+class FaceBoxesDecoder(VideoDecoder):
+    """ Crops frames of the source decoder by their face boxes, given in coordinates of whole frames """
+
+    # abstract - implementations
+
+    def _get_metadata(self):
+        metadata = dict(self.source_decoder.get_metadata())
+        metadata.update({'width': self.get_size()[0], 'height': self.get_size()[1]})
+        metadata.pop('tags', None)  # frames are already rotated
+        return metadata
+
+    def _get_frame_timestamps_and_key_frame_indices(self):
+        return self.source_decoder.get_frame_timestamps(), self.source_decoder.get_key_frame_indices()
+
+    def _read(self, frame_index_start, frames_count, crop_rect, segments_count):
+        size = self.get_size()
+        frames_array = numpy.empty((frames_count,) + self.get_frame_shape(), dtype=numpy.uint8)
+        boxes = self.get_face_boxes()[frame_index_start: frame_index_start + frames_count]
+        for segment_start, segment_frames_count, _ in get_box_segments(boxes, self.min_constant_frames):
+            segment_boxes = boxes[segment_start: segment_start + segment_frames_count]
+            x_start, y_start = segment_boxes[:, :2].min(axis=0).tolist()
+            x_end, y_end = (segment_boxes[:, :2] + segment_boxes[:, 2:]).max(axis=0).tolist()
+            union_rect = {'x': x_start, 'y': y_start, 'w': x_end - x_start, 'h': y_end - y_start}
+            frames = self.source_decoder.get_frames(frame_index_start + segment_start, segment_frames_count,
+                                                    crop_rect=union_rect)
+            frames = crop_and_resize_frames_by_area(frames, segment_boxes[:len(frames)] - [x_start, y_start, 0, 0],
+                                                    size)
+            frames_array[segment_start: segment_start + len(frames)] = frames
+            if len(frames) < segment_frames_count:
+                return frames_array[:segment_start + len(frames)]
+        return frames_array
+
+    def _close(self):
+        self.source_decoder.close()
+
+    # public
+
+    supports_crop_rect = False
+    # the minimum count of frames with the same box to decode them as a separate segment cropped to the box
+    min_constant_frames = 25
+
+    def __init__(self, source_decoder, face_boxes_path, size=None):
+        super().__init__(source_decoder.get_video_path())
+        self.source_decoder = source_decoder
+        self.face_boxes_path = face_boxes_path
+        self.size = size
+        self.face_boxes = None
+        self.cache_min_page_size = source_decoder.cache_min_page_size
+
+    def get_face_boxes(self):
+        if self.face_boxes is None:
+            frame_height, frame_width = self.source_decoder.get_frame_shape()[:2]
+            self.face_boxes = load_face_boxes(self.face_boxes_path, self.source_decoder.get_frames_count(),
+                                              frame_width, frame_height)
+        return self.face_boxes
+
+    def get_size(self):
+        if self.size is None:
+            face_boxes = self.get_face_boxes()
+            self.size = tuple(face_boxes[0, 2:].tolist()) if len(face_boxes) > 0 else (1, 1)
+        return self.size
+
+    def get_frame_shape(self, crop_rect=None):
+        return self.get_size()[1], self.get_size()[0], 3
+
+    def get_source_rect(self):
+        raise ValueError(f'frames are cropped by face boxes of every frame, they have no common area of the video: '
+                         f'{self.face_boxes_path}')
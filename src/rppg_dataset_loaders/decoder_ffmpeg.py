@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from . import utils_ffmpeg
+from .decoder_base import VideoDecoder
+
+
+class FFmpegDecoder(VideoDecoder):
+    """ Decoder by ffprobe / ffmpeg command line tools, one ffmpeg process per segment of frames """
+
+    # abstract - implementations
+
+    def _get_metadata(self):
+        return utils_ffmpeg.get_video_metadata(self.get_video_path())
+
+    def _get_frame_timestamps_and_key_frame_indices(self):
+        time_base = self.get_time_base()
+        frame_timestamps = []
+        key_frame_indices = []
+        video_timestamps = utils_ffmpeg.get_video_frame_timestamps(self.get_video_path())
+        # prev_pkt_pts = 0
+        for frame_info in video_timestamps:
+            if 'pkt_pts' in frame_info:
+                pkt_pts = frame_info['pkt_pts']
+            elif 'pkt_dts' in frame_info:
+                pkt_pts = frame_info['pkt_dts']
+            else:
+                break  # seems to be video end. Example is DEAP/face_video/s01/s01_trial01.avi
+                # or maybe pkt_pts = prev_pkt_pts + 1
+            if int(frame_info.get('key_frame', 0)) == 1:
+                key_frame_indices.append(len(frame_timestamps))
+            frame_timestamps.append(pkt_pts * time_base)
+            # more_prev = prev_pkt_pts
+            # prev_pkt_pts = pkt_pts
+        return frame_timestamps, key_frame_indices
+
+    def _read(self, frame_index_start, frames_count, crop_rect, segments_count):
+        frames_array = numpy.empty((frames_count,) + self.get_frame_shape(crop_rect), dtype=numpy.uint8)
+        if frames_count == 0:
+            return frames_array
+        segments = self.get_segments(frame_index_start, frames_count, segments_count)
+        if len(segments) == 1:
+            frames_decoded = self._prv_decode_segment(frames_array, frame_index_start, frame_index_start,
+                                                      frames_count, crop_rect, self.seek_serial_reads)
+            return frames_array[:frames_decoded]
+        # every segment is decoded by its own ffmpeg process into its own slice of the output array
+        with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            futures = [executor.submit(self._prv_decode_segment, frames_array, frame_index_start,
+                                       segment_index_start, segment_frames_count, crop_rect, True)
+                       for segment_index_start, segment_frames_count in segments]
+            frames_decoded = [future.result() for future in futures]
+        for (segment_index_start, segment_frames_count), segment_frames_decoded in zip(segments, frames_decoded):
+            if segment_frames_decoded < segment_frames_count:
+                # keep only frames decoded contiguously from `frame_index_start`
+                return frames_array[:segment_index_start - frame_index_start + segment_frames_decoded]
+        return frames_array
+
+    def _read_resized(self, frame_index_start, frames_count, crop_rect, size):
+        # cropped and scaled by ffmpeg, so only frames of output size go through the pipe
+        frames_array = numpy.empty((frames_count, size[1], size[0], 3), dtype=numpy.uint8)
+        if frames_count == 0:
+            return frames_array
+        seek_time = self._prv_get_seek_time(frame_index_start)
+        frame_index = frame_index_start if seek_time is None else 0
+        bytes_read = utils_ffmpeg.read_video_frames_into(frames_array, self.get_video_path(), frame_index,
+                                                         frames_count, crop_rect=crop_rect, seek_time=seek_time,
+                                                         size=size)
+        return frames_array[:bytes_read // (frames_array.size // frames_count)]
+
+    def _iter_frames(self, frame_index_start, frames_count, chunk_frames_count, crop_rect, size):
+        # single ffmpeg process for all chunks
+        seek_time = self._prv_get_seek_time(frame_index_start)
+        frame_index = frame_index_start if seek_time is None else 0
+        if size is None:
+            yield from utils_ffmpeg.iter_video_frames(self.get_video_path(), frame_index, frames_count,
+                                                      self.get_frame_shape(crop_rect), chunk_frames_count,
+                                                      crop_rect=crop_rect, seek_time=seek_time)
+            return
+        # ffmpeg area scaling into 16 bits, its cell weights slightly differ from exact means of `VideoDecoder`
+        for frames in utils_ffmpeg.iter_video_frames(self.get_video_path(), frame_index, frames_count,
+                                                     (size[1], size[0], 3), chunk_frames_count, crop_rect=crop_rect,
+                                                     seek_time=seek_time, size=size, pix_fmt='rgb48le'):
+            yield frames.astype(numpy.float32) / numpy.float32(257)
+
+    # private
+
+    def _prv_get_seek_time(self, frame_index):
+        # Any time between timestamps of the previous and the given frames makes ffmpeg to output the given frame first
+        if frame_index <= 0:
+            return None
+        frame_timestamps = self.get_frame_timestamps()
+        return (float(frame_timestamps[frame_index - 1]) + float(frame_timestamps[frame_index])) / 2
+
+    def _prv_decode_segment(self, frames_array, frame_index_start, segment_index_start, segment_frames_count,
+                            crop_rect, use_seek):
+        """ Decodes segment into corresponding slice of `frames_array`, returns the number of decoded frames """
+        offset = segment_index_start - frame_index_start
+        segment_array = frames_array[offset: offset + segment_frames_count]
+        seek_time = self._prv_get_seek_time(segment_index_start) if use_seek else None
+        frame_index = segment_index_start if seek_time is None else 0
+        bytes_read = utils_ffmpeg.read_video_frames_into(segment_array, self.get_video_path(), frame_index,
+                                                         segment_frames_count, crop_rect=crop_rect,
+                                                         seek_time=seek_time)
+        return bytes_read // (segment_array.size // segment_frames_count)
+
+    # public
+
+    cache_min_page_size = 500
+    # seek to the first frame of single-segment reads too, instead of decoding all preceding frames;
+    # it is exact for intra-only videos, e.g. proxy videos
+    seek_serial_reads = False
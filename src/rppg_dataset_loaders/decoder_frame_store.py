@@ -0,0 +1,200 @@
+""" Transcode-once store of decoded frames with memory-mapped access """
+
+import glob
+import hashlib
+import json
+import os
+
+import numpy
+
+from . import utils_ffmpeg
+from .decoder_base import VideoDecoder
+
+pix_fmt_to_channels_count = {'rgb24': 3, 'gray': 1}
+
+
+class FrameStoreDecoder(VideoDecoder):
+    """ Serves stored frames as views into memory-mapped file, `crop_rect` of reads is ignored """
+
+    # abstract - implementations
+
+    def _get_metadata(self):
+        return self.entry['metadata']
+
+    def _get_frame_timestamps_and_key_frame_indices(self):
+        frame_timestamps = numpy.load(self.frame_store.get_entry_path(self.entry_key, '.timestamps.npy')).tolist()
+        return frame_timestamps, list(range(len(frame_timestamps)))  # every stored frame is independent
+
+    def _read(self, frame_index_start, frames_count, crop_rect, segments_count):
+        return self.get_frames_array()[frame_index_start: frame_index_start + frames_count]
+
+    def _close(self):
+        self.frames_array = None
+
+    # public
+
+    supports_crop_rect = False
+
+    def __init__(self, video_path, frame_store, entry_key, entry):
+        super().__init__(video_path)
+        self.frame_store = frame_store
+        self.entry_key = entry_key
+        self.entry = entry
+        self.frames_array = None
+
+    def get_frame_shape(self, crop_rect=None):
+        return tuple(self.entry['frame_shape'])
+
+    def get_source_rect(self):
+        if 'source_rect' in self.entry:
+            return self.entry['source_rect']
+        if self.entry['size'] is None:
+            # entries stored before source rects were recorded are not scaled, if they have no size
+            height, width = self.get_frame_shape()[:2]
+            return self.entry['crop_rect'] or {'x': 0, 'y': 0, 'w': width, 'h': height}
+        raise ValueError(f'area of the video of scaled frames is unknown, remove the entry: {self.entry_key}')
+
+    def get_frames_array(self):
+        if self.frames_array is None:
+            self.frames_array = numpy.memmap(self.frame_store.get_entry_path(self.entry_key, '.frames'),
+                                             dtype=numpy.uint8, mode='r',
+                                             shape=(self.entry['frames_count'],) + self.get_frame_shape())
+        return self.frames_array
+
+
+class FrameStore(object):
+    """ Directory of videos decoded once into frame files, rebuilt on changes of videos, evicted by LRU """
+
+    # private
+
+    @staticmethod
+    def _prv_get_source_fingerprint(video_path):
+        stat = os.stat(video_path)
+        return {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+    def _prv_load_entry(self, entry_key, source_fingerprint):
+        entry_path = self.get_entry_path(entry_key, '.json')
+        if not os.path.exists(entry_path):
+            return None
+        with open(entry_path, 'rt', encoding='utf8') as entry_file:
+            entry = json.load(entry_file)
+        for key in source_fingerprint:
+            if entry.get(key) != source_fingerprint[key]:
+                self.remove_entry(entry_key)  # source video was changed
+                return None
+        if not os.path.exists(self.get_entry_path(entry_key, '.frames')):
+            return None
+        os.utime(entry_path)  # mark as recently used
+        return entry
+
+    def _prv_build_entry(self, entry_key, source_decoder, crop_rect, size, pix_fmt, source_fingerprint):
+        video_path = source_decoder.get_video_path()
+        frame_timestamps = numpy.asarray(source_decoder.get_frame_timestamps(), dtype=numpy.float64)
+        source_height, source_width = source_decoder.get_frame_shape()[:2]
+        if size is not None:
+            height, width = size[1], size[0]
+        else:
+            height, width, _ = source_decoder.get_frame_shape(crop_rect)
+        channels_count = pix_fmt_to_channels_count[pix_fmt]
+        frame_shape = (height, width, channels_count) if channels_count > 1 else (height, width)
+        frames_path = self.get_entry_path(entry_key, '.frames')
+        frames_path_tmp = frames_path + '.tmp'
+        utils_ffmpeg.transcode_video_frames(video_path, frames_path_tmp, crop_rect=crop_rect, size=size,
+                                            pix_fmt=pix_fmt)
+        frames_count = min(os.path.getsize(frames_path_tmp) // int(numpy.prod(frame_shape)), len(frame_timestamps))
+        os.replace(frames_path_tmp, frames_path)
+        numpy.save(self.get_entry_path(entry_key, '.timestamps.npy'), frame_timestamps[:frames_count])
+        metadata = dict(source_decoder.get_metadata())
+        metadata.update({'width': width, 'height': height, 'nb_frames': str(frames_count)})
+        metadata.pop('tags', None)  # frames are already rotated
+        entry = dict(source_fingerprint)
+        entry.update({
+            'video_path': os.path.abspath(video_path),
+            'crop_rect': crop_rect,
+            'source_rect': crop_rect or {'x': 0, 'y': 0, 'w': source_width, 'h': source_height},
+            'size': size,
+            'pix_fmt': pix_fmt,
+            'frame_shape': frame_shape,
+            'frames_count': frames_count,
+            'metadata': metadata,
+        })
+        # entry description is written last: an entry without it is incomplete
+        entry_path = self.get_entry_path(entry_key, '.json')
+        with open(entry_path + '.tmp', 'wt', encoding='utf8') as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(entry_path + '.tmp', entry_path)
+        return entry
+
+    # public
+
+    def __init__(self, path, max_size_bytes=None):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def get_path(self):
+        return self.path
+
+    @staticmethod
+    def get_entry_key(video_path, crop_rect=None, size=None, pix_fmt='rgb24'):
+        description = json.dumps([os.path.abspath(video_path), crop_rect, size, pix_fmt], sort_keys=True)
+        return hashlib.sha1(description.encode('utf8')).hexdigest()
+
+    def get_entry_path(self, entry_key, extension):
+        return os.path.join(self.path, entry_key + extension)
+
+    def get_entry_keys(self):
+        """ :return: keys of stored entries, from the least to the most recently used """
+        entry_paths = sorted(glob.glob(os.path.join(self.path, '*.json')), key=os.path.getmtime)
+        return [os.path.basename(entry_path)[:-len('.json')] for entry_path in entry_paths]
+
+    def get_entry_size_bytes(self, entry_key):
+        size_bytes = 0
+        for extension in ('.frames', '.timestamps.npy', '.json'):
+            entry_path = self.get_entry_path(entry_key, extension)
+            if os.path.exists(entry_path):
+                size_bytes += os.path.getsize(entry_path)
+        return size_bytes
+
+    def get_size_bytes(self):
+        return sum(self.get_entry_size_bytes(entry_key) for entry_key in self.get_entry_keys())
+
+    def get_decoder(self, source_decoder, crop_rect=None, size=None, pix_fmt='rgb24'):
+        """ Decoder of stored frames, the source video is decoded into the store first if needed """
+        video_path = source_decoder.get_video_path()
+        size = list(size) if size is not None else None
+        entry_key = self.get_entry_key(video_path, crop_rect, size, pix_fmt)
+        source_fingerprint = self._prv_get_source_fingerprint(video_path)
+        entry = self._prv_load_entry(entry_key, source_fingerprint)
+        if entry is None:
+            entry = self._prv_build_entry(entry_key, source_decoder, crop_rect, size, pix_fmt, source_fingerprint)
+            self.evict(keep_entry_keys=[entry_key])
+        source_decoder.close()
+        return FrameStoreDecoder(video_path, self, entry_key, entry)
+
+    def remove_entry(self, entry_key):
+        # description goes first, so a partially removed entry is never used
+        for extension in ('.json', '.frames', '.timestamps.npy'):
+            entry_path = self.get_entry_path(entry_key, extension)
+            if os.path.exists(entry_path):
+                os.remove(entry_path)
+
+    def evict(self, max_size_bytes=None, keep_entry_keys=()):
+        """ Removes the least recently used entries until the store size is not above `max_size_bytes` """
+        if max_size_bytes is None:
+            max_size_bytes = self.max_size_bytes
+        if max_size_bytes is None:
+            return
+        entry_keys = self.get_entry_keys()
+        entry_sizes_bytes = [self.get_entry_size_bytes(entry_key) for entry_key in entry_keys]
+        size_bytes = sum(entry_sizes_bytes)
+        for entry_key, entry_size_bytes in zip(entry_keys, entry_sizes_bytes):
+            if size_bytes <= max_size_bytes:
+                break
+            if entry_key not in keep_entry_keys:
+                self.remove_entry(entry_key)
+                size_bytes -= entry_size_bytes
+
+    def clear(self):
+        for entry_key in self.get_entry_keys():
+            self.remove_entry(entry_key)
@@ -0,0 +1,244 @@
+""" Decoding of live videos, which are still being written, e.g. a growing file of a capture or a FIFO """
+
+import subprocess
+import threading
+import time
+
+import numpy
+
+from . import utils_ffmpeg
+from . import utils_trace
+from .decoder_base import VideoDecoder
+
+
+class LiveDecoder(VideoDecoder):
+    """
+    Decoder of a video which grows while it is read, by a single ffmpeg process. Timestamps and frames count
+    are snapshots of frames decoded so far. The input container should be streamable, e.g. mkv, nut or mpegts.
+    """
+
+    # abstract - implementations
+
+    def _get_metadata(self):
+        self._prv_start()
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame_shape is not None or self.is_finished, self.metadata_timeout)
+            if self.frame_shape is None:
+                if self.is_finished and self.return_code != 0:
+                    raise subprocess.CalledProcessError(self.return_code, self.args)
+                raise ValueError(f'no frames are decoded from live video: {self.get_video_path()}')
+            return {
+                'codec_type': 'video',
+                'width': self.frame_shape[1],
+                'height': self.frame_shape[0],
+                'time_base': str(self.stream_time_base),
+                'avg_frame_rate': str(self.stream_frame_rate),
+            }
+
+    def _get_frame_timestamps_and_key_frame_indices(self):
+        with self.condition:
+            frames_count = self._prv_get_available_frames_count()
+            key_frames_count = numpy.searchsorted(self.live_key_frame_indices, frames_count)
+            return self.live_frame_timestamps[:frames_count], self.live_key_frame_indices[:key_frames_count]
+
+    def _read(self, frame_index_start, frames_count, crop_rect, segments_count):
+        frame_shape = self.get_frame_shape(crop_rect)
+        with self.condition:
+            if frame_index_start < self.buffer_index_start:
+                raise ValueError(f'frames before {self.buffer_index_start} are dropped from the buffer of '
+                                 f'live video: {self.get_video_path()}')
+            position = frame_index_start - self.buffer_index_start
+            frames = self.buffer[position: position + frames_count]
+        if crop_rect is not None:
+            frames = [frame[crop_rect['y']: crop_rect['y'] + crop_rect['h'],
+                            crop_rect['x']: crop_rect['x'] + crop_rect['w']] for frame in frames]
+        if len(frames) == 0:
+            return numpy.empty((0,) + tuple(frame_shape), dtype=numpy.uint8)
+        return numpy.stack(frames)
+
+    def _close(self):
+        process = self.process
+        if process is None:
+            return
+        if process.poll() is None:
+            process.kill()
+        for thread in self.threads:
+            thread.join()
+        process.stdout.close()
+        process.stderr.close()
+        process.wait()
+        self.process = None
+        self.threads = []
+
+    # private
+
+    def _prv_start(self):
+        with self.condition:
+            if self.process is not None:
+                return
+            self.process = subprocess.Popen(self.args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.threads = [threading.Thread(target=self._prv_read_frames, daemon=True),
+                            threading.Thread(target=self._prv_read_frame_infos, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def _prv_get_available_frames_count(self):
+        """ Count of frames with both data and timestamp, called under the lock """
+        return min(len(self.live_frame_timestamps), self.buffer_index_start + len(self.buffer))
+
+    def _prv_read_frame_infos(self):
+        """ Thread reading timestamps of frames from `showinfo` lines of ffmpeg stderr """
+        for line in self.process.stderr:
+            frame_info = utils_ffmpeg.parse_showinfo_line(line.decode('utf8', errors='replace'))
+            if frame_info is None:
+                continue
+            with self.condition:
+                if 'time_base' in frame_info:
+                    self.stream_time_base = frame_info['time_base']
+                    self.stream_frame_rate = frame_info['frame_rate']
+                    continue
+                if frame_info['pts'] is not None:
+                    timestamp = frame_info['pts'] * self.stream_time_base
+                elif len(self.live_frame_timestamps) > 0 and self.stream_frame_rate > 0:
+                    timestamp = self.live_frame_timestamps[-1] + 1 / self.stream_frame_rate
+                else:
+                    timestamp = 0 * self.stream_time_base
+                if frame_info['key_frame']:
+                    self.live_key_frame_indices.append(len(self.live_frame_timestamps))
+                self.live_frame_timestamps.append(timestamp)
+                if self.frame_shape is None:
+                    self.frame_shape = (frame_info['height'], frame_info['width'], 3)
+                self.condition.notify_all()
+        with self.condition:
+            self.is_frame_infos_finished = True
+            self.condition.notify_all()
+
+    def _prv_read_frames(self):
+        """ Thread reading raw frames from ffmpeg stdout, the frame size is known by the first `showinfo` line """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame_shape is not None or self.is_frame_infos_finished)
+            frame_shape = self.frame_shape
+        while frame_shape is not None:
+            frame = numpy.empty(frame_shape, dtype=numpy.uint8)
+            if utils_ffmpeg.read_pipe_into(self.process.stdout, frame) < frame.nbytes:
+                break
+            with self.condition:
+                self.buffer.append(frame)
+                self.buffer_arrival_times.append(time.monotonic())
+                if self.max_buffered_frames is not None and len(self.buffer) > 2 * self.max_buffered_frames:
+                    # dropped in batches, so the buffer is not shifted on every frame
+                    dropped_count = len(self.buffer) - self.max_buffered_frames
+                    del self.buffer[:dropped_count]
+                    del self.buffer_arrival_times[:dropped_count]
+                    self.buffer_index_start += dropped_count
+                self.condition.notify_all()
+        return_code = self.process.wait()
+        with self.condition:
+            # timestamps of the last frames may be parsed after their data
+            self.condition.wait_for(lambda: self.is_frame_infos_finished)
+            self.return_code = return_code
+            self.is_finished = True
+            self.condition.notify_all()
+
+    def _prv_wait_for_chunk(self, frame_index_start, frames_count, max_latency):
+        """ Waits for frames of the chunk until the first of them waits `max_latency`, under the lock """
+        while True:
+            available_count = self._prv_get_available_frames_count() - frame_index_start
+            if available_count >= frames_count or self.is_finished:
+                return max(0, min(frames_count, available_count))
+            if available_count > 0 and max_latency is not None:
+                arrival_time = self.buffer_arrival_times[max(0, frame_index_start - self.buffer_index_start)]
+                timeout = arrival_time + max_latency - time.monotonic()
+                if timeout <= 0:
+                    return available_count
+                self.condition.wait(timeout)
+            else:
+                self.condition.wait()
+
+    # public
+
+    # seconds to wait for the first frame by `get_metadata`, None - until it is decoded or the stream ends
+    metadata_timeout = None
+
+    def __init__(self, video_path, follow=False, follow_timeout=None, analyze_duration=None,
+                 max_buffered_frames=None):
+        """
+        :param follow: keep reading the file at its end as it grows, `follow_timeout` seconds without data end it
+        :param max_buffered_frames: the minimum count of the latest frames kept in memory, None - all frames
+        """
+        super().__init__(video_path)
+        self.args = utils_ffmpeg.get_live_video_frames_args(video_path, follow=follow, follow_timeout=follow_timeout,
+                                                            analyze_duration=analyze_duration)
+        self.max_buffered_frames = max_buffered_frames
+        self.condition = threading.Condition()
+        self.process = None
+        self.threads = []
+        self.stream_time_base = None
+        self.stream_frame_rate = None
+        self.frame_shape = None
+        self.live_frame_timestamps = []
+        self.live_key_frame_indices = []
+        self.buffer = []
+        self.buffer_arrival_times = []
+        self.buffer_index_start = 0
+        self.return_code = None
+        self.is_frame_infos_finished = False
+        self.is_finished = False
+
+    def get_frame_timestamps(self):
+        self._prv_start()
+        return self._get_frame_timestamps_and_key_frame_indices()[0]
+
+    def get_key_frame_indices(self):
+        self._prv_start()
+        return self._get_frame_timestamps_and_key_frame_indices()[1]
+
+    def get_frames_count(self):
+        self._prv_start()
+        with self.condition:
+            return self._prv_get_available_frames_count()
+
+    def get_buffer_index_start(self):
+        """ Index of the oldest frame kept in memory """
+        with self.condition:
+            return self.buffer_index_start
+
+    def get_is_finished(self):
+        with self.condition:
+            return self.is_finished
+
+    def wait_for_frames_count(self, frames_count, timeout=None):
+        """ :return: True, if `frames_count` frames are decoded before `timeout` seconds pass """
+        self._prv_start()
+        with self.condition:
+            return self.condition.wait_for(lambda: self._prv_get_available_frames_count() >= frames_count or
+                                           self.is_finished, timeout) and \
+                self._prv_get_available_frames_count() >= frames_count
+
+    def wait_for_time(self, time_end, timeout=None):
+        """ :return: True, if a frame at or after `time_end` is decoded before `timeout` seconds pass """
+        def _is_decoded():
+            frames_count = self._prv_get_available_frames_count()
+            return frames_count > 0 and self.live_frame_timestamps[frames_count - 1] >= time_end
+
+        self._prv_start()
+        with self.condition:
+            return self.condition.wait_for(lambda: _is_decoded() or self.is_finished, timeout) and _is_decoded()
+
+    def iter_frames(self, frame_index_start, frames_count, chunk_frames_count, crop_rect=None, size=None,
+                    max_latency=None):
+        """ Yields chunks of frames as they are decoded, a frame waits at most `max_latency` for its chunk """
+        self._prv_start()
+        frame_index = max(0, frame_index_start)
+        frame_index_end = None if frames_count is None else frame_index + max(0, frames_count)
+        while frame_index_end is None or frame_index < frame_index_end:
+            chunk_frames_count_max = chunk_frames_count if frame_index_end is None else \
+                min(chunk_frames_count, frame_index_end - frame_index)
+            with self.condition:
+                chunk_frames_count_available = self._prv_wait_for_chunk(frame_index, chunk_frames_count_max,
+                                                                        max_latency)
+            if chunk_frames_count_available == 0:
+                return
+            frames = self._read(frame_index, chunk_frames_count_available, crop_rect, 1)
+            yield frames if size is None else utils_trace.get_area_downscaled(frames, size)
+            frame_index += len(frames)
@@ -0,0 +1,141 @@
+""" Lossless low-resolution proxy videos, mapped to frames and timestamps of their source videos """
+
+import hashlib
+import json
+import os
+
+import numpy
+
+from . import utils_ffmpeg
+from .decoder_base import DecoderTitle, VideoDecoder, import_decoder
+
+
+def get_proxy_path(proxy_dir, video_path):
+    """ :return: path of proxy video in `proxy_dir`, unique per path of the source video """
+    video_path = os.path.abspath(video_path)
+    digest = hashlib.sha1(video_path.encode('utf8')).hexdigest()[:16]
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(proxy_dir, f'{digest}_{video_name}.mkv')
+
+
+def get_sidecar_path(proxy_path):
+    return proxy_path + '.npz'
+
+
+def get_source_fingerprint(video_path):
+    stat = os.stat(video_path)
+    return numpy.asarray([stat.st_size, stat.st_mtime_ns], dtype=numpy.int64)
+
+
+def make_proxy_video(source_decoder, proxy_path, crop_rect=None, size=None, codec='utvideo',
+                     proxy_decoder_title=DecoderTitle.FFmpeg):
+    """ Encodes the source video into proxy video by lossless intra-only codec, with sidecar of its timestamps """
+    video_path = source_decoder.get_video_path()
+    source_fingerprint = get_source_fingerprint(video_path)
+    os.makedirs(os.path.dirname(os.path.abspath(proxy_path)), exist_ok=True)
+    proxy_path_root, proxy_path_ext = os.path.splitext(proxy_path)
+    proxy_path_tmp = proxy_path_root + '.tmp' + proxy_path_ext
+    utils_ffmpeg.encode_proxy_video(video_path, proxy_path_tmp, crop_rect=crop_rect, size=size, codec=codec)
+    proxy_decoder = import_decoder(proxy_decoder_title)(proxy_path_tmp)
+    proxy_metadata = proxy_decoder.get_metadata()
+    proxy_timestamps = [float(timestamp) for timestamp in proxy_decoder.get_frame_timestamps()]
+    proxy_decoder.close()
+    frame_timestamps = [float(timestamp) for timestamp in source_decoder.get_frame_timestamps()]
+    # source timestamps may end earlier than frames, e.g. DEAP/face_video/s01/s01_trial01.avi
+    frames_count = len(frame_timestamps)
+    if len(proxy_timestamps) < frames_count:
+        os.remove(proxy_path_tmp)
+        raise ValueError(f'proxy video has {len(proxy_timestamps)} frames, {frames_count} expected: {video_path}')
+    metadata = dict(source_decoder.get_metadata())
+    metadata.update({'width': proxy_metadata['width'], 'height': proxy_metadata['height'],
+                     'nb_frames': str(frames_count)})
+    metadata.pop('tags', None)  # frames are already rotated
+    source_height, source_width = source_decoder.get_frame_shape()[:2]
+    source_rect = crop_rect or {'x': 0, 'y': 0, 'w': source_width, 'h': source_height}
+    os.replace(proxy_path_tmp, proxy_path)
+    # sidecar is saved last: a proxy without it is incomplete
+    numpy.savez(get_sidecar_path(proxy_path),
+                source_frame_indices=numpy.arange(frames_count, dtype=numpy.int64),
+                frame_timestamps=numpy.asarray(frame_timestamps, dtype=numpy.float64),
+                proxy_timestamps=numpy.asarray(proxy_timestamps[:frames_count], dtype=numpy.float64),
+                source_fingerprint=source_fingerprint,
+                metadata=json.dumps(metadata),
+                source_rect=json.dumps(source_rect),
+                proxy_metadata=json.dumps(proxy_metadata))
+    return proxy_path
+
+
+class ProxyDecoder(VideoDecoder):
+    """ Decoder of the source video by its proxy made by `make_proxy_video`, `crop_rect` of reads is ignored """
+
+    # abstract - implementations
+
+    def get_is_supported(self):
+        sidecar_path = get_sidecar_path(self.proxy_path)
+        if not os.path.exists(self.proxy_path) or not os.path.exists(sidecar_path):
+            return False
+        # the proxy is outdated, if the source video was changed
+        return numpy.array_equal(self.get_sidecar()['source_fingerprint'], get_source_fingerprint(self.video_path))
+
+    def _get_metadata(self):
+        return json.loads(str(self.get_sidecar()['metadata']))
+
+    def _get_frame_timestamps_and_key_frame_indices(self):
+        frame_timestamps = self.get_sidecar()['frame_timestamps'].tolist()
+        return frame_timestamps, list(range(len(frame_timestamps)))  # every proxy frame is a key frame
+
+    def _read(self, frame_index_start, frames_count, crop_rect, segments_count):
+        return self.get_proxy_decoder().get_frames(frame_index_start, frames_count, segments_count=segments_count)
+
+    def _iter_frames(self, frame_index_start, frames_count, chunk_frames_count, crop_rect, size):
+        return self.get_proxy_decoder().iter_frames(frame_index_start, frames_count, chunk_frames_count, size=size)
+
+    def _close(self):
+        if self.proxy_decoder is not None:
+            self.proxy_decoder.close()
+            self.proxy_decoder = None
+
+    # public
+
+    supports_crop_rect = False
+
+    def __init__(self, video_path, proxy_path, proxy_decoder_title=DecoderTitle.FFmpeg):
+        super().__init__(video_path)
+        self.proxy_path = proxy_path
+        self.proxy_decoder_title = proxy_decoder_title
+        self.sidecar = None
+        self.proxy_decoder = None
+
+    def get_proxy_path(self):
+        return self.proxy_path
+
+    def get_sidecar(self):
+        if self.sidecar is None:
+            with numpy.load(get_sidecar_path(self.proxy_path)) as sidecar:
+                self.sidecar = dict(sidecar)
+        return self.sidecar
+
+    def get_proxy_decoder(self):
+        if self.proxy_decoder is None:
+            sidecar = self.get_sidecar()
+            proxy_decoder = import_decoder(self.proxy_decoder_title)(self.proxy_path)
+            # the proxy video is not probed: its metadata and timestamps are known from the sidecar
+            proxy_decoder.metadata = json.loads(str(sidecar['proxy_metadata']))
+            proxy_decoder.frame_timestamps = sidecar['proxy_timestamps'].tolist()
+            proxy_decoder.key_frame_indices = list(range(len(proxy_decoder.frame_timestamps)))
+            proxy_decoder.seek_serial_reads = True  # every frame of the proxy is a key frame
+            self.proxy_decoder = proxy_decoder
+        return self.proxy_decoder
+
+    def get_source_frame_indices(self):
+        """ :return: indices of frames of the source video, by indices of proxy frames """
+        return self.get_sidecar()['source_frame_indices']
+
+    def get_frame_shape(self, crop_rect=None):
+        return self.get_proxy_decoder().get_frame_shape()
+
+    def get_source_rect(self):
+        sidecar = self.get_sidecar()
+        if 'source_rect' not in sidecar:
+            raise ValueError(f'area of the video of proxy frames is unknown, remake the proxy: {self.proxy_path}')
+        return json.loads(str(sidecar['source_rect']))
@@ -0,0 +1,127 @@
+import bisect
+from fractions import Fraction
+
+import av
+import numpy
+
+from .decoder_base import VideoDecoder
+
+
+class PyAVDecoder(VideoDecoder):
+    """ In-process decoder by PyAV, requires `av` package; consecutive reads do not seek """
+
+    # abstract - implementations
+
+    def _get_metadata(self):
+        stream = self._prv_get_stream()
+        codec_context = stream.codec_context
+        return {
+            'index': stream.index,
+            'codec_name': codec_context.name,
+            'width': codec_context.width,
+            'height': codec_context.height,
+            'pix_fmt': codec_context.pix_fmt,
+            'time_base': str(stream.time_base),
+            'avg_frame_rate': str(stream.average_rate) if stream.average_rate is not None else '0/0',
+            'nb_frames': str(stream.frames),
+            'tags': dict(stream.metadata),
+        }
+
+    def _get_frame_timestamps_and_key_frame_indices(self):
+        # demuxing only, packets are not decoded; packets are sorted to presentation order
+        with av.open(str(self.get_video_path())) as container:
+            stream = container.streams.video[0]
+            time_base = stream.time_base
+            packets = []
+            for packet in container.demux(stream):
+                pts = packet.pts if packet.pts is not None else packet.dts
+                if pts is not None and packet.size > 0:
+                    packets.append((pts, packet.is_keyframe))
+        packets.sort()
+        frame_timestamps = [pts * time_base for pts, _ in packets]
+        key_frame_indices = [i for i, (_, is_keyframe) in enumerate(packets) if is_keyframe]
+        return frame_timestamps, key_frame_indices
+
+    def _read(self, frame_index_start, frames_count, crop_rect, segments_count):
+        frames_array = numpy.empty((frames_count,) + self.get_frame_shape(crop_rect), dtype=numpy.uint8)
+        if frames_count == 0:
+            return frames_array
+        self._prv_seek(frame_index_start)
+        frames_read = 0
+        for frame in self.decoded_frames:
+            # timestamps of decoded frames map them to frame indices
+            frame_pts_to_index = self._prv_get_frame_pts_to_index()
+            if frame.pts is not None and frame.pts in frame_pts_to_index:
+                self.decoded_frame_index = frame_pts_to_index[frame.pts]
+            else:
+                self.decoded_frame_index += 1
+            if self.decoded_frame_index < frame_index_start:
+                continue
+            frames_array[frames_read] = self._prv_frame_to_ndarray(frame, crop_rect)
+            frames_read += 1
+            if frames_read == frames_count:
+                break
+        else:
+            self.decoded_frames = None  # end of the video
+        return frames_array[:frames_read]
+
+    def _close(self):
+        self.decoded_frames = None
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+    # private
+
+    def _prv_get_container(self):
+        if self.container is None:
+            self.container = av.open(str(self.get_video_path()))
+            self.container.streams.video[0].thread_type = 'AUTO'
+        return self.container
+
+    def _prv_get_stream(self):
+        return self._prv_get_container().streams.video[0]
+
+    def _prv_get_frame_pts(self):
+        # timestamps may be set without probing (see `ProxyDecoder`), so pts are restored from them
+        if self.frame_pts is None:
+            time_base = self._prv_get_stream().time_base
+            self.frame_pts = [round(Fraction(timestamp) / time_base) for timestamp in self.get_frame_timestamps()]
+        return self.frame_pts
+
+    def _prv_get_frame_pts_to_index(self):
+        if self.frame_pts_to_index is None:
+            self.frame_pts_to_index = {pts: i for i, pts in enumerate(self._prv_get_frame_pts())}
+        return self.frame_pts_to_index
+
+    def _prv_seek(self, frame_index):
+        key_frame_indices = self.get_key_frame_indices()
+        key_frame_position = bisect.bisect_right(key_frame_indices, frame_index) - 1
+        key_frame_index = key_frame_indices[key_frame_position] if key_frame_position >= 0 else 0
+        if self.decoded_frames is not None and key_frame_index <= self.decoded_frame_index < frame_index:
+            return  # decoding up to `frame_index` is cheaper than seeking
+        container = self._prv_get_container()
+        stream = self._prv_get_stream()
+        container.seek(self._prv_get_frame_pts()[key_frame_index], stream=stream, backward=True, any_frame=False)
+        self.decoded_frames = container.decode(stream)
+        self.decoded_frame_index = key_frame_index - 1
+
+    def _prv_frame_to_ndarray(self, frame, crop_rect):
+        frame_array = frame.to_ndarray(format='rgb24')
+        rotation = self.get_video_size_with_rotation()['rotation']
+        if rotation != 0:  # ffmpeg command line tool rotates frames by default, do the same
+            frame_array = numpy.rot90(frame_array, k=-(rotation // 90))
+        if crop_rect is not None:
+            x, y, w, h = crop_rect['x'], crop_rect['y'], crop_rect['w'], crop_rect['h']
+            frame_array = frame_array[y: y + h, x: x + w]
+        return frame_array
+
+    # public
+
+    def __init__(self, video_path):
+        super().__init__(video_path)
+        self.container = None
+        self.decoded_frames = None
+        self.decoded_frame_index = -1
+        self.frame_pts = None
+        self.frame_pts_to_index = None
@@ -0,0 +1,133 @@
+""" Memoisation of HR estimated by windows of sessions, kept in memory and on disk across runs """
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy
+
+
+def get_time_key(time):
+    """ :return: time rounded to microseconds, so keys of the same window match despite float rounding """
+    return int(round(float(time) * 1000000))
+
+
+class HRCache(object):
+    """
+    HR estimated by windows of sessions, kept by an LRU in memory and in sqlite database, if its path is set.
+    Keys include fingerprints of estimators, so results of other estimator parameters are never returned.
+    """
+
+    # private
+
+    def _prv_get_connection(self):
+        if self.connection is None and self.path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=60.0, check_same_thread=False)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS hr_values (dataset TEXT, session_key TEXT, '
+                                    'fingerprint TEXT, duration INTEGER, sync_time INTEGER, hr REAL, '
+                                    'PRIMARY KEY (dataset, session_key, fingerprint, duration, sync_time)) '
+                                    'WITHOUT ROWID')
+            self.connection.commit()
+        return self.connection
+
+    def _prv_put_memory(self, key, hr):
+        self.memory[key] = hr
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_max_entries:
+            self.memory.popitem(last=False)
+
+    # public
+
+    def __init__(self, path=None, memory_max_entries=1000000):
+        self.path = path
+        self.memory_max_entries = memory_max_entries
+        self.memory = OrderedDict()
+        self.connection = None
+        self.lock = threading.RLock()
+
+    def get_many(self, session_cache_key, sync_times, time_duration):
+        """ :return: (hr_values, is_found) of windows of the same duration, NaN for unknown HR """
+        sync_time_keys = [get_time_key(sync_time) for sync_time in sync_times]
+        duration_key = get_time_key(time_duration)
+        hr_values = numpy.full((len(sync_time_keys),), numpy.nan)
+        is_found = numpy.zeros((len(sync_time_keys),), dtype=bool)
+        with self.lock:
+            for position, sync_time_key in enumerate(sync_time_keys):
+                key = session_cache_key + (duration_key, sync_time_key)
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    hr = self.memory[key]
+                    hr_values[position] = numpy.nan if hr is None else hr
+                    is_found[position] = True
+            connection = self._prv_get_connection()
+            if connection is None or is_found.all():
+                return hr_values, is_found
+            missing_keys = [sync_time_keys[position] for position in numpy.flatnonzero(~is_found)]
+            rows = connection.execute('SELECT sync_time, hr FROM hr_values WHERE dataset = ? AND session_key = ? '
+                                      'AND fingerprint = ? AND duration = ? AND sync_time BETWEEN ? AND ?',
+                                      session_cache_key + (duration_key, min(missing_keys), max(missing_keys)))
+            stored = dict(rows.fetchall())
+            for position in numpy.flatnonzero(~is_found):
+                if sync_time_keys[position] in stored:
+                    hr = stored[sync_time_keys[position]]
+                    self._prv_put_memory(session_cache_key + (duration_key, sync_time_keys[position]), hr)
+                    hr_values[position] = numpy.nan if hr is None else hr
+                    is_found[position] = True
+        return hr_values, is_found
+
+    def put_many(self, session_cache_key, sync_times, time_duration, hr_values):
+        """ Stores results of windows of the same duration by a single transaction, NaN or None for unknown HR """
+        duration_key = get_time_key(time_duration)
+        rows = [session_cache_key + (duration_key, get_time_key(sync_time),
+                                     None if hr is None or numpy.isnan(hr) else float(hr))
+                for sync_time, hr in zip(sync_times, hr_values)]
+        with self.lock:
+            for row in rows:
+                self._prv_put_memory(row[:-1], row[-1])
+            connection = self._prv_get_connection()
+            if connection is not None and len(rows) > 0:
+                with connection:
+                    connection.executemany('INSERT OR REPLACE INTO hr_values VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def get(self, session_cache_key, sync_time, time_duration):
+        """ :return: (hr, is_found) - HR of the window, None for unknown HR, and True if it is in the cache """
+        hr_values, is_found = self.get_many(session_cache_key, [sync_time], time_duration)
+        return None if numpy.isnan(hr_values[0]) else float(hr_values[0]), bool(is_found[0])
+
+    def put(self, session_cache_key, sync_time, time_duration, hr):
+        self.put_many(session_cache_key, [sync_time], time_duration, [hr])
+
+    def prefill(self, sessions, window, stride, start=None, end=None):
+        """ Estimates and stores HR of sliding windows of sessions which are not in the cache yet """
+        for session in sessions:
+            if session.hr_cache is not self:
+                raise ValueError(f'session {session.get_session_key()} does not use this HR cache')
+            session.get_estimated_hr_series(window, stride, start, end)
+
+    def purge_stale(self, session_cache_key):
+        """ Removes results of the session by estimators with other fingerprints """
+        dataset, session_key, fingerprint = session_cache_key
+        with self.lock:
+            for key in [key for key in self.memory if key[:2] == (dataset, session_key) and key[2] != fingerprint]:
+                del self.memory[key]
+            connection = self._prv_get_connection()
+            if connection is not None:
+                with connection:
+                    connection.execute('DELETE FROM hr_values WHERE dataset = ? AND session_key = ? AND '
+                                       'fingerprint != ?', session_cache_key)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            connection = self._prv_get_connection()
+            if connection is not None:
+                with connection:
+                    connection.execute('DELETE FROM hr_values')
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
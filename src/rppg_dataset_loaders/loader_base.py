@@ -1,17 +1,28 @@
+import hashlib
+import json
 import logging
 import math
 import os
 from abc import ABC
 from enum import Enum
 from fractions import Fraction
-from typing import Optional, List, Callable
+from typing import Optional, List, Callable, Tuple
 
 import numpy
-
-from . import utils_base, utils_ffmpeg
+import scipy.signal as scs
+
+from . import utils_base
+from . import utils_ppg
+from . import utils_trace
+from .decoder_base import DecoderTitle, VideoDecoder, import_decoder
+from .decoder_face_boxes import FaceBoxesDecoder
+from .decoder_live import LiveDecoder
+from .decoder_proxy import ProxyDecoder, get_proxy_path, make_proxy_video
 from .ds_title import DSTitle
 from .utils_base import escape_filename
-from .utils_ekg import freq_welch
+from .utils_ekg import freq_welch, freq_welch_batch, get_spectral_quality_batch
+from .utils_signal import InterpolationMethod, estimate_by_windows, filter_band_zero_phase, get_average_fps, \
+    get_in_range_means, get_in_range_prefix_sums, interpolate
 
 
 class TimestampAlignment(Enum):
@@ -200,6 +211,7 @@ class DatasetLoader(object):
             session_record = self.session_records[session_key]
             if callable(session_class):
                 session = session_class(session_key, session_key_escaped, self.path, session_record)
+                session.ds_title = self.get_ds_title()
                 return session
             assert self.__class__.__name__ + ': invalid session class to instaniate'
         assert self.__class__.__name__ + ': invalid session key to instaniate'
@@ -214,11 +226,18 @@ class Session(object):
 
     # public
 
+    # `hr_cache.HRCache` of estimated HR shared by sessions, None - HR is estimated on every call
+    hr_cache = None
+    # version of HR estimation of the session class, to be increased when estimated HR values change,
+    # so values cached by the previous version are not used
+    hr_estimator_version: int = 1
+
     def __init__(self, session_key, session_key_escaped, dataset_path, session_record):
         self.session_key = session_key
         self.session_key_escaped = session_key_escaped
         self.dataset_path = dataset_path
         self.session_record = session_record
+        self.ds_title: Optional[DSTitle] = None  # set by the dataset loader
         self.path = None
         self.raw_metadata = None
         self.metadata = None
@@ -270,8 +289,28 @@ class Session(object):
     def get_session_record(self):
         return self.session_record
 
+    def get_ds_title(self) -> Optional[DSTitle]:
+        return self.ds_title
+
+    def get_hr_estimator_fingerprint(self):
+        """ :return: digest of parameters of HR estimation, which changes when they change """
+        params = json.dumps(self._get_hr_estimator_params(), sort_keys=True, default=str)
+        return hashlib.sha1(params.encode('utf8')).hexdigest()[:16]
+
+    def get_hr_cache_key(self):
+        """ :return: (dataset, session_key, fingerprint) - key of HR values of the session in `hr_cache` """
+        dataset = self.ds_title.value if self.ds_title is not None else self.__class__.__name__
+        return dataset, str(self.get_session_key()), self.get_hr_estimator_fingerprint()
+
     def get_estimated_hr_by_sync_time(self, sync_time, time_duration):
-        return self._get_estimated_hr_by_sync_time(sync_time, time_duration)
+        if self.hr_cache is None:
+            return self._get_estimated_hr_by_sync_time(sync_time, time_duration)
+        hr_cache_key = self.get_hr_cache_key()
+        hr, is_found = self.hr_cache.get(hr_cache_key, sync_time, time_duration)
+        if not is_found:
+            hr = self._get_estimated_hr_by_sync_time(sync_time, time_duration)
+            self.hr_cache.put(hr_cache_key, sync_time, time_duration, hr)
+        return hr
 
     def purge_resources(self):
         self._purge_resources()
@@ -306,6 +345,10 @@ class Session(object):
     def _get_estimated_hr_by_sync_time(self, sync_time, time_duration):
         raise NotImplementedError('abstract method is not overridden')
 
+    def _get_hr_estimator_params(self):  # dict { }, JSON serializable, of everything estimated HR depends on
+        return {'class': f'{self.__class__.__module__}.{self.__class__.__qualname__}',
+                'version': self.hr_estimator_version}
+
     def _purge_resources(self):
         return
 
@@ -319,6 +362,10 @@ class SingleVideoSession(Session, ABC):
             return self._instaniate_video_channel()
         return super()._instaniate_channel(channel_type, channel_record)
 
+    def _purge_resources(self):
+        super()._purge_resources()
+        self.signal_at_video_frames = {}
+
     # private
 
     def _prv_get_video_sync_time(self):
@@ -373,6 +420,7 @@ class SingleVideoSession(Session, ABC):
         self.vs_cross_sync_time = None
         self.vs_cross_duration = None
         self.vs_cross_metadata = None
+        self.signal_at_video_frames = {}
 
     def get_video_path(self):
         if self.video_path is None:
@@ -396,6 +444,46 @@ class SingleVideoSession(Session, ABC):
     def get_vs_cross_duration(self):
         return self._prv_get_vs_cross_duration()
 
+    def get_window_sync_times(self, window, stride, start=None, end=None):
+        """
+        :return: float64 array of sync times of starts of `window` seconds long windows every `stride` seconds,
+            within [`start`, `end`), by default the `vs_cross` range
+        """
+        if start is None:
+            start = self.get_vs_cross_sync_time()
+        if end is None:
+            end = self.get_vs_cross_sync_time() + self.get_vs_cross_duration()
+        windows_count = max(0, int(math.floor((end - start - window) / stride + 1e-9)) + 1)
+        return start + stride * numpy.arange(windows_count, dtype=numpy.float64)
+
+    def get_signal_at_video_frames(self, channel_type, channel_record='_', sync_time=None, time_duration=None,
+                                   method=InterpolationMethod.PCHIP):
+        """
+        :return: (frame_indices, values) of the signal channel interpolated at video frames of the range,
+            None - all frames, NaN outside of the signal; values of all frames are computed once
+        """
+        video_channel = self.get_video_channel()
+        # channels are identified as `get_channel` keeps them
+        cache_key = (channel_type, ('_' if channel_record is None else channel_record).__str__(),
+                     InterpolationMethod(method))
+        if cache_key not in self.signal_at_video_frames:
+            signal_channel = self.get_channel(channel_type, channel_record)
+            video_sync_times = video_channel.get_time_array() + float(video_channel.get_sync_time_offset())
+            self.signal_at_video_frames[cache_key] = signal_channel.get_data_at_sync_times(video_sync_times, method)
+        values = self.signal_at_video_frames[cache_key]
+        if sync_time is None:
+            return numpy.arange(len(values)), values
+        frame_index_range = video_channel.get_frame_index_range_by_sync_time(sync_time, time_duration)
+        if frame_index_range is None:
+            return numpy.arange(0), values[:0]
+        frame_index_start, frames_count = frame_index_range
+        return (numpy.arange(frame_index_start, frame_index_start + frames_count),
+                values[frame_index_start: frame_index_start + frames_count])
+
+    def make_video_proxy(self, proxy_dir=None, crop_rect=None, size=None, codec='utvideo'):
+        """ See `VideoChannel.make_proxy` """
+        return self.get_video_channel().make_proxy(proxy_dir, crop_rect=crop_rect, size=size, codec=codec)
+
     # abstract - to override
 
     def _get_video_path(self):
@@ -422,6 +510,15 @@ class SingleVideoSession(Session, ABC):
 #  except for implementations where the PPG signal is actually used
 class VideoAndPPGSession(SingleVideoSession, ABC):
 
+    # private
+
+    def _prv_get_signal_quality_by_windows(self, sync_times, values, fps, window_sync_times, window):
+        """ Quality index of windows of the signal of `fps` sample frequency, windows are gathered at once """
+        return estimate_by_windows(sync_times, values, window_sync_times, int(round(window * fps)),
+                                   lambda windows: get_spectral_quality_batch(
+                                       windows, fps, (self.min_hr_bpm / 60.0, self.max_hr_bpm / 60.0),
+                                       self.signal_quality_tolerance, self.signal_quality_harmonics_count)[0])
+
     # public
 
     min_hr_bpm: float = 40.0   # the minimum considered HR value, in BPM
@@ -429,15 +526,57 @@ class VideoAndPPGSession(SingleVideoSession, ABC):
 
     # default function to estimate HR by PPG signal, used for some datasets (DCC-SFEDU, DEAP, etc.)
     estimate_hr_by_ppg_signal: Callable[..., float] = freq_welch
+    # batched counterpart of `estimate_hr_by_ppg_signal` for (signals, samples) arrays, None - derived from
+    # `estimate_hr_by_ppg_signal`, see `get_hr_estimator_by_ppg_signals`
+    estimate_hr_by_ppg_signals: Optional[Callable[..., numpy.ndarray]] = None
+    # estimate HR by PPG signal filtered to [`min_hr_bpm`, `max_hr_bpm`] band once over the whole record,
+    # where PPG is a regular channel (DEAP)
+    filter_ppg_signal: bool = False
 
-    @staticmethod
-    def filter_hr_values(hr_values: List[float]) -> List[float]:
+    # the PPG signal has valleys at systoles (e.g. light absorbance of a finger video), so it is inverted for peaks
+    ppg_signal_inverted: bool = False
+
+    # half-width of bands around HR frequency and its harmonics of the signal quality index, in Hz
+    signal_quality_tolerance: float = 0.1
+    # count of bands of the signal quality index: 1 - HR frequency only, 2 - with its first harmonic, etc.
+    signal_quality_harmonics_count: int = 2
+
+    def __init__(self, session_key, session_key_escaped, dataset_path, session_record):
+        super().__init__(session_key, session_key_escaped, dataset_path, session_record)
+        # peaks are small and expensive to detect, so they are kept by `purge_resources`
+        self.ppg_peak_sync_times = None
+
+    @classmethod
+    def filter_hr_values(cls, hr_values: List[float]) -> List[float]:
         """
         Excludes HR values that are outside [`min_hr_bpm`, `max_hr_bpm`] interval.
         :param: hr_values: input values to filter, in BPM
         :return: filtered list of HR values preserving their order.
         """
-        return [hr for hr in hr_values if VideoAndPPGSession.min_hr_bpm <= hr <= VideoAndPPGSession.max_hr_bpm]
+        return [hr for hr in hr_values if cls.min_hr_bpm <= hr <= cls.max_hr_bpm]
+
+    @classmethod
+    def get_hr_estimator_by_ppg_signals(cls) -> Optional[Callable[..., numpy.ndarray]]:
+        """
+        :return: `estimate_hr_by_ppg_signals`, or `freq_welch_batch` for `freq_welch`, or None - windows
+            are estimated one by one
+        """
+        if cls.estimate_hr_by_ppg_signals is not None:
+            return cls.estimate_hr_by_ppg_signals
+        if cls.estimate_hr_by_ppg_signal is freq_welch:
+            return freq_welch_batch
+        return None
+
+    @classmethod
+    def estimate_hr_by_ppg_windows(cls, ppg_windows, fps, freq_range, **kwargs) -> numpy.ndarray:
+        """ :return: HR of every row of (windows, samples) array, in Hz, NaN where HR is unknown """
+        estimate_hr_by_ppg_signals = cls.get_hr_estimator_by_ppg_signals()
+        if estimate_hr_by_ppg_signals is not None:
+            return numpy.asarray(estimate_hr_by_ppg_signals(input_signals=ppg_windows, fps=fps, freq_range=freq_range,
+                                                            **kwargs), dtype=numpy.float64)
+        hr_values = [cls.estimate_hr_by_ppg_signal(input_signal=ppg_window, fps=fps, freq_range=freq_range, **kwargs)
+                     for ppg_window in ppg_windows]
+        return numpy.asarray([numpy.nan if not hr else hr for hr in hr_values], dtype=numpy.float64)
 
     def get_ppg_channel(self):
         ppg_channel_name = self._get_ppg_channel_name()
@@ -445,12 +584,112 @@ class VideoAndPPGSession(SingleVideoSession, ABC):
             return None
         return self.get_channel(ppg_channel_name)
 
+    def get_estimated_hr_series(self, window, stride, start=None, end=None):
+        """
+        :return: (sync_times, hr_values) float64 arrays of starts of windows and their HR, in BPM,
+            NaN where HR is unknown, as `get_estimated_hr_by_sync_time` by a single window
+        """
+        window_sync_times = self.get_window_sync_times(window, stride, start, end)
+        if self.hr_cache is None:
+            return window_sync_times, self._get_estimated_hr_series(window_sync_times, window)
+        # only windows missing in the cache are estimated, by a single batch
+        hr_cache_key = self.get_hr_cache_key()
+        hr_values, is_found = self.hr_cache.get_many(hr_cache_key, window_sync_times, window)
+        if not is_found.all():
+            missing_sync_times = window_sync_times[~is_found]
+            hr_values[~is_found] = self._get_estimated_hr_series(missing_sync_times, window)
+            self.hr_cache.put_many(hr_cache_key, missing_sync_times, window, hr_values[~is_found])
+        return window_sync_times, hr_values
+
+    def get_signal_quality_series(self, window, stride, start=None, end=None):
+        """
+        :return: (sync_times, quality) float64 arrays of starts of windows and quality of the ground truth
+            signal in them within [0, 1], NaN where the signal does not cover the window
+        """
+        window_sync_times = self.get_window_sync_times(window, stride, start, end)
+        return window_sync_times, self._get_signal_quality_series(window_sync_times, window)
+
+    def get_ppg_peak_sync_times(self):
+        """ :return: float64 sync times of systolic peaks of the whole PPG record, None without PPG channel """
+        if self.ppg_peak_sync_times is None:
+            ppg_channel = self.get_ppg_channel()
+            if ppg_channel is None:
+                return None
+            times = ppg_channel.get_time_array()
+            values = numpy.asarray(ppg_channel.get_data_array(), dtype=numpy.float64)
+            if self.ppg_signal_inverted:
+                values = -values
+            fps = get_average_fps(times)
+            peaks = utils_ppg.detect_ppg_peaks(values, fps, (self.min_hr_bpm / 60.0, self.max_hr_bpm / 60.0))
+            self.ppg_peak_sync_times = times[peaks] + float(ppg_channel.get_sync_time_offset())
+        return self.ppg_peak_sync_times
+
+    def get_ppg_peak_sync_times_by_sync_time(self, sync_time, time_duration):
+        """ :return: sync times of systolic peaks within the time range, found by binary search """
+        peak_sync_times = self.get_ppg_peak_sync_times()
+        if peak_sync_times is None:
+            return None
+        return utils_ppg.get_peak_times_in_range(peak_sync_times, sync_time, time_duration)
+
+    def get_ppg_inter_beat_intervals_by_sync_time(self, sync_time, time_duration):
+        """ :return: intervals between consecutive systolic peaks within the time range, in seconds """
+        peak_sync_times = self.get_ppg_peak_sync_times_by_sync_time(sync_time, time_duration)
+        if peak_sync_times is None:
+            return None
+        return numpy.diff(peak_sync_times)
+
+    def get_ppg_instantaneous_hr_by_sync_time(self, sync_time, time_duration):
+        """ :return: (sync_times, hr_values) of beats within the time range, see `utils_ppg.get_instantaneous_hr` """
+        peak_sync_times = self.get_ppg_peak_sync_times_by_sync_time(sync_time, time_duration)
+        if peak_sync_times is None:
+            return None
+        return utils_ppg.get_instantaneous_hr(peak_sync_times)
+
+    def get_ppg_hr_by_peaks_by_sync_time(self, sync_time, time_duration):
+        """ :return: mean HR of beats within the time range, in BPM, None if there are no plausible beats """
+        peak_sync_times = self.get_ppg_peak_sync_times_by_sync_time(sync_time, time_duration)
+        if peak_sync_times is None:
+            return None
+        return utils_ppg.get_hr_by_peak_times(peak_sync_times, (self.min_hr_bpm, self.max_hr_bpm))
+
+    def get_ppg_hrv_metrics_by_sync_time(self, sync_time, time_duration):
+        """ :return: HRV metrics of beats within the time range, see `utils_ppg.get_hrv_metrics` """
+        inter_beat_intervals = self.get_ppg_inter_beat_intervals_by_sync_time(sync_time, time_duration)
+        if inter_beat_intervals is None:
+            return None
+        return utils_ppg.get_hrv_metrics(inter_beat_intervals)
+
     # abstract - to override
 
     # noinspection PyMethodMayBeStatic
     def _get_ppg_channel_name(self) -> Optional[str]:
         return None
 
+    def _get_hr_estimator_params(self):
+        params = super()._get_hr_estimator_params()
+        params.update({'min_hr_bpm': self.min_hr_bpm, 'max_hr_bpm': self.max_hr_bpm,
+                       'filter_ppg_signal': self.filter_ppg_signal, 'ppg_signal_inverted': self.ppg_signal_inverted,
+                       'estimate_hr_by_ppg_signal': utils_base.get_qualified_name(
+                           type(self).estimate_hr_by_ppg_signal),
+                       'estimate_hr_by_ppg_signals': utils_base.get_qualified_name(
+                           type(self).get_hr_estimator_by_ppg_signals())})
+        return params
+
+    def _get_estimated_hr_series(self, window_sync_times, window):
+        # datasets without a batched implementation estimate HR window by window
+        hr_values = [self._get_estimated_hr_by_sync_time(float(sync_time), window) for sync_time in window_sync_times]
+        return numpy.asarray([numpy.nan if hr is None else hr for hr in hr_values], dtype=numpy.float64)
+
+    def _get_signal_quality_series(self, window_sync_times, window):
+        # quality of the PPG signal, if the session has it
+        ppg_channel = self.get_ppg_channel()
+        if ppg_channel is None:
+            return numpy.full((len(window_sync_times),), numpy.nan)
+        times = ppg_channel.get_time_array()
+        return self._prv_get_signal_quality_by_windows(times + float(ppg_channel.get_sync_time_offset()),
+                                                       numpy.asarray(ppg_channel.get_data_array(), dtype=numpy.float64),
+                                                       get_average_fps(times), window_sync_times, window)
+
 
 class SynchronizedFrameStream(object):
 
@@ -459,14 +698,8 @@ class SynchronizedFrameStream(object):
     def _prv_get_frame_index_from_time_default_fps_based(self, time, alignment=TimestampAlignment.LEFT):
         sample_frequency = self.get_metadata()['sample_frequency']
         frame_index_approx = time * sample_frequency
-        # TODO Koster:
-        #  add PPG signal interpolation (maybe adding third TimestampAlignment, CUBIC_HERMITE_INTERP),
-        #  so that when receiving a value from the timestamp, the interpolated value is calculated.
-        #  In the paper we are trying to reproduce,
-        #  "piecewise cubic Hermite interpolation" used without specifying parameters or explanations.
-        #  scipy implementation:
-        #  https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.CubicHermiteSpline.html
-        #  If we can't figure it out with small forces, let's take another interpolation method.
+        # values interpolated between frames (nearest, linear, piecewise cubic Hermite) are provided
+        # for many timestamps at once by `Channel.get_data_at_sync_times`
         if alignment == TimestampAlignment.LEFT:
             return math.floor(frame_index_approx)
         else:
@@ -557,7 +790,8 @@ class SynchronizedFrameStream(object):
         time = self.get_time_by_sync_time(sync_time)
         return self.get_frame_by_time(time, alignment)
 
-    def get_frames_by_time(self, time, time_duration):
+    def get_frame_index_range_by_time(self, time, time_duration):
+        """ :return: (frame_index_start, frames_count) of frames within the time range, or None if there are none """
         if time_duration < 0:
             return None
         frame_index = self._get_frame_index_from_time(time, TimestampAlignment.RIGHT)
@@ -573,7 +807,25 @@ class SynchronizedFrameStream(object):
         if frame_index_2 < frame_index:
             return None
         frame_count = frame_index_2 - frame_index + 1
-        return self.get_frames(frame_index, frame_count)
+        return frame_index, frame_count
+
+    def get_frame_index_range_by_sync_time(self, sync_time, time_duration):
+        return self.get_frame_index_range_by_time(self.get_time_by_sync_time(sync_time), time_duration)
+
+    def get_frame_index_ranges_by_sync_times(self, sync_times, time_duration):
+        """ :return: (frame_index_starts, frames_counts) int64 arrays, 0 frames where there are none """
+        frame_index_ranges = [self.get_frame_index_range_by_sync_time(float(sync_time), time_duration)
+                              for sync_time in sync_times]
+        frame_index_ranges = [(0, 0) if frame_index_range is None else frame_index_range
+                              for frame_index_range in frame_index_ranges]
+        return (numpy.asarray([start for start, _ in frame_index_ranges], dtype=numpy.int64),
+                numpy.asarray([count for _, count in frame_index_ranges], dtype=numpy.int64))
+
+    def get_frames_by_time(self, time, time_duration):
+        frame_index_range = self.get_frame_index_range_by_time(time, time_duration)
+        if frame_index_range is None:
+            return None
+        return self.get_frames(*frame_index_range)
 
     def get_frames_by_sync_time(self, sync_time, time_duration):
         if time_duration < 0:
@@ -684,6 +936,12 @@ class Channel(CachedFrameStream, ABC):
     def _get_raw_metadata(self):
         return self.channel_record
 
+    def _purge_resources(self):
+        super()._purge_resources()
+        self.time_array = None
+        self.data_array = None
+        self.in_range_indices = {}
+
     # private
 
     # public
@@ -692,10 +950,53 @@ class Channel(CachedFrameStream, ABC):
         super().__init__(session_metadata)
         self.channel_record = channel_record
         self.title = title
+        self.time_array = None
+        self.data_array = None
+        self.in_range_indices = {}
 
     def get_channel_record(self):
         return self.channel_record
 
+    def get_time_array(self):
+        """ Timestamps of all frames as float64 array """
+        if self.time_array is None:
+            self.time_array = self._get_time_array()
+        return self.time_array
+
+    def get_data_array(self):
+        """ `data` of all frames as numpy array, the first axis is frames """
+        if self.data_array is None:
+            self.data_array = self._get_data_array()
+        return self.data_array
+
+    def get_in_range_index(self, value_min, value_max):
+        """ Prefix sums and counts of values within [`value_min`, `value_max`], built once per range """
+        if (value_min, value_max) not in self.in_range_indices:
+            self.in_range_indices[(value_min, value_max)] = get_in_range_prefix_sums(self.get_data_array(),
+                                                                                     (value_min, value_max))
+        return self.in_range_indices[(value_min, value_max)]
+
+    def get_in_range_means(self, frame_index_starts, frames_counts, value_min, value_max):
+        """ :return: (means, counts) of values within [`value_min`, `value_max`] of frame ranges, NaN for none """
+        prefix_sums, prefix_counts = self.get_in_range_index(value_min, value_max)
+        frame_index_starts = numpy.asarray(frame_index_starts, dtype=numpy.int64)
+        return get_in_range_means(prefix_sums, prefix_counts, frame_index_starts,
+                                  frame_index_starts + numpy.asarray(frames_counts, dtype=numpy.int64))
+
+    def get_data_at_sync_times(self, sync_times, method=InterpolationMethod.PCHIP):
+        """ Data interpolated at all `sync_times` at once, NaN outside of the channel, see `interpolate` """
+        times = numpy.asarray(sync_times, dtype=numpy.float64) - float(self.get_sync_time_offset())
+        return interpolate(self.get_time_array(), self.get_data_array(), times, method)
+
+    # abstract - to override
+
+    def _get_time_array(self):
+        return numpy.asarray([float(self._get_time_from_frame_index(i)) for i in range(self.get_frames_count())],
+                             dtype=numpy.float64)
+
+    def _get_data_array(self):
+        return numpy.asarray([frame['data'] for frame in self.get_frames(0, self.get_frames_count())])
+
 
 class IrregularFPSChannel(Channel, ABC):
 
@@ -764,6 +1065,9 @@ class IrregularFPSChannel(Channel, ABC):
 
     # abstract - to override
 
+    def _get_time_array(self):
+        return numpy.asarray([float(timestamp) for timestamp in self.get_frame_timestamps()], dtype=numpy.float64)
+
     def _get_frame_timestamps(self):
         raise NotImplementedError('abstract method is not overridden')
 
@@ -791,12 +1095,15 @@ class RegularFPSChannel(Channel):
     def _purge_resources(self):
         super()._purge_resources()
         self.channel_data = None
+        for derived_channel in self.derived_channels.values():
+            derived_channel.purge_resources()
 
     # public
 
     def __init__(self, session_metadata, channel_record, title):
         super().__init__(session_metadata, channel_record, title)
         self.channel_data = None
+        self.derived_channels = {}
 
     def get_channel_data(self):
         if self.channel_data is None:
@@ -806,98 +1113,186 @@ class RegularFPSChannel(Channel):
     def get_sample_frequency(self):
         return self.get_metadata()['sample_frequency']
 
+    def as_rate(self, target_hz):
+        """ View of the channel resampled to `target_hz` once over the whole record """
+        rate_ratio = (Fraction(target_hz) / Fraction(self.get_sample_frequency())).limit_denominator(1000)
+        if rate_ratio == 1:
+            return self
+        derived_channel_key = ('rate', rate_ratio)
+        if derived_channel_key not in self.derived_channels:
+            self.derived_channels[derived_channel_key] = ResampledChannel(self, rate_ratio.numerator,
+                                                                          rate_ratio.denominator)
+        return self.derived_channels[derived_channel_key]
+
+    def as_filtered(self, freq_min_hz, freq_max_hz, order=4):
+        """ View of the channel band-pass filtered once over the whole record, without phase shift """
+        derived_channel_key = ('band', float(freq_min_hz), float(freq_max_hz), order)
+        if derived_channel_key not in self.derived_channels:
+            self.derived_channels[derived_channel_key] = FilteredChannel(self, (freq_min_hz, freq_max_hz), order)
+        return self.derived_channels[derived_channel_key]
+
     # abstract - to override
 
+    def _get_time_array(self):
+        return numpy.arange(self.get_frames_count(), dtype=numpy.float64) / self.get_sample_frequency()
+
+    def _get_data_array(self):
+        return numpy.asarray([frame['data'] for frame in self.get_channel_data()])
+
     def _get_channel_data(self):
         raise NotImplementedError('abstract method is not overridden')
 
 
+class DerivedChannel(RegularFPSChannel, ABC):
+    """ Channel computed from the whole record of a source channel, synchronized the same way """
+
+    # abstract - implementations
+
+    def _get_metadata(self):
+        return dict(self.source_channel.get_metadata())
+
+    def _get_channel_data(self):
+        sample_frequency = self.get_sample_frequency()
+        return [{'index': i, 'time': (i / sample_frequency), 'data': value}
+                for i, value in enumerate(self.get_data_array().tolist())]
+
+    def _get_sync_time_offset(self):
+        return self.source_channel.get_sync_time_offset()
+
+    # public
+
+    def __init__(self, source_channel):
+        super().__init__(source_channel.session_metadata, source_channel.get_channel_record(), source_channel.title)
+        self.source_channel = source_channel
+
+    def get_source_channel(self):
+        return self.source_channel
+
+    # abstract - to override
+
+    def _get_data_array(self):
+        raise NotImplementedError('abstract method is not overridden')
+
+
+class ResampledChannel(DerivedChannel):
+    """ Channel resampled by `up / down` ratio, sample `i` is at time `i / sample_frequency` """
+
+    # abstract - implementations
+
+    def _get_metadata(self):
+        metadata = super()._get_metadata()
+        metadata.update({
+            'sample_frequency': self.source_channel.get_sample_frequency() * self.up / self.down,
+            'frames_count': -(-self.source_channel.get_frames_count() * self.up // self.down),
+        })
+        return metadata
+
+    def _get_data_array(self):
+        source_data = numpy.asarray(self.source_channel.get_data_array(), dtype=numpy.float64)
+        return scs.resample_poly(source_data, self.up, self.down, axis=0)
+
+    # public
+
+    def __init__(self, source_channel, up, down):
+        super().__init__(source_channel)
+        self.up = up
+        self.down = down
+
+
+class FilteredChannel(DerivedChannel):
+    """ Channel band-pass filtered without phase shift over the whole record, windows have no transients """
+
+    # abstract - implementations
+
+    def _get_data_array(self):
+        return filter_band_zero_phase(self.source_channel.get_data_array(), self.get_sample_frequency(),
+                                      self.freq_range, order=self.order, chunk_frames_count=self.chunk_frames_count)
+
+    # public
+
+    # the maximum samples count filtered at once, longer records are filtered by overlapping chunks
+    chunk_frames_count: int = 2 ** 22
+
+    def __init__(self, source_channel, freq_range, order):
+        super().__init__(source_channel)
+        self.freq_range = freq_range
+        self.order = order
+
+
 class VideoChannel(IrregularFPSChannel, ABC):
 
     # abstract - implementations
 
     def _get_cache_min_page_size(self):
-        return 500
+        return self.get_decoder().cache_min_page_size
 
     def _get_raw_metadata(self):
-        return utils_ffmpeg.get_video_metadata(self._prv_get_video_path())
+        return self.get_decoder().get_metadata()
 
     def _get_frames(self, frame_index_start, frames_count):
-        video_size_with_rotation = self._prv_get_video_size_with_rotation()
-        width = video_size_with_rotation['width']
-        height = video_size_with_rotation['height']
-        # rotation = video_size_with_rotation['rotation']
-        crop_rect = self.get_crop_rect()
-        if crop_rect is not None:
-            width = crop_rect['w']
-            height = crop_rect['h']
-        video_buffer = utils_ffmpeg.get_video_frames(self._prv_get_video_path(), frame_index_start, frames_count,
-                                                     crop_rect=crop_rect)
-        # print(367, len(video_buffer))
-        buf_ptr = 0
+        segments_count = min(self.decode_segments_count, frames_count // max(1, self.decode_segment_min_frames))
+        video_frames_data = self.get_decoder().get_frames(frame_index_start, frames_count,
+                                                          crop_rect=self.get_crop_rect(),
+                                                          segments_count=segments_count)
         video_frames = []
-        for i in range(0, frames_count):
-            # print (36,i)
-            buf_ptr_next = buf_ptr + 3 * width * height
-            linear_frame = numpy.frombuffer(video_buffer[buf_ptr:buf_ptr_next], dtype=numpy.uint8)
-            linear_frame.shape = (height, width, 3)
-            # if rotation == 180:
-            # linear_frame = numpy.flip(linear_frame, 0)
-            # elif rotation == 90:
-            # linear_frame = numpy.flip(linear_frame, 1)
+        for i in range(0, len(video_frames_data)):
+            linear_frame = video_frames_data[i]
             frame_index = frame_index_start + i
-            buf_ptr = buf_ptr_next
             video_frames.append(
                 {'index': frame_index, 'time': self._get_time_from_frame_index(frame_index), 'data': linear_frame}
             )
         return video_frames
 
     def _get_frame_timestamps(self):
-        time_base = self._prv_get_video_time_base()
-        frame_timestamps = []
-        video_timestamps = utils_ffmpeg.get_video_frame_timestamps(self._prv_get_video_path())
-        # prev_pkt_pts = 0
-        for frame_info in video_timestamps:
-            if 'pkt_pts' in frame_info:
-                pkt_pts = frame_info['pkt_pts']
-            elif 'pkt_dts' in frame_info:
-                pkt_pts = frame_info['pkt_dts']
-            else:
-                break  # seems to be video end. Example is DEAP/face_video/s01/s01_trial01.avi
-                # or maybe pkt_pts = prev_pkt_pts + 1
-            frame_timestamps.append(pkt_pts * time_base)
-            # more_prev = prev_pkt_pts
-            # prev_pkt_pts = pkt_pts
-        return frame_timestamps
+        return self.get_decoder().get_frame_timestamps()
+
+    def _purge_resources(self):
+        super()._purge_resources()
+        if self.decoder is not None:
+            self.decoder.close()
+            self.decoder = None
 
     # private
 
+    def _prv_get_source_decoder(self):
+        video_path = self._prv_get_video_path()
+        if self.decoder_title is not None:
+            return import_decoder(self.decoder_title)(video_path)
+        if self.use_avi_reader:
+            decoder = import_decoder(DecoderTitle.AVI)(video_path)
+            if decoder.get_is_supported():
+                return decoder
+        return import_decoder(DecoderTitle.FFmpeg)(video_path)
+
+    def _prv_get_proxy_decoder(self):
+        if self.proxy_dir is None:
+            return None
+        video_path = self._prv_get_video_path()
+        decoder = ProxyDecoder(video_path, get_proxy_path(self.proxy_dir, video_path))
+        return decoder if decoder.get_is_supported() else None
+
     def _prv_get_video_path(self):
         return self.session_metadata[self.session_metadata_video_path_key]
 
+    @staticmethod
+    def _prv_get_decoded_rect(video_rect, source_rect, frame_shape):
+        """ Maps rect in coordinates of frames of the video to decoded frames of the area `source_rect` """
+        frame_height, frame_width = frame_shape[:2]
+        scale_x = frame_width / source_rect['w']
+        scale_y = frame_height / source_rect['h']
+        x = int(round((video_rect['x'] - source_rect['x']) * scale_x))
+        y = int(round((video_rect['y'] - source_rect['y']) * scale_y))
+        w = max(1, int(round((video_rect['x'] + video_rect['w'] - source_rect['x']) * scale_x)) - x)
+        h = max(1, int(round((video_rect['y'] + video_rect['h'] - source_rect['y']) * scale_y)) - y)
+        if x < 0 or y < 0 or x + w > frame_width or y + h > frame_height:
+            raise ValueError(f'crop rect {video_rect} is out of the area {source_rect} of decoded frames')
+        return {'x': x, 'y': y, 'w': w, 'h': h}
+
     def _prv_get_video_time_base(self):
         return Fraction(self.get_raw_metadata()['time_base'])
 
     def _prv_get_video_size_with_rotation(self):
-        metadata = self.get_metadata()
-        rotation = 0
-        width = int(metadata['width'])
-        height = int(metadata['height'])
-        if 'tags' in metadata:
-            tags = metadata['tags']
-            if 'rotate' in tags:
-                rotation = int(tags['rotate'])
-        while rotation < 0:
-            rotation += 360
-        while rotation > 360:
-            rotation -= 360
-        if rotation != 0 and rotation != 180:
-            width, height = height, width
-        result = {
-            'width': width,
-            'height': height,
-            'rotation': rotation,
-        }
+        result = self.get_decoder().get_video_size_with_rotation()
         crop_rect = self.get_crop_rect()
         if crop_rect is not None:
             result['crop_rect'] = crop_rect
@@ -905,6 +1300,32 @@ class VideoChannel(IrregularFPSChannel, ABC):
 
     # public
 
+    # decoder backend; None - automatic choice: `DecoderTitle.AVI` if supported, otherwise `DecoderTitle.FFmpeg`.
+    # Set it for `VideoChannel` globally or for a dataset specific subclass, e.g. `UBFCVideoChannel`, per loader.
+    decoder_title: Optional[DecoderTitle] = None
+    # number of processes to decode a large frame range in parallel, one contiguous segment per process
+    decode_segments_count: int = 1
+    # the minimum number of frames per segment when decoding in parallel
+    decode_segment_min_frames: int = 250
+    # serve frames of uncompressed and MJPEG AVI files directly from the file, without ffmpeg
+    use_avi_reader: bool = True
+    # transcode-once store of frames, `decoder_frame_store.FrameStore`; None - frames are decoded on every read
+    frame_store = None
+    # (width, height) to scale frames to in the frame store; None - size of the video or of the crop rect
+    frame_store_size: Optional[Tuple[int, int]] = None
+    # pixel format of frames in the frame store: `rgb24` or `gray`
+    frame_store_pix_fmt: str = 'rgb24'
+    # directory of lossless proxy videos made by `make_proxy`; a proxy is read instead of its video when exists
+    proxy_dir: Optional[str] = None
+    # frames count decoded at once by `get_trace`
+    trace_chunk_frames_count: int = 250
+    # crop frames by the track of face boxes of the video, see `get_face_boxes_path`; a track alone does not crop
+    use_face_boxes: bool = False
+    # (width, height) of frames cropped by face boxes track; None - size of the first box
+    face_boxes_size: Optional[Tuple[int, int]] = None
+    # extension of face boxes track next to the video file, when session metadata has no path of the track
+    face_boxes_extension: str = '.boxes.txt'
+
     def __init__(self, session_metadata, channel_record, title='video'):
         super().__init__(session_metadata, channel_record, title)
         if type(self.channel_record) is dict and 'video_path' in self.channel_record:
@@ -915,22 +1336,228 @@ class VideoChannel(IrregularFPSChannel, ABC):
             self.session_metadata_crop_rect_key = self.channel_record['crop_rect']
         else:
             self.session_metadata_crop_rect_key = 'crop_rect'
+        if type(self.channel_record) is dict and 'face_boxes_path' in self.channel_record:
+            self.session_metadata_face_boxes_path_key = self.channel_record['face_boxes_path']
+        else:
+            self.session_metadata_face_boxes_path_key = 'face_boxes_path'
         self.video_path = None
         self.crop_rect = None
+        self.decoder = None
+
+    @classmethod
+    def get_decoding_params(cls):
+        """ Settings decoded frames depend on, e.g. to fingerprint HR estimated by frames of the channel """
+        params = {'decoder_title': cls.decoder_title, 'use_avi_reader': cls.use_avi_reader,
+                  'use_face_boxes': cls.use_face_boxes, 'face_boxes_size': cls.face_boxes_size}
+        if cls.frame_store is not None:
+            params.update({'frame_store_size': cls.frame_store_size, 'frame_store_pix_fmt': cls.frame_store_pix_fmt})
+        return params
+
+    def get_decoder(self) -> VideoDecoder:
+        if self.decoder is None:
+            self.decoder = self._get_decoder()
+        return self.decoder
 
     def get_video_resolution(self):
         return self._prv_get_video_size_with_rotation()
         # return {'width': self.get_metadata()['width'], 'height': self.get_metadata()['height']}
 
+    def get_key_frame_indices(self):
+        return self.get_decoder().get_key_frame_indices()
+
     def get_crop_rect(self):
         if self.crop_rect is None:
             self.crop_rect = self._get_crop_rect()
         return self.crop_rect
 
+    def get_face_boxes_path(self):
+        """ Path of the track of face boxes, see `decoder_face_boxes.load_face_boxes`, or None if there is no track """
+        return self._get_face_boxes_path()
+
+    def get_roi_frames(self, frame_index_start, frames_count, crop_rects):
+        """
+        :return: (frames, height, width, channels) arrays of `crop_rects` of frames of the channel,
+            views of frames decoded once cropped to the union of the rects
+        """
+        decoder = self.get_decoder()
+        crop_rect = self.get_crop_rect()
+        x_offset, y_offset = (crop_rect['x'], crop_rect['y']) if crop_rect is not None else (0, 0)
+        video_rects = [{'x': rect['x'] + x_offset, 'y': rect['y'] + y_offset, 'w': rect['w'], 'h': rect['h']}
+                       for rect in crop_rects]
+        if decoder.supports_crop_rect:
+            x_start = min(rect['x'] for rect in video_rects)
+            y_start = min(rect['y'] for rect in video_rects)
+            x_end = max(rect['x'] + rect['w'] for rect in video_rects)
+            y_end = max(rect['y'] + rect['h'] for rect in video_rects)
+            union_rect = {'x': x_start, 'y': y_start, 'w': x_end - x_start, 'h': y_end - y_start}
+            frame_rects = [{'x': rect['x'] - x_start, 'y': rect['y'] - y_start, 'w': rect['w'], 'h': rect['h']}
+                           for rect in video_rects]
+            frame_shape = decoder.get_frame_shape(union_rect)
+        else:
+            union_rect = None
+            frame_shape = decoder.get_frame_shape()
+            frame_rects = [self._prv_get_decoded_rect(rect, decoder.get_source_rect(), frame_shape)
+                           for rect in video_rects]
+        frames = numpy.asarray(decoder.get_frames(frame_index_start, frames_count, crop_rect=union_rect))
+        if len(frames) == 0:
+            return [numpy.empty((0, rect['h'], rect['w']) + tuple(frame_shape[2:]), dtype=numpy.uint8)
+                    for rect in frame_rects]
+        return [frames[:, rect['y']: rect['y'] + rect['h'], rect['x']: rect['x'] + rect['w']] for rect in frame_rects]
+
+    def get_roi_frames_by_sync_time(self, sync_time, time_duration, crop_rects):
+        frame_index_range = self.get_frame_index_range_by_sync_time(sync_time, time_duration)
+        if frame_index_range is None:
+            return None
+        return self.get_roi_frames(*frame_index_range, crop_rects)
+
+    def get_trace(self, frame_index_start=0, frames_count=None, crop_rects=None, grid=None, masks=None,
+                  downscale_grid=False, polygons=None):
+        """
+        Reduces frames to (frames, regions, channels) float32 means of regions given in coordinates of frames
+        of the channel, the whole frame if no regions are given, decoding frames chunk by chunk.
+        """
+        if frames_count is None:
+            frames_count = self.get_frames_count() - frame_index_start
+        decoder = self.get_decoder()
+        crop_rect = self.get_crop_rect()
+        size = (grid[1], grid[0]) if grid is not None and downscale_grid else None
+        frame_shape = decoder.get_frame_shape(crop_rect)
+        channels_count = frame_shape[2] if len(frame_shape) == 3 else 1
+        regions_count = utils_trace.get_regions_count(crop_rects, grid, masks, polygons)
+        trace_chunks = [numpy.empty((0, regions_count, channels_count), dtype=numpy.float32)]
+        frames_traced = 0
+        for frames in decoder.iter_frames(frame_index_start, frames_count, self.trace_chunk_frames_count,
+                                          crop_rect=crop_rect, size=size):
+            if size is not None:
+                frames = utils_trace.as_frames_array(frames)
+                trace_chunks.append(frames.reshape(len(frames), grid[0] * grid[1], frames.shape[-1]))
+            else:
+                chunk_polygons = None
+                if polygons is not None:
+                    chunk_polygons = [region_polygons[frames_traced: frames_traced + len(frames)]
+                                      for region_polygons in polygons]
+                trace_chunks.append(utils_trace.get_spatial_means(frames, crop_rects, grid, masks, chunk_polygons))
+            frames_traced += len(frames)
+        return numpy.concatenate(trace_chunks)
+
+    def make_proxy(self, proxy_dir=None, crop_rect=None, size=None, codec='utvideo'):
+        """ :return: path of lossless intra-only proxy video of the video, optionally cropped and downscaled """
+        if proxy_dir is None:
+            proxy_dir = self.proxy_dir
+        if crop_rect is None:
+            crop_rect = self.get_crop_rect()
+        video_path = self._prv_get_video_path()
+        source_decoder = self._prv_get_source_decoder()
+        try:
+            proxy_path = make_proxy_video(source_decoder, get_proxy_path(proxy_dir, video_path), crop_rect=crop_rect,
+                                          size=size, codec=codec)
+        finally:
+            source_decoder.close()
+        self.purge_resources()  # the proxy is read from now on, if it is in `proxy_dir` of the channel
+        return proxy_path
+
     # abstract - to override
 
+    def _get_decoder(self):
+        # proxy frames are already cropped and scaled, so the frame store is not applied on top of them
+        decoder = self._prv_get_proxy_decoder()
+        if decoder is not None:
+            return decoder
+        decoder = self._prv_get_source_decoder()
+        face_boxes_path = self.get_face_boxes_path() if self.use_face_boxes else None
+        if face_boxes_path is not None:
+            # boxes replace the crop rect; they are cropped from decoded frames, so the frame store is not applied
+            return FaceBoxesDecoder(decoder, face_boxes_path, size=self.face_boxes_size)
+        if self.frame_store is not None:
+            return self.frame_store.get_decoder(decoder, crop_rect=self.get_crop_rect(), size=self.frame_store_size,
+                                                pix_fmt=self.frame_store_pix_fmt)
+        return decoder
+
     def _get_crop_rect(self):
         if self.session_metadata_crop_rect_key in self.session_metadata:
             crop_rect = self.session_metadata[self.session_metadata_crop_rect_key]
             return crop_rect
         return None
+
+    def _get_data_array(self):
+        """ Frames are not kept as a single array, subclasses may reduce them to a signal, e.g. by `get_trace` """
+        raise TypeError(f'{self.__class__.__name__} has no data array, see `get_trace`')
+
+    def _get_face_boxes_path(self):
+        if self.session_metadata_face_boxes_path_key in self.session_metadata:
+            return self.session_metadata[self.session_metadata_face_boxes_path_key]
+        face_boxes_path = os.path.splitext(self._prv_get_video_path())[0] + self.face_boxes_extension
+        return face_boxes_path if os.path.exists(face_boxes_path) else None
+
+
+class LiveVideoChannel(VideoChannel, ABC):
+    """
+    Video channel of a video which is still being written, decoded by `LiveDecoder` as frames arrive.
+    Frames count and timestamps are not cached, they grow until the stream ends.
+    """
+
+    # abstract - implementations
+
+    def _get_decoder(self):
+        return LiveDecoder(self._prv_get_video_path(), follow=self.live_follow, follow_timeout=self.live_follow_timeout,
+                           analyze_duration=self.live_analyze_duration,
+                           max_buffered_frames=self.live_max_buffered_frames)
+
+    # public
+
+    # keep reading the video file at its end, as it grows; not needed for FIFOs
+    live_follow: bool = True
+    # seconds without new data of the followed file to end the stream, None - never
+    live_follow_timeout: Optional[float] = 5.0
+    # seconds of the input analysed to detect streams, None - ffmpeg default; short durations reduce the latency
+    live_analyze_duration: Optional[float] = None
+    # the minimum count of the latest frames kept in memory, None - all frames
+    live_max_buffered_frames: Optional[int] = None
+    # the maximum seconds a decoded frame waits for its chunk to fill in `iter_frames`, None - unlimited
+    live_max_latency: Optional[float] = 0.1
+
+    def get_frames_count(self):
+        """ Count of frames decoded so far """
+        return self.get_decoder().get_frames_count()
+
+    def get_frame_timestamps(self):
+        """ Timestamps of frames decoded so far """
+        return self.get_decoder().get_frame_timestamps()
+
+    def get_time_duration(self):
+        frames_count = self.get_frames_count()
+        if frames_count == 0:
+            return 0
+        return self._get_time_from_frame_index(frames_count - 1) - self.get_time_start()
+
+    def get_time_array(self):
+        """ Timestamps of frames decoded so far as float64 array, extended by timestamps of new frames """
+        frame_timestamps = self.get_frame_timestamps()
+        if self.time_array is None:
+            self.time_array = numpy.empty((0,), dtype=numpy.float64)
+        if len(self.time_array) < len(frame_timestamps):
+            new_times = numpy.asarray([float(timestamp) for timestamp in frame_timestamps[len(self.time_array):]],
+                                      dtype=numpy.float64)
+            self.time_array = numpy.concatenate([self.time_array, new_times])
+        return self.time_array
+
+    def get_is_finished(self):
+        """ True, if the stream has ended and all its frames are decoded """
+        return self.get_decoder().get_is_finished()
+
+    def wait_for_sync_time(self, sync_time, timeout=None):
+        """ :return: True, if a frame at or after `sync_time` is decoded before the stream ends or timeout """
+        return self.get_decoder().wait_for_time(self.get_time_by_sync_time(sync_time), timeout)
+
+    def iter_frames(self, frame_index_start=0, frames_count=None, chunk_frames_count=None, max_latency=None):
+        """ :return: generator of dicts with `index`, `time` and `data` arrays of chunks of frames as they arrive """
+        if chunk_frames_count is None:
+            chunk_frames_count = self.trace_chunk_frames_count
+        if max_latency is None:
+            max_latency = self.live_max_latency
+        frame_index = frame_index_start
+        for frames in self.get_decoder().iter_frames(frame_index_start, frames_count, chunk_frames_count,
+                                                     crop_rect=self.get_crop_rect(), max_latency=max_latency):
+            indices = numpy.arange(frame_index, frame_index + len(frames))
+            yield {'index': indices, 'time': self.get_time_array()[indices], 'data': frames}
+            frame_index += len(frames)
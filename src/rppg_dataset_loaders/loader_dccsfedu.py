@@ -1,12 +1,15 @@
 import json
 import os
 import re
+from typing import Optional, Tuple
 
 import numpy as np
 
 from .loader_base import DatasetLoader
+from .lockstep_reader import LockstepVideoReader
 from .loader_base import VideoAndPPGSession
 from .loader_base import VideoChannel
+from .utils_signal import estimate_by_windows
 
 
 # TODO Koster: fix frame rotation (frames are rotated, but 'rotation' field in get_video_resolution is '0')
@@ -60,10 +63,52 @@ class DCCSFEDUFingerChannel(VideoChannel):
     def _get_sync_time_offset(self):
         return 0
 
+    def _get_data_array(self):
+        return self.get_ppg_signal()
+
     # public
 
+    # (rows, cols) of the grid the finger video is downscaled to while decoding, for a faster PPG signal;
+    # None - exact mean of all pixels of every frame, the reference signal of the dataset
+    ppg_signal_grid: Optional[Tuple[int, int]] = None
+
     def __init__(self, session_metadata):
         super().__init__(session_metadata, {"video_path": "finger_path"})
+        self.ppg_signal = None
+        self.ppg_timestamps = None
+        self.fps = None
+
+    def get_ppg_signal(self):
+        """ Mean of `green` component of every frame, or of its only component, computed once for the whole video """
+        if self.ppg_signal is None:
+            if self.ppg_signal_grid is None:
+                trace = self.get_trace()
+            else:
+                trace = self.get_trace(grid=self.ppg_signal_grid, downscale_grid=True)
+            # frames of the frame store may be `gray`
+            self.ppg_signal = trace[:, :, 1 if trace.shape[2] > 1 else 0].mean(axis=1)
+        return self.ppg_signal
+
+    def get_ppg_timestamps(self):
+        if self.ppg_timestamps is None:
+            self.ppg_timestamps = np.asarray(self.get_frame_timestamps(), dtype=np.float64)
+        return self.ppg_timestamps
+
+    def get_fps(self):
+        """ Average FPS of the whole video """
+        if self.fps is None:
+            self.fps = 1.0 / float(np.mean(np.diff(self.get_ppg_timestamps())))
+        return self.fps
+
+    def get_ppg_signal_by_sync_time(self, sync_time, time_duration):
+        """ :return: (ppg_signal, ppg_timestamps) slices of the time range, or None if it has no frames """
+        frame_index_range = self.get_frame_index_range_by_sync_time(sync_time, time_duration)
+        if frame_index_range is None:
+            return None
+        frame_index_start, frames_count = frame_index_range
+        frame_index_end = frame_index_start + frames_count
+        return (self.get_ppg_signal()[frame_index_start: frame_index_end],
+                self.get_ppg_timestamps()[frame_index_start: frame_index_end])
 
 
 class DCCSFEDUVideoChannel(VideoChannel):
@@ -116,34 +161,64 @@ class DCCSFEDUSession(VideoAndPPGSession):
     def _get_estimated_hr_by_sync_time(self, sync_time, time_duration):
         # get PPG signal
         ppg_channel = self._prv_get_ppg_channel()
-        ppg_data = ppg_channel.get_frames_by_sync_time(sync_time, time_duration)
-        ppg_signal = np.asarray([np.mean(frame['data'], axis=(0, 1)) for frame in ppg_data])
-        ppg_signal = ppg_signal[:, 1]  # use `green` component
+        ppg_signal_and_timestamps = ppg_channel.get_ppg_signal_by_sync_time(sync_time, time_duration)
+        if ppg_signal_and_timestamps is None:
+            return None
+        ppg_signal, _ = ppg_signal_and_timestamps
         eps = 1e-5
         ppg_signal_norm = (ppg_signal - ppg_signal.mean(axis=0) + eps) / (ppg_signal.std(axis=0) + eps)
         ppg_signal_norm_neg = -ppg_signal_norm
 
         # get FPS
-        # TODO: calculate FPS once for the whole signal
-        timestamps = [float(frame['time']) - float(ppg_data[0]['time']) for frame in ppg_data]
-        time_diff = np.diff(timestamps)
-        spf = float(np.mean(time_diff))
-        fps = 1.0 / spf
+        fps = ppg_channel.get_fps()
 
         freq_range = [self.min_hr_bpm / 60.0, self.max_hr_bpm / 60.0]
         prominence = 1.0
-        hr_hz = VideoAndPPGSession.estimate_hr_by_ppg_signal(input_signal=ppg_signal_norm_neg,
-                                                             fps=fps,
-                                                             freq_range=freq_range,
-                                                             prominence=prominence,
-                                                             consider_neighboring_peaks=True)
+        hr_hz = type(self).estimate_hr_by_ppg_signal(input_signal=ppg_signal_norm_neg,
+                                                     fps=fps,
+                                                     freq_range=freq_range,
+                                                     prominence=prominence,
+                                                     consider_neighboring_peaks=True)
         if hr_hz is None:
             return None
         return hr_hz * 60.0
 
+    def _get_estimated_hr_series(self, window_sync_times, window):
+        ppg_channel = self._prv_get_ppg_channel()
+        fps = ppg_channel.get_fps()
+        freq_range = [self.min_hr_bpm / 60.0, self.max_hr_bpm / 60.0]
+        prominence = 1.0
+        eps = 1e-5
+
+        def estimate_hr(ppg_windows):
+            ppg_windows_norm = (ppg_windows - ppg_windows.mean(axis=1, keepdims=True) + eps) / \
+                               (ppg_windows.std(axis=1, keepdims=True) + eps)
+            ppg_windows_norm_neg = -ppg_windows_norm
+            return self.estimate_hr_by_ppg_windows(ppg_windows_norm_neg,
+                                                   fps=fps,
+                                                   freq_range=freq_range,
+                                                   prominence=prominence,
+                                                   consider_neighboring_peaks=True) * 60.0
+
+        # the signal is computed once, windows are gathered from it
+        return estimate_by_windows(ppg_channel.get_ppg_timestamps() + float(ppg_channel.get_sync_time_offset()),
+                                   ppg_channel.get_ppg_signal(), window_sync_times, int(round(window * fps)),
+                                   estimate_hr)
+
+    def _get_hr_estimator_params(self):
+        params = super()._get_hr_estimator_params()
+        params.update({'ppg_signal_grid': DCCSFEDUFingerChannel.ppg_signal_grid,
+                       'finger_decoding': DCCSFEDUFingerChannel.get_decoding_params()})
+        return params
+
     def get_ppg_channel(self):
         return self._prv_get_ppg_channel()
 
+    def get_face_and_finger_reader(self, chunk_frames_count=250, max_time_difference=None):
+        """ Lockstep reader of face and finger videos, its rows are frames of the face video """
+        return LockstepVideoReader([self.get_video_channel(), self._prv_get_ppg_channel()],
+                                   chunk_frames_count=chunk_frames_count, max_time_difference=max_time_difference)
+
     # private
 
     # noinspection PyUnusedLocal
@@ -157,3 +232,6 @@ class DCCSFEDUSession(VideoAndPPGSession):
         return os.path.join(self.get_path(), self.session_record['finger'])
 
     # public
+
+    # the finger video gets darker at systoles
+    ppg_signal_inverted = True
@@ -6,6 +6,7 @@ from .loader_base import DatasetLoader
 from .loader_base import RegularFPSChannel
 from .loader_base import VideoAndPPGSession
 from .loader_base import VideoChannel
+from .utils_signal import estimate_by_windows
 
 
 class DEAPDatasetLoader(DatasetLoader):
@@ -139,16 +140,30 @@ class DEAPSession(VideoAndPPGSession):
 
     def _get_estimated_hr_by_sync_time(self, sync_time, time_duration):
         ppg_channel = self._prv_get_ppg_channel()
+        if self.filter_ppg_signal:
+            ppg_channel = ppg_channel.as_filtered(self.min_hr_bpm / 60.0, self.max_hr_bpm / 60.0)
         ppg_data = ppg_channel.get_frames_by_sync_time(sync_time, time_duration)
         ppg_signal = [sample['data'] for sample in ppg_data]
         fps = ppg_channel.get_sample_frequency()
         freq_range = [self.min_hr_bpm / 60.0, self.max_hr_bpm / 60.0]
 
-        hr_hz = VideoAndPPGSession.estimate_hr_by_ppg_signal(input_signal=ppg_signal, fps=fps, freq_range=freq_range)
+        hr_hz = type(self).estimate_hr_by_ppg_signal(input_signal=ppg_signal, fps=fps, freq_range=freq_range)
         if not hr_hz:
             return None
         return hr_hz * 60.0
 
+    def _get_estimated_hr_series(self, window_sync_times, window):
+        ppg_channel = self._prv_get_ppg_channel()
+        if self.filter_ppg_signal:
+            ppg_channel = ppg_channel.as_filtered(self.min_hr_bpm / 60.0, self.max_hr_bpm / 60.0)
+        fps = ppg_channel.get_sample_frequency()
+        freq_range = [self.min_hr_bpm / 60.0, self.max_hr_bpm / 60.0]
+        # the signal is fetched once, windows are gathered from it
+        return estimate_by_windows(
+            ppg_channel.get_time_array() + float(ppg_channel.get_sync_time_offset()), ppg_channel.get_data_array(),
+            window_sync_times, int(round(window * fps)),
+            lambda ppg_windows: self.estimate_hr_by_ppg_windows(ppg_windows, fps, freq_range) * 60.0)
+
     def get_ppg_channel(self):
         return self._prv_get_ppg_channel()
 
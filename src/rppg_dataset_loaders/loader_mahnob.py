@@ -1,5 +1,10 @@
 import csv
+import hashlib
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
 
 import numpy
 import pyedflib
@@ -64,6 +69,16 @@ class MahnobBDFChannel(RegularFPSChannel):
     def _get_sync_time_offset(self):
         return 0  # todo
 
+    def _get_data_array(self):
+        signal = numpy.zeros((self.get_frames_count(),), dtype='float64')
+        with pyedflib.EdfReader(self._prv_get_bdf_path()) as e:
+            e.readsignal(self.get_metadata()['channel_index'], 0, self.get_frames_count(), signal)
+        return signal
+
+    def _purge_resources(self):
+        super()._purge_resources()
+        self.r_peaks = None
+
     # private
 
     def _prv_get_channel_key(self):
@@ -81,21 +96,82 @@ class MahnobBDFChannel(RegularFPSChannel):
         return self.session_metadata['bdf_path']
 
     def _prv_get_channel_data(self):
-        channel_data = []
-        signal = numpy.zeros((self.get_frames_count(),), dtype='float64')
-        channel_index = self.get_metadata()['channel_index']
         sample_frequency = self.get_metadata()['sample_frequency']
-        with pyedflib.EdfReader(self._prv_get_bdf_path()) as e:
-            e.readsignal(channel_index, 0, self.get_frames_count(), signal)
-            for i in range(len(signal)):
-                channel_data.append({'index': i, 'time': (i / sample_frequency), 'data': signal[i]})
-        return channel_data
+        return [{'index': i, 'time': (i / sample_frequency), 'data': value}
+                for i, value in enumerate(self.get_data_array().tolist())]
+
+    def _prv_get_r_peaks_path(self):
+        bdf_path = os.path.abspath(self._prv_get_bdf_path())
+        bdf_name = os.path.splitext(os.path.basename(bdf_path))[0]
+        # BDF files of different sessions may have the same names
+        digest = hashlib.sha1(bdf_path.encode('utf8')).hexdigest()[:16]
+        return os.path.join(self.r_peaks_dir, f'{digest}_{bdf_name}.{self._prv_get_channel_key()}.rpeaks.npz')
+
+    def _prv_get_bdf_fingerprint(self):
+        stat = os.stat(self._prv_get_bdf_path())
+        return numpy.asarray([stat.st_size, stat.st_mtime_ns], dtype=numpy.int64)
+
+    def _prv_get_qrs_detector_fingerprint(self):
+        return json.dumps(self.get_qrs_detector_params(), sort_keys=True)
+
+    def _prv_load_r_peaks(self):
+        r_peaks_path = self._prv_get_r_peaks_path() if self.r_peaks_dir is not None else None
+        if r_peaks_path is not None and os.path.exists(r_peaks_path):
+            with numpy.load(r_peaks_path) as r_peaks_file:
+                # peaks are outdated, if the BDF file, the detector or its parameters were changed
+                if numpy.array_equal(r_peaks_file['bdf_fingerprint'], self._prv_get_bdf_fingerprint()) and \
+                        str(r_peaks_file['qrs_detector']) == self._prv_get_qrs_detector_fingerprint():
+                    return r_peaks_file['r_peaks']
+        r_peaks = numpy.asarray(utils_ekg.estimate_hr_and_peaks(self.get_sample_frequency(), self.get_data_array(),
+                                                                self.qrs_detector_title,
+                                                                **self.qrs_detector_params)['peaks'],
+                                dtype=numpy.int64)
+        if r_peaks_path is not None:
+            os.makedirs(os.path.dirname(r_peaks_path), exist_ok=True)
+            numpy.savez(r_peaks_path, r_peaks=r_peaks, bdf_fingerprint=self._prv_get_bdf_fingerprint(),
+                        qrs_detector=self._prv_get_qrs_detector_fingerprint())
+        return r_peaks
 
     # public
 
+    # directory to persist R-peaks of records in, None - R-peaks are kept in memory only
+    r_peaks_dir: Optional[str] = None
+    # detector of R-peaks, `QRSDetectorTitle.MNE` requires `mne` package
+    qrs_detector_title: utils_ekg.QRSDetectorTitle = utils_ekg.QRSDetectorTitle.Native
+    # keyword parameters of the detector of R-peaks, e.g. `threshold_ratio` of `utils_ekg.detect_qrs_peaks`;
+    # read-only, replace the mapping to change them
+    qrs_detector_params: Mapping[str, Any] = MappingProxyType({})
+
     def __init__(self, session_metadata, channel_record):
         super().__init__(session_metadata, channel_record, channel_record['channel_key'].__str__)
         self.channel_index = None
+        self.r_peaks = None
+
+    @classmethod
+    def get_qrs_detector_params(cls):
+        """ :return: detector of R-peaks and all its parameters, see `utils_ekg.get_qrs_detector_params` """
+        return utils_ekg.get_qrs_detector_params(cls.qrs_detector_title, **cls.qrs_detector_params)
+
+    def get_r_peaks(self):
+        """ :return: sorted int64 sample indices of R-peaks of the whole record, persisted in `r_peaks_dir`, if set """
+        if self.r_peaks is None:
+            self.r_peaks = self._prv_load_r_peaks()
+        return self.r_peaks
+
+    def get_hr_and_peaks_by_sync_time(self, sync_time, time_duration):
+        """ :return: dict as `utils_ekg.estimate_hr_and_peaks` returns, computed from R-peaks within the window """
+        frame_index_range = self.get_frame_index_range_by_sync_time(sync_time, time_duration)
+        if frame_index_range is None:
+            return {'hr': 0., 'peaks': numpy.zeros((0,), dtype=numpy.int64)}
+        return utils_ekg.get_hr_and_peaks_in_range(self.get_sample_frequency(), self.get_r_peaks(),
+                                                   *frame_index_range)
+
+    def get_hr_series_by_sync_times(self, sync_times, time_duration):
+        """ :return: HR of windows starting at `sync_times`, see `utils_ekg.get_hr_by_peaks_in_ranges` """
+        # the same frame ranges as of `get_hr_and_peaks_by_sync_time`
+        frame_index_starts, frames_counts = self.get_frame_index_ranges_by_sync_times(sync_times, time_duration)
+        return utils_ekg.get_hr_by_peaks_in_ranges(self.get_sample_frequency(), self.get_r_peaks(),
+                                                   frame_index_starts, frame_index_starts + frames_counts)
 
 
 class MahnobVideoChannel(VideoChannel):
@@ -112,6 +188,7 @@ class MahnobVideoChannel(VideoChannel):
 
 
 class MahnobSession(VideoAndPPGSession):
+    """ HR is estimated by R-peaks of ECG channels detected once over the whole record """
 
     # abstract - implementations
 
@@ -145,20 +222,38 @@ class MahnobSession(VideoAndPPGSession):
         return self._prv_get_bdf_channel({'channel_key': 'EXG1'})
 
     def _get_estimated_hr_by_sync_time(self, sync_time, time_duration):
-        hr_channels_names = ['EXG1', 'EXG2', 'EXG3']
-        hr_channels = map(
-            lambda channel_name: self._prv_get_bdf_channel({'channel_key': channel_name}), hr_channels_names
-        )
-        hr_channels_estimates = []
-        for channel in hr_channels:
+        hr_channels = self._prv_get_hr_channels_with_r_peaks()
+        hr_channels_estimates = [channel.get_hr_and_peaks_by_sync_time(sync_time, time_duration)
+                                 for channel in hr_channels]
+        hr = utils_ekg.find_best_hr_estimation(hr_channels_estimates)
+        return hr if hr != 0 else None  # 0 is unknown HR
+
+    def _get_hr_estimator_params(self):
+        params = super()._get_hr_estimator_params()
+        params.update({'hr_channel_keys': list(self.hr_channel_keys),
+                       'qrs_detector': MahnobBDFChannel.get_qrs_detector_params()})
+        return params
+
+    def _get_estimated_hr_series(self, window_sync_times, window):
+        hr_channels = self._prv_get_hr_channels_with_r_peaks()
+        hr_channels_series = [channel.get_hr_series_by_sync_times(window_sync_times, window)
+                              for channel in hr_channels]
+        hr_values = numpy.asarray([utils_ekg.find_best_hr_estimation([{'hr': hr} for hr in hr_channels_values])
+                                   for hr_channels_values in zip(*hr_channels_series)], dtype=numpy.float64)
+        hr_values[hr_values == 0] = numpy.nan  # 0 is unknown HR
+        return hr_values
+
+    def _get_signal_quality_series(self, window_sync_times, window):
+        # QRS energy pulses at every beat, so its spectrum has peaks at HR frequency and harmonics as PPG does;
+        # the quality of a window is the best one of ECG channels, as HR is estimated by the best channel
+        channels_quality = []
+        for channel in self._prv_get_hr_channels():
             sample_frequency = channel.get_sample_frequency()
-            frames_in_range = channel.get_frames_by_sync_time(sync_time, time_duration)
-            frames_count_in_range = len(frames_in_range)
-            signal = numpy.zeros((frames_count_in_range,), dtype='float64')
-            for i in range(len(frames_in_range)):
-                signal[i] = frames_in_range[i]['data']
-            hr_channels_estimates.append(utils_ekg.estimate_hr_and_peaks(sample_frequency, signal))
-        return utils_ekg.find_best_hr_estimation(hr_channels_estimates)
+            qrs_energy = utils_ekg.get_qrs_energy(sample_frequency, channel.get_data_array())
+            channels_quality.append(self._prv_get_signal_quality_by_windows(
+                channel.get_time_array() + float(channel.get_sync_time_offset()), qrs_energy, sample_frequency,
+                window_sync_times, window))
+        return numpy.fmax.reduce(channels_quality, axis=0)
 
     # private
 
@@ -174,4 +269,18 @@ class MahnobSession(VideoAndPPGSession):
     def _prv_get_bdf_channel(self, channel_record):
         return self.get_channel('bdf', channel_record)
 
+    def _prv_get_hr_channels(self):
+        return [self._prv_get_bdf_channel({'channel_key': channel_key}) for channel_key in self.hr_channel_keys]
+
+    def _prv_get_hr_channels_with_r_peaks(self):
+        hr_channels = self._prv_get_hr_channels()
+        if any(channel.r_peaks is None for channel in hr_channels):
+            # R-peaks of the whole record are detected once per channel, channels are processed in parallel
+            with ThreadPoolExecutor(max_workers=len(hr_channels)) as executor:
+                list(executor.map(lambda channel: channel.get_r_peaks(), hr_channels))
+        return hr_channels
+
     # public
+
+    # ECG channels to estimate HR by
+    hr_channel_keys = ('EXG1', 'EXG2', 'EXG3')
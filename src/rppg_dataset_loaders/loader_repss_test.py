@@ -1,4 +1,7 @@
 import os
+from typing import Dict, List
+
+import numpy
 
 from .loader_base import DatasetLoader
 from .loader_base import IrregularFPSChannel
@@ -154,7 +157,51 @@ class REPSS_TESTSession(VideoAndPPGSession):
     def _prv_get_landmark_channel(self):
         return self.get_channel('landmark')
 
+    def _prv_get_landmarks_array(self, frame_index_start, frames_count):
+        landmark_frames = self._prv_get_landmark_channel().get_frames(frame_index_start, frames_count)
+        landmarks_count = max([len(frame['data']) for frame in landmark_frames], default=0)
+        landmarks = numpy.full((len(landmark_frames), landmarks_count, 2), numpy.nan)
+        for i, frame in enumerate(landmark_frames):
+            if 0 < len(frame['data']) == landmarks_count:  # frames without detected face have no landmarks
+                landmarks[i] = frame['data']
+        return landmarks
+
+    def _prv_get_roi_polygons(self, landmarks, roi_title):
+        if roi_title == 'forehead':
+            # there are no landmarks above eyebrows: they are shifted up from the nose tip
+            eyebrows = landmarks[:, self.forehead_eyebrow_landmark_indices]
+            shift = eyebrows.mean(axis=1, keepdims=True) - landmarks[:, [self.forehead_nose_landmark_index]]
+            return numpy.concatenate([eyebrows, (eyebrows + shift * self.forehead_height_ratio)[:, ::-1]], axis=1)
+        return landmarks[:, self.roi_landmark_indices[roi_title]]
+
     # public
 
+    # polygons of facial ROIs by indices of their vertices in the 68-point landmark scheme
+    roi_landmark_indices: Dict[str, List[int]] = {
+        'left_cheek': [1, 2, 3, 4, 48, 31, 41],
+        'right_cheek': [15, 14, 13, 12, 54, 35, 46],
+    }
+    # `forehead` ROI spans eyebrows shifted up by this ratio of the distance from the nose tip to eyebrows
+    forehead_eyebrow_landmark_indices: List[int] = list(range(17, 27))
+    forehead_nose_landmark_index: int = 33
+    forehead_height_ratio: float = 0.5
+
     def get_landmark_channel(self):
         return self._prv_get_landmark_channel()
+
+    def get_landmark_roi_trace(self, roi_titles=('forehead', 'left_cheek', 'right_cheek'), frame_index_start=0,
+                               frames_count=None):
+        """ :return: (frames, rois, 3) float32 means of facial ROIs of landmarks, NaN for frames without them """
+        video_channel = self.get_video_channel()
+        if frames_count is None:
+            frames_count = video_channel.get_frames_count() - frame_index_start
+        landmarks = self._prv_get_landmarks_array(frame_index_start, frames_count)
+        if landmarks.shape[1] == 0:
+            # no face is detected in any frame, so there is nothing to decode
+            frame_shape = video_channel.get_decoder().get_frame_shape(video_channel.get_crop_rect())
+            channels_count = frame_shape[2] if len(frame_shape) == 3 else 1
+            return numpy.full((len(landmarks), len(roi_titles), channels_count), numpy.nan, dtype=numpy.float32)
+        if landmarks.shape[1] <= self.forehead_nose_landmark_index:
+            raise ValueError(f'68 landmarks per frame are expected, got {landmarks.shape[1]}')
+        polygons = [self._prv_get_roi_polygons(landmarks, roi_title) for roi_title in roi_titles]
+        return video_channel.get_trace(frame_index_start, len(landmarks), polygons=polygons)
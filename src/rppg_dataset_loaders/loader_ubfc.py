@@ -55,6 +55,10 @@ class UBFCGroundTruthChannel(RegularFPSChannel):
     def _get_sync_time_offset(self):
         return 0
 
+    def _get_data_array(self):
+        # all values of the file, also for the channel without frame timestamps
+        return numpy.asarray([frame['data'] for frame in self.get_channel_data()], dtype=numpy.float64)
+
     # private
 
     def _prv_get_channel_data(self):
@@ -158,24 +162,35 @@ class UBFCSession(VideoAndPPGSession):
 
     def _get_estimated_hr_by_sync_time(self, sync_time, time_duration):
         ground_truth_channel = self._prv_get_ground_truth_channel()
-        ground_truth_frames = ground_truth_channel.get_frames_by_sync_time(sync_time, time_duration)
-        hr_values = list(map(lambda ground_truth_frame: ground_truth_frame['data'], ground_truth_frames))
-        hr_values = self.filter_hr_values(hr_values=hr_values)
-        if len(hr_values) > 0:
-            # return average of found HR values as `ground_truth` HR
-            return numpy.mean(hr_values)
-        else:
-            # No appropriate HR values were found; return session average HR value
-            return self.mean_hr
+        frame_index_range = ground_truth_channel.get_frame_index_range_by_sync_time(sync_time, time_duration)
+        if frame_index_range is not None:
+            # average of HR values within [`min_hr_bpm`, `max_hr_bpm`] as `ground_truth` HR, by the prefix-sum index
+            hr_means, hr_counts = ground_truth_channel.get_in_range_means([frame_index_range[0]],
+                                                                          [frame_index_range[1]],
+                                                                          self.min_hr_bpm, self.max_hr_bpm)
+            if hr_counts[0] > 0:
+                return float(hr_means[0])
+        # No appropriate HR values were found; return session average HR value
+        return self.mean_hr
+
+    def _get_estimated_hr_series(self, window_sync_times, window):
+        ground_truth_channel = self._prv_get_ground_truth_channel()
+        # the same frame ranges as of `_get_estimated_hr_by_sync_time`, HR of all of them by the prefix-sum index
+        frame_index_starts, frames_counts = ground_truth_channel.get_frame_index_ranges_by_sync_times(
+            window_sync_times, window)
+        hr_values, hr_counts = ground_truth_channel.get_in_range_means(frame_index_starts, frames_counts,
+                                                                       self.min_hr_bpm, self.max_hr_bpm)
+        # No appropriate HR values were found; session average HR value is used
+        mean_hr = numpy.nan if self.mean_hr is None else self.mean_hr
+        return numpy.where(hr_counts > 0, hr_values, mean_hr)
 
     def _get_is_valid(self):
         # Calculation of session average HR value when session is firstly read
         ground_truth_sc_channel = self._prv_get_ground_truth_sc_channel()
-        ground_truth_frames_all = ground_truth_sc_channel.get_channel_data()
-        hr_values = list(map(lambda ground_truth_frame: ground_truth_frame['data'], ground_truth_frames_all))
-        hr_values = self.filter_hr_values(hr_values=hr_values)
-        if len(hr_values) > 0:
-            self.mean_hr = numpy.mean(hr_values)
+        hr_means, hr_counts = ground_truth_sc_channel.get_in_range_means(
+            [0], [len(ground_truth_sc_channel.get_data_array())], self.min_hr_bpm, self.max_hr_bpm)
+        if hr_counts[0] > 0:
+            self.mean_hr = float(hr_means[0])
             return True
         else:
             # All `ground_truth` values were excluded; session is considered invalid
@@ -0,0 +1,123 @@
+""" Synchronized reading of several video channels, e.g. of several cameras of the same session """
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from .utils_base import get_nearest_indices
+
+
+class LockstepVideoReader(object):
+    """
+    Decodes several `VideoChannel`s in parallel threads and yields their frames matched by sync time:
+    rows are frames of the reference channel, other channels give frames with the nearest sync times.
+    """
+
+    # private
+
+    def _prv_get_sync_timestamps(self, video_channel):
+        frame_timestamps = numpy.asarray(video_channel.get_frame_timestamps(), dtype=numpy.float64)
+        return frame_timestamps + float(video_channel.get_sync_time_offset())
+
+    def _prv_read_until(self, channel_position, frame_index_first, frame_index_last):
+        """ Pulls chunks of the channel stream until the buffer holds frames up to `frame_index_last` """
+        buffer = self.buffers[channel_position]
+        buffer_index_start = self.buffer_index_starts[channel_position]
+        # frames before `frame_index_first` are not needed anymore
+        buffer = buffer[max(0, frame_index_first - buffer_index_start):]
+        buffer_index_start = max(buffer_index_start, frame_index_first)
+        chunks = [buffer]
+        buffer_index_end = buffer_index_start + len(buffer)
+        while buffer_index_end <= frame_index_last:
+            frames = next(self.streams[channel_position], None)
+            if frames is None:
+                break
+            chunks.append(numpy.asarray(frames))
+            buffer_index_end += len(frames)
+        buffer = numpy.concatenate(chunks) if len(chunks) > 1 else buffer
+        self.buffers[channel_position] = buffer
+        self.buffer_index_starts[channel_position] = buffer_index_start
+        return buffer, buffer_index_start
+
+    def _prv_open_streams(self, frame_index_starts):
+        self.streams = []
+        self.buffers = []
+        self.buffer_index_starts = []
+        for video_channel, frame_index_start in zip(self.video_channels, frame_index_starts):
+            decoder = video_channel.get_decoder()
+            frames_count = video_channel.get_frames_count() - frame_index_start
+            self.streams.append(decoder.iter_frames(frame_index_start, frames_count, self.chunk_frames_count,
+                                                    crop_rect=video_channel.get_crop_rect()))
+            frame_shape = decoder.get_frame_shape(video_channel.get_crop_rect())
+            self.buffers.append(numpy.empty((0,) + tuple(frame_shape), dtype=numpy.uint8))
+            self.buffer_index_starts.append(frame_index_start)
+
+    def _prv_close_streams(self):
+        for stream in self.streams:
+            stream.close()
+        self.streams = []
+        self.buffers = []
+        self.buffer_index_starts = []
+
+    # public
+
+    def __init__(self, video_channels, reference_channel_position=0, chunk_frames_count=250,
+                 max_time_difference=None):
+        """ :param max_time_difference: rows with a matched frame further than it, in seconds, are skipped """
+        self.video_channels = list(video_channels)
+        self.reference_channel_position = reference_channel_position
+        self.chunk_frames_count = chunk_frames_count
+        self.max_time_difference = max_time_difference
+        self.streams = []
+        self.buffers = []
+        self.buffer_index_starts = []
+        self.matched_frame_indices = None
+        self.sync_times = None
+
+    def get_matched_frame_indices(self):
+        """ :return: (sync_times, frame_indices) of rows, frame indices are a (channels, rows) array """
+        if self.matched_frame_indices is None:
+            sync_timestamps = [self._prv_get_sync_timestamps(video_channel) for video_channel in self.video_channels]
+            sync_time_start = max(timestamps[0] for timestamps in sync_timestamps)
+            sync_time_end = min(timestamps[-1] for timestamps in sync_timestamps)
+            reference_timestamps = sync_timestamps[self.reference_channel_position]
+            is_common = (reference_timestamps >= sync_time_start) & (reference_timestamps <= sync_time_end)
+            reference_indices = numpy.flatnonzero(is_common)
+            sync_times = reference_timestamps[reference_indices]
+            frame_indices = numpy.stack([get_nearest_indices(timestamps, sync_times)
+                                         for timestamps in sync_timestamps])
+            if self.max_time_difference is not None:
+                time_differences = numpy.stack([numpy.abs(timestamps[indices] - sync_times)
+                                                for timestamps, indices in zip(sync_timestamps, frame_indices)])
+                is_matched = (time_differences <= self.max_time_difference).all(axis=0)
+                sync_times, frame_indices = sync_times[is_matched], frame_indices[:, is_matched]
+            self.sync_times, self.matched_frame_indices = sync_times, frame_indices
+        return self.sync_times, self.matched_frame_indices
+
+    def iter_chunks(self):
+        """ Yields dicts with `sync_time` and (channels, rows) `index` arrays and `data` tuple of frames of channels """
+        sync_times, frame_indices = self.get_matched_frame_indices()
+        if len(sync_times) == 0:
+            return
+        channels_count = len(self.video_channels)
+        self._prv_open_streams(frame_indices[:, 0].tolist())
+        try:
+            with ThreadPoolExecutor(max_workers=channels_count) as executor:
+                for row_start in range(0, len(sync_times), self.chunk_frames_count):
+                    chunk_indices = frame_indices[:, row_start: row_start + self.chunk_frames_count]
+                    futures = [executor.submit(self._prv_read_until, channel_position,
+                                               int(chunk_indices[channel_position].min()),
+                                               int(chunk_indices[channel_position].max()))
+                               for channel_position in range(channels_count)]
+                    buffers = [future.result() for future in futures]
+                    data = []
+                    for (buffer, buffer_index_start), indices in zip(buffers, chunk_indices):
+                        positions = indices - buffer_index_start
+                        if len(positions) > 0 and positions[-1] >= len(buffer):
+                            return  # the video ended earlier than its timestamps
+                        data.append(buffer[positions])
+                    yield {'sync_time': sync_times[row_start: row_start + self.chunk_frames_count],
+                           'index': chunk_indices,
+                           'data': tuple(data)}
+        finally:
+            self._prv_close_streams()
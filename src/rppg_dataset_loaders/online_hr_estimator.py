@@ -0,0 +1,110 @@
+""" HR estimation of live signals, updated incrementally as new samples arrive """
+
+from typing import Optional, Tuple
+
+import numpy
+
+from .utils_ekg import get_psd_peak_freqs, get_welch_setup
+
+
+class OnlineHREstimator(object):
+    """
+    Estimates HR by the latest window of a live signal, as `utils_ekg.freq_welch` does, updating only
+    DFT bins around the HR band by a sliding DFT, O(new samples * bins) per update.
+    """
+
+    # private
+
+    def _prv_recompute_bins(self):
+        ordered = numpy.roll(self.buffer, -self.buffer_position)  # the oldest sample first
+        self.bins = numpy.fft.rfft(ordered)[:self.bins_count]
+        self.samples_count_since_recompute = 0
+
+    def _prv_slide_bins(self, new_samples, old_samples):
+        """ Sliding DFT by several samples at once: every sample shifts the window by one """
+        deltas = new_samples - old_samples
+        powers = numpy.arange(len(deltas), 0, -1)[:, None]
+        self.bins = self.bins * self.twiddles ** len(deltas) + deltas @ (self.twiddles[None, :] ** powers)
+
+    def _prv_get_rect_bins(self, bin_indices):
+        """ Bins of the detrended window without Hann window, other bins are conjugates of kept ones """
+        bin_indices = numpy.mod(bin_indices, self.window_length)
+        is_kept = bin_indices <= self.window_length // 2
+        kept_indices = numpy.where(is_kept, bin_indices, self.window_length - bin_indices)
+        bins = self.bins[numpy.minimum(kept_indices, self.bins_count - 1)]
+        bins = numpy.where(is_kept, bins, numpy.conj(bins))
+        return numpy.where(bin_indices == 0, 0, bins)  # constant detrending zeroes DC
+
+    # public
+
+    # samples count after which bins are recomputed from the buffer, None - the window length
+    recompute_samples_count: Optional[int] = None
+
+    def __init__(self, fps, window_duration, freq_range=(40.0 / 60.0, 240.0 / 60.0)):
+        """ :param freq_range: (freq_min, freq_max) range to search HR frequency, in Hz """
+        self.fps = float(fps)
+        self.window_length = int(round(window_duration * fps))
+        self.freq_range = (float(freq_range[0]), float(freq_range[1]))
+        _, self.freqs, self.scales, self.first_index, self.last_index = get_welch_setup(
+            self.fps, self.window_length, self.freq_range[0], self.freq_range[1])
+        # Hann window mixes neighbouring bins, and the peak is refined by neighbours too
+        self.bins_count = min(self.last_index + 3, self.window_length // 2 + 1)
+        self.twiddles = numpy.exp(2j * numpy.pi * numpy.arange(self.bins_count) / self.window_length)
+        self.buffer = numpy.zeros((self.window_length,), dtype=numpy.float64)
+        self.buffer_position = 0  # position of the oldest sample, where the next sample is written
+        self.samples_count = 0
+        self.samples_count_since_recompute = 0
+        self.bins = None
+
+    def reset(self):
+        self.buffer[:] = 0
+        self.buffer_position = 0
+        self.samples_count = 0
+        self.samples_count_since_recompute = 0
+        self.bins = None
+
+    def get_is_ready(self):
+        """ :return: True, if the window is filled with samples """
+        return self.samples_count >= self.window_length
+
+    def update(self, samples) -> Optional[float]:
+        """ :return: HR frequency by the latest window with new `samples`, in Hz, None until the window is filled """
+        samples = numpy.asarray(samples, dtype=numpy.float64).reshape(-1)[-self.window_length:]
+        positions = (self.buffer_position + numpy.arange(len(samples))) % self.window_length
+        old_samples = self.buffer[positions]
+        self.buffer[positions] = samples
+        self.buffer_position = int((self.buffer_position + len(samples)) % self.window_length)
+        was_ready = self.get_is_ready()
+        self.samples_count += len(samples)
+        self.samples_count_since_recompute += len(samples)
+        recompute_samples_count = self.recompute_samples_count or self.window_length
+        if not self.get_is_ready():
+            return None
+        if not was_ready or self.samples_count_since_recompute >= recompute_samples_count:
+            self._prv_recompute_bins()
+        elif len(samples) > 0:
+            self._prv_slide_bins(samples, old_samples)
+        return self.get_freq()
+
+    def get_psd(self) -> Optional[Tuple[numpy.ndarray, numpy.ndarray]]:
+        """ :return: (freqs, psd) of bins up to the HR band and its neighbours, as `freq_welch` computes PSD """
+        if not self.get_is_ready():
+            return None
+        bin_indices = numpy.arange(min(self.last_index + 2, len(self.freqs)))
+        rect_bins = self._prv_get_rect_bins(numpy.stack([bin_indices - 1, bin_indices, bin_indices + 1]))
+        # periodic Hann window is a 3-tap convolution in the frequency domain
+        hann_bins = 0.5 * rect_bins[1] - 0.25 * rect_bins[0] - 0.25 * rect_bins[2]
+        return self.freqs[bin_indices], numpy.square(numpy.abs(hann_bins)) * self.scales[bin_indices]
+
+    def get_freq(self) -> Optional[float]:
+        """ :return: HR frequency by the latest window, in Hz, None until the window is filled """
+        psd = self.get_psd()
+        if psd is None:
+            return None
+        freqs, psd = psd
+        return float(get_psd_peak_freqs(psd[None, :], freqs, self.first_index, self.last_index, self.freq_range)[0])
+
+    def get_hr(self) -> Optional[float]:
+        """ :return: HR by the latest window, in BPM, None until the window is filled """
+        freq = self.get_freq()
+        return None if freq is None else freq * 60.0
@@ -0,0 +1,270 @@
+""" Random access to frames of uncompressed and MJPEG AVI files without ffmpeg """
+import io
+import os
+import struct
+from fractions import Fraction
+
+import numpy
+
+try:
+    from PIL import Image
+except ImportError:  # MJPEG frames can not be decoded in-process, ffmpeg is used for them instead
+    Image = None
+
+
+AVIIF_KEYFRAME = 0x10
+AVI_INDEX_OF_INDEXES = 0x00
+AVI_INDEX_OF_CHUNKS = 0x01
+AVI_INDEX_DELTA_FRAME = 0x80000000
+
+RAW_COMPRESSIONS = (b'\x00\x00\x00\x00', b'RGB ', b'DIB ')
+RAW_BIT_COUNTS = (24, 32)
+MJPEG_COMPRESSIONS = (b'MJPG', b'mjpg', b'AVRn', b'AVDJ', b'JPEG', b'jpeg')
+
+_idx1_entry_dtype = numpy.dtype([('ckid', 'S4'), ('flags', '<u4'), ('offset', '<u4'), ('size', '<u4')])
+_super_index_entry_dtype = numpy.dtype([('offset', '<u8'), ('size', '<u4'), ('duration', '<u4')])
+_std_index_entry_dtype = numpy.dtype([('offset', '<u4'), ('size', '<u4')])
+
+
+def _iter_chunks(fp, pos, end):
+    """ Yields (fourcc, data position, data size) of RIFF chunks in [pos, end) range """
+    while pos + 8 <= end:
+        fp.seek(pos)
+        header = fp.read(8)
+        if len(header) < 8:
+            return
+        fourcc, size = struct.unpack('<4sI', header)
+        yield fourcc, pos + 8, size
+        pos += 8 + size + (size & 1)
+
+
+def _read_list_type(fp, data_pos):
+    fp.seek(data_pos)
+    return fp.read(4)
+
+
+def _parse_stream_list(fp, pos, end):
+    stream = {}
+    for fourcc, data_pos, size in _iter_chunks(fp, pos, end):
+        fp.seek(data_pos)
+        if fourcc == b'strh':
+            fcc_type, fcc_handler, _, _, _, _, scale, rate, start, length = struct.unpack('<4s4sIHHIIIII', fp.read(36))
+            stream.update({'type': fcc_type, 'handler': fcc_handler, 'scale': scale, 'rate': rate,
+                           'start': start, 'length': length})
+        elif fourcc == b'strf':
+            stream['format'] = fp.read(min(size, 40))
+        elif fourcc == b'indx':
+            stream['indx'] = fp.read(size)
+    return stream
+
+
+def _parse_super_index(fp, indx):
+    _, index_sub_type, index_type, entries_count, _ = struct.unpack('<HBBI4s', indx[:12])
+    if index_type != AVI_INDEX_OF_INDEXES or index_sub_type != 0:
+        raise ValueError('unsupported AVI super index type')
+    super_entries = numpy.frombuffer(indx, dtype=_super_index_entry_dtype, count=entries_count, offset=24)
+    offsets, sizes = [], []
+    for super_entry in super_entries:
+        fp.seek(int(super_entry['offset']) + 8)
+        _, _, index_type, entries_count, _, base_offset, _ = struct.unpack('<HBBI4sQI', fp.read(24))
+        if index_type != AVI_INDEX_OF_CHUNKS:
+            raise ValueError('unsupported AVI standard index type')
+        entries = numpy.frombuffer(fp.read(entries_count * _std_index_entry_dtype.itemsize),
+                                   dtype=_std_index_entry_dtype)
+        offsets.append(base_offset + entries['offset'].astype(numpy.int64))
+        sizes.append(entries['size'].astype(numpy.int64))
+    sizes = numpy.concatenate(sizes)
+    key_frames = (sizes & AVI_INDEX_DELTA_FRAME) == 0
+    return numpy.concatenate(offsets), sizes & ~AVI_INDEX_DELTA_FRAME, key_frames
+
+
+def _parse_idx1(fp, idx1_pos, idx1_size, movi_pos, chunk_ids):
+    fp.seek(idx1_pos)
+    entries = numpy.frombuffer(fp.read(idx1_size - idx1_size % 16), dtype=_idx1_entry_dtype)
+    entries = entries[numpy.isin(entries['ckid'], chunk_ids)]
+    offsets = entries['offset'].astype(numpy.int64)
+    if len(entries) > 0:
+        # offsets are relative to the 'movi' list type by the spec, but some writers store absolute file offsets
+        fp.seek(movi_pos + int(offsets[0]))
+        if fp.read(4) == entries['ckid'][0]:
+            offsets += movi_pos
+    key_frames = (entries['flags'] & AVIIF_KEYFRAME) != 0
+    return offsets + 8, entries['size'].astype(numpy.int64), key_frames
+
+
+def _scan_movi(fp, movi_ranges, chunk_ids):
+    offsets, sizes = [], []
+    lists = list(movi_ranges)
+    while len(lists) > 0:
+        pos, end = lists.pop(0)
+        for fourcc, data_pos, size in _iter_chunks(fp, pos, end):
+            if fourcc == b'LIST':
+                lists.insert(0, (data_pos + 4, data_pos + size))
+            elif fourcc in chunk_ids:
+                offsets.append(data_pos)
+                sizes.append(size)
+    return numpy.asarray(offsets, dtype=numpy.int64), numpy.asarray(sizes, dtype=numpy.int64), None
+
+
+def parse_avi_index(path_to_input_video):
+    """
+    Parses headers and frame index of the first video stream of AVI file.
+    Both OpenDML (AVI 2.0) and legacy `idx1` indices are supported, unindexed files are scanned.
+    :param path_to_input_video: path to AVI file
+    :return: dict of stream headers and `offsets`, `sizes`, `positions` and `key_frames` arrays of non-empty frames
+    """
+    file_size = os.path.getsize(path_to_input_video)
+    with open(path_to_input_video, 'rb') as fp:
+        streams = []
+        movi_ranges = []
+        idx1 = None
+        for fourcc, data_pos, size in _iter_chunks(fp, 0, file_size):
+            if fourcc != b'RIFF' or _read_list_type(fp, data_pos) not in (b'AVI ', b'AVIX'):
+                raise ValueError(f'not an AVI file: {path_to_input_video}')
+            riff_end = min(data_pos + size, file_size)
+            for fourcc2, data_pos2, size2 in _iter_chunks(fp, data_pos + 4, riff_end):
+                list_type = _read_list_type(fp, data_pos2) if fourcc2 == b'LIST' else None
+                if list_type == b'hdrl':
+                    for fourcc3, data_pos3, size3 in _iter_chunks(fp, data_pos2 + 4, data_pos2 + size2):
+                        if fourcc3 == b'LIST' and _read_list_type(fp, data_pos3) == b'strl':
+                            streams.append(_parse_stream_list(fp, data_pos3 + 4, data_pos3 + size3))
+                elif list_type == b'movi':
+                    movi_ranges.append((data_pos2 + 4, min(data_pos2 + size2, riff_end)))
+                elif fourcc2 == b'idx1' and idx1 is None:
+                    idx1 = (data_pos2, size2)
+        stream_types = [stream.get('type') for stream in streams]
+        if b'vids' not in stream_types:
+            raise ValueError(f'no video stream found: {path_to_input_video}')
+        stream_index = stream_types.index(b'vids')
+        stream = streams[stream_index]
+        chunk_ids = [b'%02ddb' % stream_index, b'%02ddc' % stream_index]
+        if 'indx' in stream:
+            offsets, sizes, key_frames = _parse_super_index(fp, stream['indx'])
+        elif idx1 is not None and len(movi_ranges) > 0:
+            offsets, sizes, key_frames = _parse_idx1(fp, idx1[0], idx1[1], movi_ranges[0][0] - 4, chunk_ids)
+        else:
+            offsets, sizes, key_frames = _scan_movi(fp, movi_ranges, chunk_ids)
+    if key_frames is None:
+        key_frames = numpy.ones(len(offsets), dtype=bool)
+    _, width, height, _, bit_count, compression, _ = struct.unpack('<IiiHH4sI', stream['format'][:24])
+    # empty chunks are dropped frames: they are not decoded, but they take their time slot
+    positions = numpy.arange(len(offsets), dtype=numpy.int64)
+    non_empty = sizes > 0
+    return {
+        'stream_index': stream_index,
+        'handler': stream['handler'],
+        'compression': compression,
+        'width': width,
+        'height': height,
+        'bit_count': bit_count,
+        'scale': stream['scale'],
+        'rate': stream['rate'],
+        'start': stream['start'],
+        'offsets': offsets[non_empty],
+        'sizes': sizes[non_empty],
+        'positions': positions[non_empty],
+        'key_frames': key_frames[non_empty],
+    }
+
+
+class AVIReader(object):
+    """
+    Serves frames of AVI video stream by frame-to-byte-offset table built once:
+    uncompressed frames as zero-copy views into memory-mapped file, MJPEG frames are decoded independently.
+    """
+
+    # private
+
+    def _prv_get_raw_frame(self, frame_index):
+        avi_index = self.get_avi_index()
+        width = avi_index['width']
+        height = abs(avi_index['height'])
+        bytes_per_pixel = avi_index['bit_count'] // 8
+        stride = (width * bytes_per_pixel + 3) // 4 * 4  # rows are aligned to 4 bytes
+        offset = int(avi_index['offsets'][frame_index])
+        if avi_index['sizes'][frame_index] < stride * height:
+            raise ValueError(f'{self.__class__.__name__}: frame {frame_index} is truncated')
+        frame = self.get_data()[offset: offset + stride * height].reshape(height, stride)
+        frame = frame[:, :width * bytes_per_pixel].reshape(height, width, bytes_per_pixel)
+        if avi_index['height'] > 0:  # bottom-up DIB
+            frame = frame[::-1]
+        return frame[:, :, 2::-1]  # BGR(A) to RGB
+
+    def _prv_get_mjpeg_frame(self, frame_index):
+        avi_index = self.get_avi_index()
+        offset = int(avi_index['offsets'][frame_index])
+        size = int(avi_index['sizes'][frame_index])
+        with Image.open(io.BytesIO(self.get_data()[offset: offset + size])) as image:
+            return numpy.asarray(image.convert('RGB'))
+
+    # public
+
+    def __init__(self, path_to_input_video):
+        self.path = path_to_input_video
+        self.avi_index = None
+        self.data = None
+        self.frame_timestamps = None
+
+    def get_avi_index(self):
+        if self.avi_index is None:
+            self.avi_index = parse_avi_index(self.path)
+        return self.avi_index
+
+    def get_data(self):
+        if self.data is None:
+            self.data = numpy.memmap(self.path, dtype=numpy.uint8, mode='r')
+        return self.data
+
+    def get_is_raw(self):
+        avi_index = self.get_avi_index()
+        return avi_index['compression'] in RAW_COMPRESSIONS and avi_index['bit_count'] in RAW_BIT_COUNTS
+
+    def get_is_mjpeg(self):
+        avi_index = self.get_avi_index()
+        return avi_index['compression'] in MJPEG_COMPRESSIONS or avi_index['handler'] in MJPEG_COMPRESSIONS
+
+    def get_is_supported(self):
+        return self.get_is_raw() or (self.get_is_mjpeg() and Image is not None)
+
+    def get_metadata(self):
+        """ Video stream metadata with the same keys as in `utils_ffmpeg.get_video_metadata` """
+        avi_index = self.get_avi_index()
+        return {
+            'codec_name': 'rawvideo' if self.get_is_raw() else 'mjpeg',
+            'codec_tag_string': avi_index['compression'].decode('latin-1'),
+            'width': avi_index['width'],
+            'height': abs(avi_index['height']),
+            'time_base': f"{avi_index['scale']}/{avi_index['rate']}",
+            'avg_frame_rate': f"{avi_index['rate']}/{avi_index['scale']}",
+            'nb_frames': str(self.get_frames_count()),
+        }
+
+    def get_frames_count(self):
+        return len(self.get_avi_index()['offsets'])
+
+    def get_frame_timestamps(self):
+        if self.frame_timestamps is None:
+            avi_index = self.get_avi_index()
+            time_base = Fraction(avi_index['scale'], avi_index['rate'])
+            self.frame_timestamps = [(avi_index['start'] + int(position)) * time_base
+                                     for position in avi_index['positions']]
+        return self.frame_timestamps
+
+    def get_key_frame_indices(self):
+        return numpy.flatnonzero(self.get_avi_index()['key_frames']).tolist()
+
+    def get_frame(self, frame_index, crop_rect=None):
+        """
+        :return: (height, width, 3) RGB frame; read-only view into the file for uncompressed video
+        """
+        if self.get_is_raw():
+            frame = self._prv_get_raw_frame(frame_index)
+        else:
+            frame = self._prv_get_mjpeg_frame(frame_index)
+        if crop_rect is not None:
+            x, y, w, h = crop_rect['x'], crop_rect['y'], crop_rect['w'], crop_rect['h']
+            frame = frame[y: y + h, x: x + w]
+        return frame
+
+    def close(self):
+        self.data = None
@@ -1,5 +1,7 @@
 import string
 
+import numpy
+
 
 def escape_filename(s: str):
     s = s.replace('/', '_').replace('\\', '_').replace(' ', '_')
@@ -12,3 +14,24 @@ def escape_filename(s: str):
             escaped_filename.append("%{0:04x}".format(ord(ch)))
     escaped_filename = ''.join(escaped_filename)
     return escaped_filename
+
+
+def get_nearest_indices(timestamps, query_timestamps):
+    """ :return: indices of the nearest of sorted `timestamps` for every query timestamp """
+    timestamps = numpy.asarray(timestamps, dtype=numpy.float64)
+    query_timestamps = numpy.asarray(query_timestamps, dtype=numpy.float64)
+    right = numpy.clip(numpy.searchsorted(timestamps, query_timestamps), 1, max(1, len(timestamps) - 1))
+    left = right - 1
+    if len(timestamps) == 1:
+        return numpy.zeros(query_timestamps.shape, dtype=numpy.int64)
+    is_left_nearer = query_timestamps - timestamps[left] <= timestamps[right] - query_timestamps
+    return numpy.where(is_left_nearer, left, right).astype(numpy.int64)
+
+
+def get_qualified_name(function):
+    """ :return: `module.qualname` of the function, e.g. to fingerprint a replaceable estimator, None for None """
+    if function is None:
+        return None
+    if hasattr(function, '__module__') and hasattr(function, '__qualname__'):
+        return f'{function.__module__}.{function.__qualname__}'
+    return repr(function)  # e.g. `functools.partial` with its arguments
@@ -1,18 +1,150 @@
+import inspect
+from enum import Enum
+from functools import lru_cache
 from typing import Tuple, Dict, Any
 
 import numpy as np
+import scipy.ndimage as scn
 import scipy.signal as scs
-from mne.preprocessing.ecg import qrs_detector
 
 
-def estimate_hr_and_peaks(sampling_frequency, signal):
-    peaks = qrs_detector(sampling_frequency, signal, filter_length='3.5s')
+class QRSDetectorTitle(Enum):
+    """
+    Titles of supported QRS detectors
+    """
+    Native = 'native'  # vectorised detector of Pan-Tompkins family, see `detect_qrs_peaks`
+    MNE = 'mne'        # `mne.preprocessing.ecg.qrs_detector`, requires `mne` package
+
+
+def get_qrs_energy(sampling_frequency, signal, integration_duration=0.15):
+    """
+    QRS energy of Pan-Tompkins family: band-pass filtering to the QRS band, differentiation, squaring and
+    moving-window integration. Filters are zero-phase, so the energy is not delayed.
+    :param integration_duration: width of the moving-window integration, in seconds
+    :return: float64 array of the energy, it has a pulse at every QRS complex
+    """
+    integration_size = max(1, int(round(integration_duration * sampling_frequency)))
+    qrs_sos = scs.butter(2, (5., min(15., 0.45 * sampling_frequency)), btype='bandpass', fs=sampling_frequency,
+                         output='sos')
+    qrs_signal = scs.sosfiltfilt(qrs_sos, np.asarray(signal, dtype=np.float64))
+    return scn.uniform_filter1d(np.square(np.gradient(qrs_signal)), integration_size)
+
+
+def detect_qrs_peaks(sampling_frequency, signal, integration_duration=0.15, refractory_duration=0.25,
+                     threshold_ratio=0.3, level_duration=8.):
+    """
+    Vectorised QRS detector of Pan-Tompkins family: band-pass filtering, differentiation, squaring and
+    moving-window integration, then peaks of the integrated signal above a fraction of its local level.
+    Filters are zero-phase, so peaks are not delayed; every peak is moved to the maximum of the filtered
+    ECG magnitude near it, as `mne.preprocessing.ecg.qrs_detector` locates peaks.
+    :param sampling_frequency: sample frequency of the signal, in Hz
+    :param signal: 1D ECG signal
+    :param integration_duration: width of the moving-window integration, in seconds
+    :param refractory_duration: the minimum interval between peaks, in seconds (240 bpm by default)
+    :param threshold_ratio: fraction of the local level of QRS energy to detect peaks above
+    :param level_duration: duration of the running window of the local level, in seconds
+    :return: sorted int64 array of sample indices of R-peaks
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    integration_size = max(1, int(round(integration_duration * sampling_frequency)))
+    if len(signal) <= 4 * integration_size:
+        return np.zeros((0,), dtype=np.int64)
+    energy = get_qrs_energy(sampling_frequency, signal, integration_duration)
+    candidates, _ = scs.find_peaks(energy, distance=max(1, int(round(refractory_duration * sampling_frequency))))
+    if len(candidates) == 0:
+        return np.zeros((0,), dtype=np.int64)
+    # local level: median of per-second maxima of the energy, robust to missed beats and artifacts
+    block_size = max(1, int(round(sampling_frequency)))
+    blocks_count = -(-len(energy) // block_size)
+    block_maxima = np.pad(energy, (0, blocks_count * block_size - len(energy)), mode='edge')
+    block_maxima = block_maxima.reshape(blocks_count, block_size).max(axis=1)
+    block_levels = scn.median_filter(block_maxima, size=max(1, int(round(level_duration))), mode='nearest')
+    peaks = candidates[energy[candidates] > threshold_ratio * block_levels[candidates // block_size]]
+    # R-peak is the maximum of the band-passed ECG magnitude around the peak of energy
+    magnitude = np.abs(scs.sosfiltfilt(scs.butter(2, (5., min(35., 0.45 * sampling_frequency)), btype='bandpass',
+                                                  fs=sampling_frequency, output='sos'), signal))
+    offsets = np.arange(-integration_size, integration_size + 1)
+    neighbourhoods = np.clip(peaks[:, None] + offsets[None, :], 0, len(signal) - 1)
+    peaks = neighbourhoods[np.arange(len(peaks)), np.argmax(magnitude[neighbourhoods], axis=1)]
+    return np.unique(peaks).astype(np.int64)
+
+
+def detect_qrs_peaks_mne(sampling_frequency, signal, filter_length='3.5s'):
+    """ R-peaks by `mne.preprocessing.ecg.qrs_detector`, mne is imported on demand as an optional dependency """
+    from mne.preprocessing.ecg import qrs_detector
+    return np.asarray(qrs_detector(sampling_frequency, signal, filter_length=filter_length, verbose=False),
+                      dtype=np.int64)
+
+
+def get_qrs_detector(qrs_detector_title=QRSDetectorTitle.Native):
+    if QRSDetectorTitle(qrs_detector_title) == QRSDetectorTitle.MNE:
+        return detect_qrs_peaks_mne
+    return detect_qrs_peaks
+
+
+def get_qrs_detector_params(qrs_detector_title=QRSDetectorTitle.Native, **detector_params):
+    """
+    :return: dict of the detector title and all its parameters, defaults included, e.g. to fingerprint peaks
+        detected by it
+    """
+    detector_signature = inspect.signature(get_qrs_detector(qrs_detector_title))
+    params = {name: parameter.default for name, parameter in detector_signature.parameters.items()
+              if parameter.default is not inspect.Parameter.empty}
+    params.update(detector_params)
+    return {'qrs_detector': QRSDetectorTitle(qrs_detector_title).value, 'params': params}
+
+
+def estimate_hr_and_peaks(sampling_frequency, signal, qrs_detector_title=QRSDetectorTitle.Native, **detector_params):
+    """ :param detector_params: keyword parameters of the detector, e.g. `threshold_ratio` of `detect_qrs_peaks` """
+    peaks = get_qrs_detector(qrs_detector_title)(sampling_frequency, signal, **detector_params)
+    return {'hr': get_hr_by_peaks(sampling_frequency, peaks), 'peaks': peaks}
+
+
+def get_hr_by_peaks(sampling_frequency, peaks):
+    """ Mean of instantaneous rates between consecutive R-peaks, in bpm, 0 if there are no plausible rates """
     # noinspection PyTypeChecker
     instantaneous_rates = (sampling_frequency * 60) / np.diff(peaks)
-  
+
     # remove instantaneous rates which are lower than 30, higher than 240
     selector = (instantaneous_rates > 30) & (instantaneous_rates < 240)
-    return {'hr': float(np.nan_to_num(instantaneous_rates[selector].mean())), 'peaks': peaks}
+    if not selector.any():
+        return 0.
+    return float(instantaneous_rates[selector].mean())
+
+
+def get_hr_and_peaks_in_range(sampling_frequency, peaks, frame_index_start, frames_count):
+    """
+    HR estimation of a window by R-peaks detected once over the whole record, peaks are found by binary search.
+    :param peaks: sorted sample indices of R-peaks of the whole record
+    :return: dict as `estimate_hr_and_peaks` returns, `peaks` are relative to `frame_index_start`
+    """
+    peaks = np.asarray(peaks, dtype=np.int64)
+    peaks_start, peaks_end = np.searchsorted(peaks, [frame_index_start, frame_index_start + frames_count])
+    peaks_in_range = peaks[peaks_start: peaks_end] - frame_index_start
+    return {'hr': get_hr_by_peaks(sampling_frequency, peaks_in_range), 'peaks': peaks_in_range}
+
+
+def get_hr_by_peaks_in_ranges(sampling_frequency, peaks, frame_index_starts, frame_index_ends):
+    """
+    HR estimations of many windows at once by R-peaks of the whole record, as `get_hr_and_peaks_in_range`
+    does for a single window: prefix sums of plausible instantaneous rates and their counts.
+    :param peaks: sorted sample indices of R-peaks of the whole record
+    :param frame_index_starts: first sample indices of windows
+    :param frame_index_ends: sample indices after the last samples of windows
+    :return: float64 array of HR of windows, in bpm, 0 for windows without plausible rates
+    """
+    peaks = np.asarray(peaks, dtype=np.int64)
+    # noinspection PyTypeChecker
+    instantaneous_rates = (sampling_frequency * 60) / np.diff(peaks) if len(peaks) > 1 else np.zeros((0,))
+    selector = (instantaneous_rates > 30) & (instantaneous_rates < 240)
+    rate_sums = np.concatenate([[0.], np.cumsum(np.where(selector, instantaneous_rates, 0.))])
+    rate_counts = np.concatenate([[0], np.cumsum(selector)])
+    # rates between peaks within [start, end) of a window
+    rate_index_starts = np.minimum(np.searchsorted(peaks, frame_index_starts), len(instantaneous_rates))
+    rate_index_ends = np.maximum(rate_index_starts, np.searchsorted(peaks, frame_index_ends) - 1)
+    counts = rate_counts[rate_index_ends] - rate_counts[rate_index_starts]
+    sums = rate_sums[rate_index_ends] - rate_sums[rate_index_starts]
+    return np.where(counts > 0, sums / np.maximum(counts, 1), 0.)
 
 
 def find_best_hr_estimation(estimated_hr_and_peaks):
@@ -111,3 +243,107 @@ def freq_welch(input_signal: np.ndarray,
     # clamp to [min_freq, max_freq]
     freq_hz = np.clip(freq_hz, a_min=freq_range[0], a_max=freq_range[1]).item()
     return freq_hz
+
+
+@lru_cache(maxsize=64)
+def get_welch_setup(fps, segment_length, freq_min, freq_max):
+    """
+    Hann window, PSD scales by frequency bins, frequencies and band of `freq_welch` for signals of `segment_length`
+    samples, cached per arguments.
+    :return: (window, freqs, scales, first_index, last_index) - band is `freqs[first_index: last_index + 1]`
+    """
+    window = scs.get_window('hann', segment_length)
+    freqs = np.fft.rfftfreq(segment_length, d=1.0 / fps)
+    scales = np.full(freqs.shape, 2.0 / (fps * np.sum(np.square(window))))
+    scales[0] /= 2  # DC and Nyquist bins are not doubled in one-sided spectrum
+    if segment_length % 2 == 0:
+        scales[-1] /= 2
+    first_index = np.flatnonzero(freqs > freq_min)[0]
+    last_index = np.flatnonzero(freqs < freq_max)[-1]
+    return window, freqs, scales, first_index, last_index
+
+
+def get_psd_peak_freqs(psd, freqs, first_index, last_index, freq_range):
+    """
+    Peak frequencies of PSDs within the band, refined by neighbouring bins as `freq_welch` does.
+    :param psd: (signals, bins) array of PSDs, bins up to `last_index + 1` at least
+    :return: (signals,) array of frequencies, in Hz
+    """
+    rows = np.arange(len(psd))
+    max_idx = first_index + np.argmax(psd[:, first_index: last_index + 1], axis=1)
+    # consider neighboring peaks
+    max_indices = np.minimum(np.stack([max_idx - 1, max_idx, max_idx + 1], axis=1), psd.shape[1] - 1)
+    neighbours_psd = psd[rows[:, None], max_indices]
+    max_weights_aux = neighbours_psd - neighbours_psd.min(axis=1, keepdims=True)  # min(neighbours) is noise level
+    with np.errstate(invalid='ignore', divide='ignore'):
+        max_weights = max_weights_aux / max_weights_aux.sum(axis=1, keepdims=True)
+    freq_hz = np.sum(max_weights * freqs[max_indices], axis=1)
+    # clamp to [min_freq, max_freq]
+    return np.clip(freq_hz, a_min=freq_range[0], a_max=freq_range[1])
+
+
+def freq_welch_batch(input_signals: np.ndarray,
+                     fps: float,
+                     freq_range: Tuple[float, float],
+                     **_: Dict[str, Any]
+                     ) -> np.ndarray:
+    """
+    Batched `freq_welch`: frequencies of many signals of the same length at once, e.g. of windows of a signal.
+    Window, PSD scale and band are set up once per (fps, length); PSDs, peaks and their refinement by
+    neighbours are computed for all rows at once. Results match `freq_welch` of every row.
+    :param input_signals: (signals, samples) array
+    :param fps: Framerate of input_signals, in Hz
+    :param freq_range: (freq_min, freq_max) range to search frequency, in Hz
+    :param _: dummy params for alternative functions
+    :return: (signals,) array of estimated frequency values, in Hz
+    """
+    psd, freqs, first_index, last_index = get_welch_psd_batch(input_signals, fps, freq_range)
+    return get_psd_peak_freqs(psd, freqs, first_index, last_index, freq_range)
+
+
+def get_welch_psd_batch(input_signals, fps, freq_range):
+    """
+    PSDs of many signals of the same length at once, as `freq_welch` computes PSD of a signal.
+    :param input_signals: (signals, samples) array
+    :return: (psd, freqs, first_index, last_index) - (signals, bins) array of PSDs, frequencies of bins, in Hz,
+        and the band of `freq_range`, see `get_welch_setup`
+    """
+    input_signals = np.asarray(input_signals, dtype=np.float64)
+    if input_signals.ndim != 2:
+        raise ValueError(f'input_signals is expected to be 2-dimentional, got {input_signals.ndim}')
+    if input_signals.shape[1] == 0:
+        raise ValueError('input_signals should be non-empty')
+    window, freqs, scales, first_index, last_index = get_welch_setup(
+        float(fps), input_signals.shape[1], float(freq_range[0]), float(freq_range[1]))
+    # PSD of a single Hann-windowed segment per signal, as `scs.welch` with `nperseg` equal to signal length
+    detrended = input_signals - input_signals.mean(axis=1, keepdims=True)
+    psd = np.square(np.abs(np.fft.rfft(detrended * window, axis=1))) * scales
+    return psd, freqs, first_index, last_index
+
+
+def get_spectral_quality_batch(input_signals, fps, freq_range, tolerance=0.1, harmonics_count=2):
+    """
+    Signal quality index of many signals of the same length at once, by a single batched FFT: the fraction of
+    spectral power near the HR frequency (the PSD peak within `freq_range`) and its harmonics, of the power within
+    [`freq_range[0]`, `harmonics_count * freq_range[1]`]. Clean pulse signals have most of their power there.
+    :param input_signals: (signals, samples) array
+    :param fps: sample frequency of signals, in Hz
+    :param freq_range: (freq_min, freq_max) range of HR, in Hz
+    :param tolerance: half-width of bands around the HR frequency and its harmonics, in Hz; bands are not narrower
+        than the main lobe of Hann window (two bins), so power of short windows leaked to neighbour bins is counted
+    :param harmonics_count: count of bands, 1 - the HR frequency only, 2 - with its first harmonic, etc.
+    :return: (quality, hr_freqs) - float64 arrays of the index within [0, 1], NaN for signals without power
+        in the band, and of HR frequencies, in Hz
+    """
+    psd, freqs, first_index, last_index = get_welch_psd_batch(input_signals, fps, freq_range)
+    hr_freqs = get_psd_peak_freqs(psd, freqs, first_index, last_index, freq_range)
+    tolerance = max(tolerance, 2 * freqs[1]) if len(freqs) > 1 else tolerance
+    is_in_band = (freqs >= freq_range[0]) & (freqs <= harmonics_count * freq_range[1] + tolerance)
+    band_freqs, band_psd = freqs[is_in_band], psd[:, is_in_band]
+    harmonics = np.arange(1, harmonics_count + 1, dtype=np.float64)
+    distances = np.abs(band_freqs[None, None, :] - hr_freqs[:, None, None] * harmonics[None, :, None]).min(axis=1)
+    band_power = band_psd.sum(axis=1)
+    quality = np.full(band_power.shape, np.nan)
+    np.divide(np.where(distances <= tolerance, band_psd, 0.).sum(axis=1), band_power, out=quality,
+              where=band_power > 0)
+    return quality, hr_freqs
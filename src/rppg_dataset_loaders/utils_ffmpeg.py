@@ -1,6 +1,10 @@
 import json
+import re
 import shlex
 import subprocess
+from fractions import Fraction
+
+import numpy
 
 
 def get_video_metadata(path_to_input_video):
@@ -34,7 +38,15 @@ def get_video_frame_timestamps(path_to_input_video):
 
 
 # noinspection PyShadowingBuiltins
-def get_video_frames(path_to_input_video, frame_index, frame_count, crop_rect=None):
+def get_video_frames_args(path_to_input_video, frame_index, frame_count, crop_rect=None, seek_time=None, size=None,
+                          pix_fmt='rgb24'):
+    """
+    Builds ffmpeg command line to decode `frame_count` frames starting from `frame_index` to stdout
+    as raw frames of `pix_fmt` pixel format.
+    If `seek_time` is set, input is seeked to this stream timestamp (in seconds) first, and `frame_index` is counted
+    from the first frame at or after `seek_time`.
+    If `size` (width, height) is set, frames are scaled to it by area averaging after cropping.
+    """
     # you may use -vf select for accurate frame selection
     # (something like -vf 'select=gte(n\,100)' to skip the 100 first frames)
     # eq(n\,100) - exact frame
@@ -43,13 +55,175 @@ def get_video_frames(path_to_input_video, frame_index, frame_count, crop_rect=No
     if crop_rect is not None:
         filter = filter + ",crop='{0}:{1}:{2}:{3}'". \
             format(crop_rect['w'], crop_rect['h'], crop_rect['x'], crop_rect['y'])
+    if size is not None:
+        # scaling in the output pixel format keeps fractional part of averages for 16-bit formats
+        filter = filter + ",format={0},scale={1}:{2}:flags=area".format(pix_fmt, size[0], size[1])
 
     cmd = "ffmpeg -i -loglevel panic -hide_banner -vf -vsync 0 -f image2pipe -vcodec rawvideo -pix_fmt rgb24 -"
     args = shlex.split(cmd)
     args.insert(6, filter)
     args.insert(2, path_to_input_video)
+    args[-2] = pix_fmt
+    # stop decoding as soon as the last selected frame is written, instead of decoding up to the end of the video
+    args[-1:-1] = ['-frames:v', str(frame_count)]
+    if seek_time is not None:
+        # `-seek_timestamp` makes `-ss` an actual stream timestamp, not an offset from the start time of the file
+        args[1:1] = ['-seek_timestamp', '1', '-ss', repr(float(seek_time))]
+    return args
+
+
+# noinspection PyShadowingBuiltins
+def get_video_frames(path_to_input_video, frame_index, frame_count, crop_rect=None, seek_time=None):
+    args = get_video_frames_args(path_to_input_video, frame_index, frame_count, crop_rect, seek_time)
     # print(args)
     # calculate_quality the ffprobe process, decode stdout into utf-8 & convert to JSON
     ffmpegOutput = subprocess.check_output(args)
 
     return ffmpegOutput
+
+
+def read_pipe_into(pipe, buffer):
+    """ Reads from `pipe` into the writable `buffer` until it is full or the pipe is closed, returns bytes read """
+    buffer_view = memoryview(buffer).cast('B')
+    bytes_read = 0
+    while bytes_read < len(buffer_view):
+        chunk_size = pipe.readinto(buffer_view[bytes_read:])
+        if not chunk_size:
+            break
+        bytes_read += chunk_size
+    return bytes_read
+
+
+def read_video_frames_into(buffer, path_to_input_video, frame_index, frame_count, crop_rect=None, seek_time=None,
+                           size=None):
+    """
+    Same as `get_video_frames`, but decoded frames are written straight into the writable `buffer`
+    (e.g. a slice of numpy array) without intermediate copies.
+    :return: number of bytes written into `buffer`
+    """
+    args = get_video_frames_args(path_to_input_video, frame_index, frame_count, crop_rect, seek_time, size)
+    with subprocess.Popen(args, stdout=subprocess.PIPE) as process:
+        bytes_read = read_pipe_into(process.stdout, buffer)
+        process.stdout.close()
+        return_code = process.wait()
+    if return_code != 0 and bytes_read < memoryview(buffer).nbytes:
+        raise subprocess.CalledProcessError(return_code, args)
+    return bytes_read
+
+
+def iter_video_frames(path_to_input_video, frame_index, frame_count, frame_shape, chunk_frames_count,
+                      crop_rect=None, seek_time=None, size=None, pix_fmt='rgb24'):
+    """
+    Same as `get_video_frames`, but frames are decoded by a single ffmpeg process and yielded by chunks,
+    so at most one chunk of frames is held in memory.
+    :param frame_shape: shape of output frames, e.g. (height, width, 3)
+    :param chunk_frames_count: the maximum count of frames per chunk
+    :param size: optional (width, height) to scale frames to by area averaging
+    :param pix_fmt: `rgb24` for uint8 frames or `rgb48le` for uint16 frames
+    :return: generator of numpy arrays of frames
+    """
+    args = get_video_frames_args(path_to_input_video, frame_index, frame_count, crop_rect, seek_time, size, pix_fmt)
+    dtype = numpy.uint16 if pix_fmt == 'rgb48le' else numpy.uint8
+    frames_read = 0
+    # leaving the context closes the pipe, so ffmpeg stops even if the generator is not exhausted
+    with subprocess.Popen(args, stdout=subprocess.PIPE) as process:
+        while frames_read < frame_count:
+            chunk = numpy.empty((min(chunk_frames_count, frame_count - frames_read),) + tuple(frame_shape), dtype)
+            chunk_frames_read = read_pipe_into(process.stdout, chunk) // (chunk.nbytes // len(chunk))
+            if chunk_frames_read > 0:
+                yield chunk[:chunk_frames_read]
+            frames_read += chunk_frames_read
+            if chunk_frames_read < len(chunk):
+                break
+        process.stdout.close()
+        return_code = process.wait()
+    if return_code != 0 and frames_read < frame_count:
+        raise subprocess.CalledProcessError(return_code, args)
+
+
+def get_live_video_frames_args(path_to_input_video, follow=False, follow_timeout=None, analyze_duration=None,
+                               pix_fmt='rgb24'):
+    """
+    Builds ffmpeg command line to decode all frames of a video, which may be still being written, to stdout
+    as raw frames of `pix_fmt` pixel format, as soon as they are decoded. The `showinfo` filter reports
+    timestamp and size of every frame to stderr, see `parse_showinfo_line`.
+    :param follow: keep reading the input file at its end, as it grows (not needed for pipes and FIFOs)
+    :param follow_timeout: seconds without new data of the followed file to end the stream, None - never
+    :param analyze_duration: seconds of the input analysed to detect streams, None - ffmpeg default;
+        short durations reduce the latency of the first frame
+    """
+    args = ['ffmpeg', '-nostdin', '-hide_banner', '-nostats', '-loglevel', 'info']
+    if analyze_duration is not None:
+        args += ['-analyzeduration', str(int(analyze_duration * 1000000))]
+    if follow:
+        args += ['-follow', '1']
+        if follow_timeout is not None:
+            args += ['-rw_timeout', str(int(follow_timeout * 1000000))]
+        path_to_input_video = 'file:' + path_to_input_video
+    args += ['-i', path_to_input_video, '-vf', 'showinfo', '-vsync', '0', '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-']
+    return args
+
+
+showinfo_config_pattern = re.compile(r'Parsed_showinfo.*config in time_base: (\d+)/(\d+), frame_rate: (\d+)/(\d+)')
+showinfo_frame_pattern = re.compile(
+    r'Parsed_showinfo.*\bn: *(\d+) +pts: *(-?\d+|NOPTS) .*\bs:(\d+)x(\d+) .*\biskey:(\d)')
+
+
+def parse_showinfo_line(line):
+    """
+    Parses stderr line of ffmpeg `showinfo` filter.
+    :return: dict with `time_base` and `frame_rate` (`Fraction`s) keys for the filter config line, dict with
+        `index`, `pts` (int or None), `width`, `height` and `key_frame` keys for a frame line, otherwise None
+    """
+    match = showinfo_frame_pattern.search(line)
+    if match is not None:
+        index, pts, width, height, key_frame = match.groups()
+        return {'index': int(index), 'pts': None if pts == 'NOPTS' else int(pts),
+                'width': int(width), 'height': int(height), 'key_frame': key_frame == '1'}
+    match = showinfo_config_pattern.search(line)
+    if match is not None:
+        time_base_num, time_base_den, frame_rate_num, frame_rate_den = (int(value) for value in match.groups())
+        return {'time_base': Fraction(time_base_num, max(1, time_base_den)),
+                'frame_rate': Fraction(frame_rate_num, max(1, frame_rate_den))}
+    return None
+
+
+def transcode_video_frames(path_to_input_video, path_to_output_file, crop_rect=None, size=None, pix_fmt='rgb24'):
+    """
+    Decodes all frames of the input video into the file of raw frames, one after another, without padding.
+    :param crop_rect: optional dict with `x`, `y`, `w`, `h` keys of area to crop, applied before scaling
+    :param size: optional (width, height) to scale frames to
+    :param pix_fmt: pixel format of output frames, e.g. `rgb24` or `gray`
+    """
+    cmd = "ffmpeg -y -loglevel panic -hide_banner -i -vf -vsync 0 -f rawvideo -pix_fmt"
+    args = shlex.split(cmd)
+    args.insert(6, path_to_input_video)
+    args.insert(8, get_crop_and_scale_filter(crop_rect, size))
+    args += [pix_fmt, path_to_output_file]
+    subprocess.check_call(args)
+
+
+def encode_proxy_video(path_to_input_video, path_to_output_video, crop_rect=None, size=None, codec='utvideo'):
+    """
+    Encodes every frame of the input video, without audio, by lossless intra-only codec.
+    Each frame of such a video is decoded independently, so seeking to any frame is cheap.
+    :param crop_rect: optional dict with `x`, `y`, `w`, `h` keys of area to crop, applied before scaling
+    :param size: optional (width, height) to scale frames to
+    :param codec: `utvideo` (the fastest to decode) or `ffv1` (the smallest)
+    """
+    cmd = "ffmpeg -y -loglevel panic -hide_banner -i -vf -vsync 0 -an -c:v -g 1 -pix_fmt gbrp"
+    args = shlex.split(cmd)
+    args.insert(6, path_to_input_video)
+    args.insert(8, get_crop_and_scale_filter(crop_rect, size))
+    args.insert(13, codec)
+    args.append(path_to_output_video)
+    subprocess.check_call(args)
+
+
+def get_crop_and_scale_filter(crop_rect=None, size=None):
+    filters = ["format=rgba"]
+    if crop_rect is not None:
+        filters.append("crop='{0}:{1}:{2}:{3}'".format(crop_rect['w'], crop_rect['h'], crop_rect['x'], crop_rect['y']))
+    if size is not None:
+        filters.append("scale={0}:{1}:flags=area".format(size[0], size[1]))
+    return ','.join(filters)
@@ -0,0 +1,100 @@
+""" Beat-level analysis of PPG signals: systolic peaks, inter-beat intervals, HR and HRV """
+
+import numpy as np
+import scipy.ndimage as scn
+import scipy.signal as scs
+
+from .utils_signal import filter_band_zero_phase
+
+
+def get_local_beat_periods(filtered, fps, freq_range, segment_duration=10.0, step_duration=2.0):
+    """
+    Dominant beat period along the signal, by the spectrum peak of its short-time Fourier transform.
+    :param filtered: 1D signal band-passed to `freq_range`
+    :return: float64 array of beat periods at every sample, in samples
+    """
+    segment_size = min(len(filtered), max(1, int(round(segment_duration * fps))))
+    step_size = min(segment_size, max(1, int(round(step_duration * fps))))
+    freqs, segment_times, spectrum = scs.stft(filtered, fs=fps, nperseg=segment_size,
+                                              noverlap=segment_size - step_size, nfft=4 * segment_size,
+                                              boundary=None, padded=False)
+    is_in_range = (freqs >= freq_range[0]) & (freqs <= freq_range[1])
+    dominant_freqs = freqs[is_in_range][np.argmax(np.abs(spectrum[is_in_range]), axis=0)]
+    return np.interp(np.arange(len(filtered)) / fps, segment_times, fps / dominant_freqs)
+
+
+def detect_ppg_peaks(values, fps, freq_range, prominence_ratio=0.3, level_beats_count=9, min_period_ratio=0.6):
+    """
+    Vectorised detection of systolic peaks over the whole PPG record. The signal is band-pass filtered to
+    the HR range without phase shift, then its maxima are kept, if their prominence is above a fraction of
+    the running median prominence of neighbouring beats. Of maxima closer than a fraction of the local beat
+    period (e.g. systolic and diastolic waves of the same beat) the less prominent ones are dropped.
+    :param values: 1D PPG signal, systolic peaks are maxima
+    :param fps: sample frequency, in Hz
+    :param freq_range: (freq_min, freq_max) range of HR, in Hz
+    :param prominence_ratio: fraction of the local prominence level to detect peaks above
+    :param level_beats_count: count of neighbouring beats the local prominence level is taken over
+    :param min_period_ratio: the minimum interval between peaks, as a fraction of the local beat period
+    :return: sorted int64 array of sample indices of systolic peaks
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2 * fps / freq_range[0]:
+        return np.zeros((0,), dtype=np.int64)  # less than two slowest beats
+    filtered = filter_band_zero_phase(values, fps, freq_range, order=2)
+    peaks, properties = scs.find_peaks(filtered, distance=max(1, int(fps / freq_range[1])), prominence=0)
+    if len(peaks) == 0:
+        return np.zeros((0,), dtype=np.int64)
+    prominences = properties['prominences']
+    is_beat = prominences > prominence_ratio * scn.median_filter(prominences, size=level_beats_count, mode='nearest')
+    peaks, prominences = peaks[is_beat], prominences[is_beat]
+    min_distances = min_period_ratio * get_local_beat_periods(filtered, fps, freq_range)[peaks]
+    while len(peaks) > 1:
+        close = np.flatnonzero(np.diff(peaks) < min_distances[1:])
+        if len(close) == 0:
+            break
+        is_kept = np.ones(len(peaks), dtype=bool)
+        is_kept[np.where(prominences[close] < prominences[close + 1], close, close + 1)] = False
+        peaks, prominences, min_distances = peaks[is_kept], prominences[is_kept], min_distances[is_kept]
+    return peaks.astype(np.int64)
+
+
+def get_peak_times_in_range(peak_times, time_start, time_duration):
+    """ :return: slice of sorted `peak_times` within [time_start, time_start + time_duration], by binary search """
+    peaks_start, peaks_end = np.searchsorted(peak_times, [time_start, time_start + time_duration], side='left')
+    if peaks_end < len(peak_times) and peak_times[peaks_end] == time_start + time_duration:
+        peaks_end += 1
+    return peak_times[peaks_start: peaks_end]
+
+
+def get_instantaneous_hr(peak_times):
+    """ :return: (times, hr_values) - times of the ending peaks of inter-beat intervals, and HR of them, in bpm """
+    peak_times = np.asarray(peak_times, dtype=np.float64)
+    return peak_times[1:], 60.0 / np.diff(peak_times)
+
+
+def get_hr_by_peak_times(peak_times, hr_range):
+    """ :return: mean of instantaneous HR values within `hr_range` (in bpm), None if there are none """
+    _, hr_values = get_instantaneous_hr(peak_times)
+    hr_values = hr_values[(hr_values >= hr_range[0]) & (hr_values <= hr_range[1])]
+    if len(hr_values) == 0:
+        return None
+    return float(hr_values.mean())
+
+
+def get_hrv_metrics(inter_beat_intervals):
+    """
+    Time-domain HRV metrics of inter-beat intervals.
+    :param inter_beat_intervals: intervals between consecutive beats, in seconds
+    :return: dict with `mean_ibi`, `sdnn`, `rmssd` (in seconds) and `pnn50` (fraction) keys, NaN if undefined
+    """
+    inter_beat_intervals = np.asarray(inter_beat_intervals, dtype=np.float64)
+    if len(inter_beat_intervals) < 2:
+        return {'mean_ibi': float(inter_beat_intervals.mean()) if len(inter_beat_intervals) > 0 else np.nan,
+                'sdnn': np.nan, 'rmssd': np.nan, 'pnn50': np.nan}
+    successive_differences = np.diff(inter_beat_intervals)
+    return {
+        'mean_ibi': float(inter_beat_intervals.mean()),
+        'sdnn': float(inter_beat_intervals.std(ddof=1)),
+        'rmssd': float(np.sqrt(np.mean(np.square(successive_differences)))),
+        'pnn50': float(np.mean(np.abs(successive_differences) > 0.05)),
+    }
@@ -0,0 +1,148 @@
+""" Vectorised operations on whole signals: interpolation at arbitrary timestamps, filtering, windowing """
+
+from enum import Enum
+
+import numpy as np
+import scipy.interpolate as sci
+import scipy.signal as scs
+
+from .utils_base import get_nearest_indices
+
+
+class InterpolationMethod(Enum):
+    """
+    Methods to get signal values between its samples
+    """
+    NEAREST = 'nearest'  # value of the nearest sample
+    LINEAR = 'linear'    # linear interpolation between neighbouring samples
+    PCHIP = 'pchip'      # piecewise cubic Hermite interpolation, monotonic between samples (no overshoots)
+
+
+def interpolate(times, values, query_times, method=InterpolationMethod.PCHIP):
+    """
+    Interpolates signal at all query timestamps at once.
+    :param times: sorted timestamps of signal samples
+    :param values: signal values, the first axis corresponds to `times`
+    :param query_times: timestamps to get signal values at
+    :param method: `InterpolationMethod`
+    :return: float64 array of values at `query_times`, NaN outside of [times[0], times[-1]]
+    """
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    query_times = np.asarray(query_times, dtype=np.float64)
+    method = InterpolationMethod(method)
+    result_shape = query_times.shape + values.shape[1:]
+    if len(times) == 0:
+        return np.full(result_shape, np.nan)
+    is_inside = (query_times >= times[0]) & (query_times <= times[-1])
+    if len(times) == 1 or method == InterpolationMethod.NEAREST:
+        result = values[get_nearest_indices(times, query_times)]
+    elif method == InterpolationMethod.LINEAR:
+        result = sci.interp1d(times, values, axis=0, assume_sorted=True, bounds_error=False)(query_times)
+    else:
+        result = sci.PchipInterpolator(times, values, axis=0, extrapolate=False)(query_times)
+    result = np.array(result, dtype=np.float64).reshape(result_shape)
+    result[~is_inside] = np.nan
+    return result
+
+
+def filter_band_zero_phase(values, fps, freq_range, order=4, chunk_frames_count=None):
+    """
+    Zero-phase Butterworth band-pass filtering (forward-backward, `sosfiltfilt`) of the whole signal.
+    Long signals may be filtered by overlapping chunks: every chunk is extended by margins of several periods
+    of the lowest frequency, which are filtered too and dropped, so chunk edges have no filter transients.
+    :param values: signal values, the first axis is time
+    :param fps: sample frequency, in Hz
+    :param freq_range: (freq_min, freq_max) pass band, in Hz
+    :param order: order of the Butterworth filter
+    :param chunk_frames_count: the maximum samples count filtered at once (without margins), None - unlimited
+    :return: float64 array of filtered values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    sos = scs.butter(order, freq_range, btype='bandpass', fs=fps, output='sos')
+    if chunk_frames_count is None or len(values) <= chunk_frames_count:
+        return scs.sosfiltfilt(sos, values, axis=0)
+    margin = int(np.ceil(5 * fps / freq_range[0]))
+    result = np.empty(values.shape, dtype=np.float64)
+    for chunk_start in range(0, len(values), chunk_frames_count):
+        chunk_end = min(len(values), chunk_start + chunk_frames_count)
+        margin_start = max(0, chunk_start - margin)
+        filtered = scs.sosfiltfilt(sos, values[margin_start: min(len(values), chunk_end + margin)], axis=0)
+        result[chunk_start: chunk_end] = filtered[chunk_start - margin_start: chunk_end - margin_start]
+    return result
+
+
+def get_windows_by_times(times, values, window_start_times, window_length):
+    """
+    Gathers windows of the same length, e.g. to estimate HR by all windows of a signal at once.
+    :param times: sorted timestamps of signal samples
+    :param values: signal values, the first axis corresponds to `times`
+    :param window_start_times: start times of windows, every window starts at the first sample not before it
+    :param window_length: samples count of every window
+    :return: (windows, is_valid) - (windows, window_length, ...) array of windows, zeros for windows which
+        do not fit into the signal, and boolean array of windows that fit
+    """
+    values = np.asarray(values)
+    starts = np.searchsorted(np.asarray(times, dtype=np.float64), np.asarray(window_start_times, dtype=np.float64))
+    is_valid = starts + window_length <= len(values)
+    indices = np.where(is_valid, starts, 0)[:, None] + np.arange(window_length)[None, :]
+    windows = values[np.minimum(indices, max(0, len(values) - 1))] if len(values) > 0 else \
+        np.zeros(indices.shape + values.shape[1:], dtype=values.dtype)
+    windows[~is_valid] = 0
+    return windows, is_valid
+
+
+def get_average_fps(times):
+    """ Average sample frequency of sorted timestamps, 1.0 for less than two samples """
+    times = np.asarray(times, dtype=np.float64)
+    return (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 else 1.0
+
+
+def estimate_by_windows(times, values, window_start_times, window_length, estimate):
+    """
+    Estimates a value of every window of the signal, windows are gathered at once, see `get_windows_by_times`.
+    :param estimate: function of (windows, window_length, ...) array of windows which fit into the signal, returns
+        an array of their values
+    :return: float64 array of values of windows, NaN for windows which do not fit into the signal
+    """
+    windows, is_valid = get_windows_by_times(times, values, window_start_times, window_length)
+    result = np.full((len(is_valid),), np.nan)
+    if is_valid.any():
+        result[is_valid] = estimate(windows[is_valid])
+    return result
+
+
+def get_in_range_prefix_sums(values, value_range):
+    """
+    Index of a signal to get means of its values within `value_range` over any sample range in O(1),
+    e.g. of plausible HR values of a per-sample HR signal.
+    :param values: 1D signal values
+    :param value_range: (value_min, value_max) range of values to take, inclusive
+    :return: (prefix_sums, prefix_counts) - float64 and int64 arrays of `len(values) + 1` sums and counts
+        of in-range values before every sample
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(-1)
+    is_in_range = (values >= value_range[0]) & (values <= value_range[1])
+    prefix_sums = np.zeros((len(values) + 1,), dtype=np.float64)
+    prefix_counts = np.zeros((len(values) + 1,), dtype=np.int64)
+    np.cumsum(np.where(is_in_range, values, 0.), out=prefix_sums[1:])
+    np.cumsum(is_in_range, out=prefix_counts[1:])
+    return prefix_sums, prefix_counts
+
+
+def get_in_range_means(prefix_sums, prefix_counts, starts, ends):
+    """
+    Means of in-range values over many sample ranges at once, see `get_in_range_prefix_sums`.
+    :param starts: first sample indices of ranges
+    :param ends: sample indices after the last samples of ranges, ranges are clipped to the signal
+    :return: (means, counts) - float64 array of means, NaN for ranges without in-range values, and int64 array
+        of counts of in-range values
+    """
+    samples_count = len(prefix_counts) - 1
+    starts = np.clip(np.asarray(starts, dtype=np.int64), 0, samples_count)
+    ends = np.clip(np.asarray(ends, dtype=np.int64), starts, samples_count)
+    counts = prefix_counts[ends] - prefix_counts[starts]
+    sums = prefix_sums[ends] - prefix_sums[starts]
+    means = np.full(counts.shape, np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return means, counts
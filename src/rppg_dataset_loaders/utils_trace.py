@@ -0,0 +1,132 @@
+""" Reduction of video frames to spatial means of regions (traces) """
+
+import numpy
+
+
+def as_frames_array(frames):
+    """ :return: (frames, height, width, channels) array of frames given as array or list, gray frames included """
+    frames = numpy.asarray(frames)
+    if frames.ndim == 3:
+        frames = frames[..., None]
+    return frames
+
+
+def get_grid_bounds(length, cells_count):
+    """ :return: bounds of `cells_count` nearly equal cells along an axis of `length` pixels """
+    if not 0 < cells_count <= length:
+        raise ValueError(f'{cells_count} cells do not fit into {length} pixels')
+    return numpy.round(numpy.linspace(0, length, cells_count + 1)).astype(numpy.int64)
+
+
+def get_regions_count(crop_rects=None, grid=None, masks=None, polygons=None):
+    if polygons is not None:
+        return len(polygons)
+    if crop_rects is not None:
+        return len(crop_rects)
+    if grid is not None:
+        return grid[0] * grid[1]
+    if masks is not None:
+        return len(masks)
+    return 1
+
+
+def get_area_downscaled(frames, size):
+    """ Downscales frames to (width, height) `size` by exact means of grid cells, as float32 array """
+    frames = as_frames_array(frames)
+    row_bounds = get_grid_bounds(frames.shape[1], size[1])
+    col_bounds = get_grid_bounds(frames.shape[2], size[0])
+    sums = numpy.add.reduceat(frames, row_bounds[:-1], axis=1, dtype=numpy.float64)
+    sums = numpy.add.reduceat(sums, col_bounds[:-1], axis=2)
+    areas = numpy.outer(numpy.diff(row_bounds), numpy.diff(col_bounds))
+    return (sums / areas[None, :, :, None]).astype(numpy.float32)
+
+
+def get_polygon_masks(polygons, height, width):
+    """
+    Rasterizes (polygons, points, 2) vertices into (polygons, height, width) masks by the even-odd rule at once:
+    masks are parities of counts of edge crossings left of pixel centers. Undefined vertices give empty masks.
+    """
+    polygons = numpy.asarray(polygons, dtype=numpy.float64)
+    polygons_count, points_count = polygons.shape[:2]
+    is_defined = numpy.isfinite(polygons).all(axis=(1, 2))
+    if points_count < 3 or not is_defined.any() or height == 0 or width == 0:
+        return numpy.zeros((polygons_count, height, width), dtype=bool)
+    polygons = numpy.where(is_defined[:, None, None], polygons, 0.)
+    xa, ya = polygons[:, :, 0, None], polygons[:, :, 1, None]  # (polygons, edges, 1)
+    next_polygons = numpy.roll(polygons, -1, axis=1)
+    xb, yb = next_polygons[:, :, 0, None], next_polygons[:, :, 1, None]
+    py = numpy.arange(height, dtype=numpy.float64)[None, None, :]
+    crosses = (ya > py) != (yb > py)  # (polygons, edges, height), horizontal edges are never crossed
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        x_cross = xa + (py - ya) * (xb - xa) / (yb - ya)
+    # pixels `px < x_cross` are toggled, i.e. pixels before `ceil(x_cross)`
+    toggle_ends = numpy.clip(numpy.ceil(numpy.where(crosses, x_cross, 0.)), 0, width).astype(numpy.int64)
+    is_toggling = crosses & (toggle_ends > 0) & is_defined[:, None, None]
+    polygon_indices, _, row_indices = numpy.nonzero(is_toggling)
+    toggle_indices = (polygon_indices * height + row_indices) * (width + 1) + toggle_ends[is_toggling]
+    # only parities of counts matter, so they are summed as uint8 wrapping around
+    toggles = numpy.bincount(toggle_indices, minlength=polygons_count * height * (width + 1)).\
+        astype(numpy.uint8).reshape(polygons_count, height, width + 1)
+    # count of crossings toggling pixel `px` is the count of toggle ends after it
+    crossings_counts = numpy.cumsum(toggles[:, :, ::-1], axis=2, dtype=numpy.uint8)[:, :, -2::-1]
+    return (crossings_counts & 1).view(bool)
+
+
+def get_polygon_means(frames, polygons, batch_elements_count=1 << 24):
+    """ :return: (frames, regions, channels) means of per-frame (frames, points, 2) polygons, NaN for empty ones """
+    frames_count, height, width, channels_count = frames.shape
+    means = numpy.full((frames_count, len(polygons), channels_count), numpy.nan, dtype=numpy.float32)
+    vertices = numpy.concatenate([numpy.asarray(region_polygons, dtype=numpy.float64).reshape(-1, 2)
+                                  for region_polygons in polygons] + [numpy.zeros((0, 2))])
+    vertices = vertices[numpy.isfinite(vertices).all(axis=1)]
+    if len(vertices) == 0:
+        return means
+    x_start, y_start = numpy.maximum(0, numpy.ceil(vertices.min(axis=0))).astype(numpy.int64)
+    x_end = min(width, int(numpy.floor(vertices[:, 0].max())) + 1)
+    y_end = min(height, int(numpy.floor(vertices[:, 1].max())) + 1)
+    if x_end <= x_start or y_end <= y_start:
+        return means
+    box_size = (y_end - y_start) * (x_end - x_start)
+    batch_frames_count = max(1, batch_elements_count // (len(polygons) * box_size))
+    for batch_start in range(0, frames_count, batch_frames_count):
+        batch_end = min(frames_count, batch_start + batch_frames_count)
+        masks = numpy.stack([get_polygon_masks(numpy.asarray(region_polygons[batch_start: batch_end]) -
+                                               [x_start, y_start], y_end - y_start, x_end - x_start)
+                             for region_polygons in polygons], axis=1)
+        weights = masks.reshape(batch_end - batch_start, len(polygons), box_size).astype(numpy.float32)
+        pixels = frames[batch_start: batch_end, y_start: y_end, x_start: x_end].\
+            reshape(batch_end - batch_start, box_size, channels_count).astype(numpy.float32)
+        sums = numpy.einsum('frp,fpc->frc', weights, pixels, optimize=True)
+        areas = weights.sum(axis=2)[:, :, None]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            means[batch_start: batch_end] = sums / areas  # empty masks give NaN means
+    return means
+
+
+def get_spatial_means(frames, crop_rects=None, grid=None, masks=None, polygons=None):
+    """ :return: (frames, regions, channels) float32 means of regions, the whole frame if no regions are given """
+    frames = as_frames_array(frames)
+    frames_count, height, width, channels_count = frames.shape
+    if polygons is not None:
+        return get_polygon_means(frames, polygons)
+    if crop_rects is not None:
+        means = [frames[:, rect['y']: rect['y'] + rect['h'], rect['x']: rect['x'] + rect['w']].
+                 mean(axis=(1, 2), dtype=numpy.float64) for rect in crop_rects]
+        return numpy.stack(means, axis=1).astype(numpy.float32)
+    if grid is not None:
+        means = get_area_downscaled(frames, (grid[1], grid[0]))
+        return means.reshape(frames_count, grid[0] * grid[1], channels_count)
+    if masks is not None:
+        masks = numpy.asarray(masks, dtype=numpy.float32)
+        # only the bounding box of all masks is reduced
+        rows = numpy.flatnonzero(masks.any(axis=(0, 2)))
+        cols = numpy.flatnonzero(masks.any(axis=(0, 1)))
+        if len(rows) == 0:
+            return numpy.full((frames_count, len(masks), channels_count), numpy.nan, dtype=numpy.float32)
+        y_slice, x_slice = slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+        weights = masks[:, y_slice, x_slice].reshape(len(masks), -1)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            weights = weights / weights.sum(axis=1, keepdims=True)  # empty masks give NaN means
+        pixels = frames[:, y_slice, x_slice].reshape(frames_count, -1, channels_count).astype(numpy.float32)
+        return numpy.matmul(weights, pixels)
+    return frames.mean(axis=(1, 2), dtype=numpy.float64)[:, None, :].astype(numpy.float32)
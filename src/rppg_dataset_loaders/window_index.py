@@ -0,0 +1,150 @@
+""" Global index of sliding windows of sessions of one or many datasets, e.g. for samplers of training """
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from .ds_title import DSTitle
+
+
+def get_session_windows(session, window, stride, min_quality=None):
+    """
+    :return: (sync_times, frame_indices) of starts of windows within `vs_cross` range and of the first video frames
+        at or after them, of quality not below `min_quality`, if it is set
+    """
+    if not session.get_is_valid():
+        return numpy.zeros((0,), dtype=numpy.float64), numpy.zeros((0,), dtype=numpy.int64)
+    sync_times = session.get_window_sync_times(window, stride)
+    if min_quality is not None and len(sync_times) > 0:
+        _, quality = session.get_signal_quality_series(window, stride)
+        sync_times = sync_times[quality >= min_quality]  # NaN quality is not above any threshold
+    video_channel = session.get_video_channel()
+    frame_sync_times = video_channel.get_time_array() + float(video_channel.get_sync_time_offset())
+    frame_indices = numpy.searchsorted(frame_sync_times, sync_times, side='left').astype(numpy.int64)
+    is_covered = frame_indices < len(frame_sync_times)
+    return sync_times[is_covered], frame_indices[is_covered]
+
+
+class WindowIndex(object):
+    """
+    Index of sliding windows of sessions of many datasets, kept in flat arrays: global window index maps to
+    dataset, session, first video frame and sync time of the window by a binary search over sessions.
+    """
+
+    # private
+
+    def _prv_get_session_positions(self, window_indices):
+        window_indices = numpy.asarray(window_indices, dtype=numpy.int64)
+        if numpy.any((window_indices < 0) | (window_indices >= self.get_windows_count())):
+            raise IndexError(f'window index is out of range [0, {self.get_windows_count()})')
+        return numpy.searchsorted(self.session_window_offsets, window_indices, side='right') - 1
+
+    # public
+
+    def __init__(self, window, stride, ds_titles, session_ds_indices, session_keys, session_window_offsets,
+                 window_sync_times, window_frame_indices):
+        self.window = float(window)
+        self.stride = float(stride)
+        self.ds_titles = [DSTitle(ds_title) for ds_title in ds_titles]
+        self.session_ds_indices = numpy.asarray(session_ds_indices, dtype=numpy.int16)
+        self.session_keys = list(session_keys)
+        self.session_window_offsets = numpy.asarray(session_window_offsets, dtype=numpy.int64)
+        self.window_sync_times = numpy.asarray(window_sync_times, dtype=numpy.float64)
+        self.window_frame_indices = numpy.asarray(window_frame_indices, dtype=numpy.int64)
+
+    @staticmethod
+    def build(dataset_loaders, window, stride, min_quality=None, max_workers=8):
+        """ Finds windows of all valid sessions of the datasets, sessions are probed in parallel threads """
+        session_probes = [(ds_index, dataset_loader, session_key)
+                          for ds_index, dataset_loader in enumerate(dataset_loaders)
+                          for session_key in dataset_loader.get_session_keys()]
+
+        def probe_session(session_probe):
+            # sessions are instantiated and validated in the workers, invalid ones are skipped
+            _, dataset_loader, session_key = session_probe
+            session = dataset_loader.get_session_by_key(session_key)
+            if session is None:
+                return None
+            return get_session_windows(session, window, stride, min_quality)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            probed_windows = list(executor.map(probe_session, session_probes))
+        session_ds_indices = []
+        session_keys = []
+        session_windows = []
+        for (ds_index, _, session_key), windows in zip(session_probes, probed_windows):
+            if windows is None:
+                continue
+            session_ds_indices.append(ds_index)
+            session_keys.append(session_key)
+            session_windows.append(windows)
+        windows_counts = [len(sync_times) for sync_times, _ in session_windows]
+        session_window_offsets = numpy.concatenate([[0], numpy.cumsum(windows_counts, dtype=numpy.int64)])
+        return WindowIndex(window, stride, [dataset_loader.get_ds_title() for dataset_loader in dataset_loaders],
+                           session_ds_indices, session_keys, session_window_offsets,
+                           numpy.concatenate([[]] + [sync_times for sync_times, _ in session_windows]),
+                           numpy.concatenate([numpy.zeros((0,), dtype=numpy.int64)] +
+                                             [frame_indices for _, frame_indices in session_windows]))
+
+    @staticmethod
+    def load(path):
+        """ Loads index saved by `save` """
+        with numpy.load(path, allow_pickle=False) as index_file:
+            return WindowIndex(float(index_file['window']), float(index_file['stride']),
+                               [str(ds_title) for ds_title in index_file['ds_titles']],
+                               index_file['session_ds_indices'],
+                               [str(session_key) for session_key in index_file['session_keys']],
+                               index_file['session_window_offsets'], index_file['window_sync_times'],
+                               index_file['window_frame_indices'])
+
+    def save(self, path):
+        """ Saves index into `.npz` file, without pickled objects """
+        numpy.savez(path, window=self.window, stride=self.stride,
+                    ds_titles=numpy.asarray([ds_title.value for ds_title in self.ds_titles], dtype=str),
+                    session_ds_indices=self.session_ds_indices,
+                    session_keys=numpy.asarray(self.session_keys, dtype=str),
+                    session_window_offsets=self.session_window_offsets,
+                    window_sync_times=self.window_sync_times, window_frame_indices=self.window_frame_indices)
+
+    def get_windows_count(self):
+        return int(self.session_window_offsets[-1])
+
+    def get_sessions_count(self):
+        return len(self.session_keys)
+
+    def get_window(self, window_index):
+        """ :return: dict with `ds_title`, `session_key`, `frame_index` and `sync_time` keys of the window """
+        session_position = int(self._prv_get_session_positions(window_index))
+        return {
+            'ds_title':     self.ds_titles[self.session_ds_indices[session_position]],
+            'session_key':  self.session_keys[session_position],
+            'frame_index':  int(self.window_frame_indices[window_index]),
+            'sync_time':    float(self.window_sync_times[window_index]),
+        }
+
+    def get_windows(self, window_indices):
+        """
+        :return: dict with `ds_index`, `session_position`, `frame_index` and `sync_time` arrays of windows, positions
+            are in `ds_titles` and `session_keys`
+        """
+        session_positions = self._prv_get_session_positions(window_indices)
+        return {
+            'ds_index':         self.session_ds_indices[session_positions],
+            'session_position': session_positions,
+            'frame_index':      self.window_frame_indices[window_indices],
+            'sync_time':        self.window_sync_times[window_indices],
+        }
+
+    def get_session_window_range(self, session_position):
+        """ :return: (window_index_start, windows_count) of windows of the session """
+        window_index_start = int(self.session_window_offsets[session_position])
+        return window_index_start, int(self.session_window_offsets[session_position + 1]) - window_index_start
+
+    def get_session(self, window_index, dataset_loaders):
+        """ :return: session of the window, from the loader of its dataset, None if there is no such loader """
+        window = self.get_window(window_index)
+        dataset_loader = next((dataset_loader for dataset_loader in dataset_loaders
+                               if dataset_loader.get_ds_title() == window['ds_title']), None)
+        if dataset_loader is None:
+            return None
+        return dataset_loader.get_session_by_key(window['session_key'])
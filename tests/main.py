@@ -1,10 +1,15 @@
 import pprint
 import argparse
 import pathlib
+import importlib.util
+
+import numpy
 
 from src.rppg_dataset_loaders import loader_dccsfedu, loader_ubfc, loader_mahnob, \
-    loader_deap, loader_viplhr, DSTitle
+    loader_deap, loader_viplhr, DSTitle, utils_ekg
+from src.rppg_dataset_loaders.hr_cache import HRCache
 from src.rppg_dataset_loaders.loader_base import TimestampAlignment
+from src.rppg_dataset_loaders.window_index import WindowIndex
 
 
 def test_video_channel(video_channel):
@@ -25,6 +30,73 @@ def test_video_channel(video_channel):
     assert img_shape[1] == vres['width']
     assert img_shape[0] == vres['height']
 
+    # parallel segmented decoding must be frame-identical to the serial one
+    frames_count = min(video_channel.get_frames_count(), 600)
+    frames_serial = video_channel._get_frames(0, frames_count)
+    video_channel.decode_segments_count = 4
+    frames_parallel = video_channel._get_frames(0, frames_count)
+    video_channel.decode_segments_count = 1
+    assert len(frames_serial) == len(frames_parallel)
+    assert all(numpy.array_equal(fs['data'], fp['data']) for fs, fp in zip(frames_serial, frames_parallel))
+
+    # streamed trace must match means of decoded frames
+    trace = video_channel.get_trace(0, 60, grid=(2, 2))
+    print("      > Trace Shape:", trace.shape)
+    frames_means = numpy.asarray([f['data'].mean(axis=(0, 1)) for f in frames_serial[:60]])
+    assert numpy.allclose(trace.mean(axis=1), frames_means, atol=0.5)
+
+    # crops of a single decode must match crops of frames of a channel with a crop rect
+    video_channel.purge_resources()
+    video_channel.crop_rect = {'x': 8, 'y': 8, 'w': vres['width'] // 2, 'h': vres['height'] // 2}
+    crop_rects = [{'x': 0, 'y': 0, 'w': 16, 'h': 16}, {'x': 10, 'y': 12, 'w': 20, 'h': 8}]
+    roi_frames = video_channel.get_roi_frames(0, 30, crop_rects)
+    frames = numpy.asarray([f['data'] for f in video_channel.get_frames(0, 30)])
+    for rect, rect_frames in zip(crop_rects, roi_frames):
+        rect_means = frames[:, rect['y']: rect['y'] + rect['h'], rect['x']: rect['x'] + rect['w']].mean(axis=(0, 1, 2))
+        assert numpy.allclose(rect_frames.mean(axis=(0, 1, 2)), rect_means)
+    video_channel.purge_resources()
+    video_channel.crop_rect = None
+
+
+def get_synthetic_ecg(sampling_frequency, duration, hr, seed=0):
+    """ ECG of Gaussian P, Q, R, S and T waves at beats with jittered R-R intervals, baseline wander and noise """
+    rng = numpy.random.default_rng(seed)
+    times = numpy.arange(int(duration * sampling_frequency)) / sampling_frequency
+    beats = numpy.cumsum(60. / hr * (1. + rng.normal(0., 0.03, int(duration * hr / 60.) + 2)))
+    beats = beats[beats < duration - 1.]
+    offsets = times[None, :] - beats[:, None]
+    waves = [(-0.16, 0.025, 0.15), (-0.025, 0.008, -0.1), (0., 0.01, 1.), (0.03, 0.01, -0.2), (0.3, 0.05, 0.3)]
+    ecg = sum(amplitude * numpy.exp(-0.5 * numpy.square((offsets - offset) / width))
+              for offset, width, amplitude in waves).sum(axis=0)
+    ecg += 0.3 * numpy.sin(2 * numpy.pi * 0.2 * times) + rng.normal(0., 0.05, len(times))
+    return ecg, numpy.round(beats * sampling_frequency).astype(numpy.int64)
+
+
+def get_peak_distances(peaks, reference_peaks):
+    """ :return: distances from each peak to its nearest reference peak, in samples """
+    return numpy.abs(peaks[:, None] - reference_peaks[None, :]).min(axis=1)
+
+
+def test_qrs_detectors():
+    print("QRS DETECTORS")
+    for sampling_frequency, hr in ((256, 70), (512, 110)):
+        ecg, r_peaks = get_synthetic_ecg(sampling_frequency, 60., hr)
+        peaks_native = utils_ekg.detect_qrs_peaks(sampling_frequency, ecg)
+        print("  > R-peaks:", len(r_peaks), "native:", len(peaks_native))
+        # the native detector must find every known R-peak, and only them, within a few samples
+        tolerance = int(round(0.02 * sampling_frequency))
+        assert len(peaks_native) == len(r_peaks)
+        assert get_peak_distances(peaks_native, r_peaks).max() <= tolerance
+        assert get_peak_distances(r_peaks, peaks_native).max() <= tolerance
+        # mne is optional; each of its peaks must be one of them too, it may miss a few beats
+        if importlib.util.find_spec('mne') is None:
+            print("  > mne is not installed, skipped")
+            continue
+        peaks_mne = utils_ekg.detect_qrs_peaks_mne(sampling_frequency, ecg)
+        print("  > mne:", len(peaks_mne))
+        assert len(peaks_mne) >= 0.9 * len(r_peaks)
+        assert get_peak_distances(peaks_mne, peaks_native).max() <= tolerance
+
 
 def test_session(loader, session):
     print("  > SESSION:", session.__class__.__name__)
@@ -53,6 +125,22 @@ def test_session(loader, session):
     else:
         print("    > Estimated HR:", hr)
 
+    sync_times, hr_series = session.get_estimated_hr_series(12.0, 1.0, 1.0, 18.0)
+    print("    > Estimated HR series:", hr_series)
+    if hr is not None:
+        assert abs(hr_series[0] - hr) < 3.0
+
+    _, quality_series = session.get_signal_quality_series(12.0, 1.0, 1.0, 18.0)
+    print("    > Signal quality series:", quality_series)
+    assert quality_series.shape == hr_series.shape
+    assert numpy.all(numpy.isnan(quality_series) | ((quality_series >= 0.0) & (quality_series <= 1.0)))
+
+    # cached HR must be the same, and the second call must be served by the cache
+    session.hr_cache = HRCache()
+    assert session.get_estimated_hr_by_sync_time(1.0, 12.0) == hr
+    assert session.hr_cache.get(session.get_hr_cache_key(), 1.0, 12.0) == (hr, True)
+    session.hr_cache = None
+
     ppg = session.get_ppg_channel()
     print("    > PPG CHANNEL:", ppg.__class__.__name__)
     if ppg is None:
@@ -60,6 +148,8 @@ def test_session(loader, session):
     else:
         ppg_data = ppg.get_frame_by_index(7)
         print("      > data:", ppg_data)
+        print("      > HR by peaks:", session.get_ppg_hr_by_peaks_by_sync_time(1.0, 12.0))
+        print("      > HRV:", session.get_ppg_hrv_metrics_by_sync_time(1.0, 12.0))
 
 
 def test_loader(loader):
@@ -76,6 +166,8 @@ def test_loader(loader):
 def main(dir_datasets: str):
     pp = pprint.PrettyPrinter(indent=2)
 
+    test_qrs_detectors()  # synthetic signals, no datasets are needed
+
     path_datasets = pathlib.Path(dir_datasets)
     if not path_datasets.exists():
         raise FileNotFoundError(f'Wrong path for `dir_datasets`: {path_datasets}')
@@ -85,6 +177,9 @@ def main(dir_datasets: str):
     fc = s1.get_ppg_channel()
     fc.get_frames_count()
     fr = fc.get_frames(1, 1)
+    # the finger PPG signal must match the per-pixel mean of `green` component of decoded frames
+    frames_means = numpy.asarray([f['data'][:, :, 1].mean() for f in fc.get_frames(0, 60)])
+    assert numpy.allclose(fc.get_ppg_signal()[:60], frames_means, atol=1e-3)
     vc = s1.get_video_channel()
     fr = vc.get_frames(1, 1)
     rd = s1.get_raw_metadata()
@@ -98,6 +193,15 @@ def main(dir_datasets: str):
     sc1 = s1._prv_get_ground_truth_channel()
     cd1 = sc1.get_channel_data()
     test_loader(loader)
+    # HR series must be the batched form of HR by single windows
+    sync_times, hr_series = s1.get_estimated_hr_series(10.0, 2.0)
+    assert numpy.array_equal(hr_series, [s1.get_estimated_hr_by_sync_time(float(sync_time), 10.0)
+                                         for sync_time in sync_times])
+    window_index = WindowIndex.build([loader], 10.0, 5.0)
+    window = window_index.get_window(window_index.get_windows_count() - 1)
+    assert window['session_key'] == loader.get_session_keys()[-1]
+    assert window_index.get_session(0, [loader]).get_video_channel().get_sync_time_from_frame_index(
+        window_index.get_window(0)['frame_index']) >= window_index.get_window(0)['sync_time'] - 1e-6
 
     # RePSS datasets are not used after the competition
     # loader = loader_repss_train.REPSS_TRAINDatasetLoader(path_datasets / DSTitle.RePSS_Train.value)
@@ -132,6 +236,12 @@ def main(dir_datasets: str):
     end_time = start_time + total_duration_time
     start_frame = camera.get_frame_index_from_sync_time(start_time, alignment=TimestampAlignment.RIGHT)
     end_frame = camera.get_frame_index_from_sync_time(end_time)
+    # the native QRS detector must agree with mne on real ECG
+    exg = session.get_channel('bdf', {'channel_key': 'EXG1'})
+    peaks_native = utils_ekg.detect_qrs_peaks(exg.get_sample_frequency(), exg.get_data_array())
+    peaks_mne = utils_ekg.detect_qrs_peaks_mne(exg.get_sample_frequency(), exg.get_data_array())
+    assert abs(utils_ekg.get_hr_by_peaks(exg.get_sample_frequency(), peaks_native) -
+               utils_ekg.get_hr_by_peaks(exg.get_sample_frequency(), peaks_mne)) < 3.
     test_loader(loader)
 
     loader = loader_deap.DEAPDatasetLoader(path_datasets / DSTitle.DEAP.value)